@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+'''
+analyze-vacuum-benchmark.py
+* Copyright 2015, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+Benchmarks the candidate queries of the Analyze Vacuum Utility against a catalog of many tables. The table statistics
+snapshot is read for each of a number of schemas, first with the query parameters interpolated into the statement
+text, so that every schema's statements are parsed and planned afresh, and then as prepared statements with
+parameters, which the driver reuses across schemas on the same connection.
+'''
+import os
+import sys
+
+# add the lib directory to the sys path
+try:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+except:
+    pass
+
+import getopt
+import time
+import analyze_vacuum
+import config_constants
+
+OK = 0
+ERROR = 1
+INVALID_ARGS = 2
+
+SCHEMA_PREFIX = 'av_benchmark_'
+
+prepared_execute_query = analyze_vacuum.execute_query
+
+
+def usage(with_message=None):
+    print('Usage: analyze-vacuum-benchmark.py')
+    print('       Benchmarks the interpolated and prepared candidate queries of the Analyze Vacuum Utility\n')
+
+    if with_message is not None:
+        print(with_message + "\n")
+
+    print('Arguments: --db                 - The Database to Use')
+    print('           --db-user            - The Database User to connect to')
+    print('           --db-pwd             - The Password for the Database User to connect to')
+    print('           --db-host            - The Cluster endpoint')
+    print('           --db-port            - The Cluster endpoint port : Default = 5439')
+    print('           --require-ssl        - Does the connection require SSL? (True | False)')
+    print('           --tables             - Number of tables in the benchmark catalog : Default = 10000')
+    print('           --schemas            - Number of schemas the tables are spread across : Default = 100')
+    print('           --iterations         - Number of times the snapshot of each schema is read : Default = 3')
+    print('           --setup              - Create the benchmark schemas and tables (True | False) : Default = True')
+    print('           --cleanup            - Drop the benchmark schemas and tables (True | False) : Default = False')
+
+    sys.exit(INVALID_ARGS)
+
+
+def get_literal(value):
+    if isinstance(value, (int, float)):
+        return str(value)
+    else:
+        return "'%s'" % str(value).replace("'", "''")
+
+
+def interpolated_execute_query(conn, query, params=None):
+    # run a query with its parameters interpolated into the statement text, as the utility previously did
+    if params is not None:
+        query = query % tuple(get_literal(p) for p in params)
+
+    return prepared_execute_query(conn, query)
+
+
+def setup(conn, tables, schemas):
+    analyze_vacuum.comment("Creating %s Tables in %s Schemas..." % (tables, schemas))
+    cursor = conn.cursor()
+
+    for s in range(schemas):
+        cursor.execute('CREATE SCHEMA IF NOT EXISTS %s%03d' % (SCHEMA_PREFIX, s))
+
+    for t in range(tables):
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s%03d.t_%05d (id INTEGER, val VARCHAR(10)) SORTKEY (id)' % (
+            SCHEMA_PREFIX, t % schemas, t))
+
+    analyze_vacuum.comment("Created Benchmark Catalog")
+
+
+def cleanup(conn, schemas):
+    cursor = conn.cursor()
+
+    for s in range(schemas):
+        cursor.execute('DROP SCHEMA IF EXISTS %s%03d CASCADE' % (SCHEMA_PREFIX, s))
+
+    analyze_vacuum.comment("Dropped Benchmark Catalog")
+
+
+def run_benchmark(connect, execute_query, schemas, iterations):
+    # read the snapshot of each schema on a new connection, so that no prepared statements are cached at the start
+    conn = connect()
+    analyze_vacuum.execute_query = execute_query
+
+    timings = []
+    try:
+        for i in range(iterations):
+            for s in range(schemas):
+                start = time.time()
+                analyze_vacuum.get_table_snapshot(conn, '^%s%03d$' % (SCHEMA_PREFIX, s), load_interleaved=True,
+                                                  load_last_analyzed=True)
+                timings.append(time.time() - start)
+    finally:
+        analyze_vacuum.execute_query = prepared_execute_query
+        analyze_vacuum.cleanup(conn)
+
+    timings.sort()
+    return {'snapshots': len(timings), 'seconds': sum(timings), 'mean_ms': 1000 * sum(timings) / len(timings),
+            'p50_ms': 1000 * timings[len(timings) // 2], 'p95_ms': 1000 * timings[int(len(timings) * 0.95)],
+            'max_ms': 1000 * max(timings)}
+
+
+def main(argv):
+    supported_args = """db= db-user= db-pwd= db-host= db-port= require-ssl= tables= schemas= iterations= setup= cleanup="""
+
+    # extract the command line arguments
+    try:
+        optlist, remaining = getopt.getopt(argv[1:], "", supported_args.split())
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+
+    args = {config_constants.DB_NAME: os.environ.get('PGDATABASE'),
+            config_constants.DB_USER: os.environ.get('PGUSER'),
+            config_constants.DB_PASSWORD: os.environ.get('PGPASSWORD'),
+            config_constants.DB_HOST: os.environ.get('PGHOST'),
+            config_constants.DB_PORT: os.environ.get('PGPORT', 5439)}
+    ssl = True
+    tables = 10000
+    schemas = 100
+    iterations = 3
+    do_setup = True
+    do_cleanup = False
+
+    # parse command line arguments
+    for arg, value in optlist:
+        if arg == "--db":
+            args[config_constants.DB_NAME] = value
+        elif arg == "--db-user":
+            args[config_constants.DB_USER] = value
+        elif arg == "--db-pwd":
+            args[config_constants.DB_PASSWORD] = value
+        elif arg == "--db-host":
+            args[config_constants.DB_HOST] = value
+        elif arg == "--db-port":
+            args[config_constants.DB_PORT] = int(value)
+        elif arg == "--require-ssl":
+            ssl = value.upper() == 'TRUE' or value == '1'
+        elif arg == "--tables":
+            tables = int(value)
+        elif arg == "--schemas":
+            schemas = int(value)
+        elif arg == "--iterations":
+            iterations = int(value)
+        elif arg == "--setup":
+            do_setup = value.upper() == 'TRUE' or value == '1'
+        elif arg == "--cleanup":
+            do_cleanup = value.upper() == 'TRUE' or value == '1'
+        else:
+            usage("Unsupported Argument " + arg)
+
+    for required in [config_constants.DB_NAME, config_constants.DB_USER, config_constants.DB_HOST]:
+        if args[required] is None:
+            usage("Missing Parameter '%s'" % required)
+
+    def connect():
+        conn = analyze_vacuum.get_pg_conn(args[config_constants.DB_HOST], args[config_constants.DB_NAME],
+                                          args[config_constants.DB_USER], args[config_constants.DB_PASSWORD],
+                                          'public', args[config_constants.DB_PORT], ssl=ssl)
+
+        if conn is None:
+            raise Exception("No Connection was established")
+
+        return conn
+
+    if do_setup:
+        conn = connect()
+        setup(conn, tables, schemas)
+        analyze_vacuum.cleanup(conn)
+
+    results = [('interpolated', run_benchmark(connect, interpolated_execute_query, schemas, iterations)),
+               ('prepared', run_benchmark(connect, prepared_execute_query, schemas, iterations))]
+
+    print('%-14s %10s %10s %10s %10s %10s %10s' % ('Queries', 'Snapshots', 'Seconds', 'Mean ms', 'p50 ms', 'p95 ms',
+                                                   'Max ms'))
+    for name, r in results:
+        print('%-14s %10s %10.2f %10.1f %10.1f %10.1f %10.1f' % (name, r['snapshots'], r['seconds'], r['mean_ms'],
+                                                                r['p50_ms'], r['p95_ms'], r['max_ms']))
+
+    if do_cleanup:
+        conn = connect()
+        cleanup(conn, schemas)
+        analyze_vacuum.cleanup(conn)
+
+    sys.exit(OK)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
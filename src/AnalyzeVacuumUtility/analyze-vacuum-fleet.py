@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+'''
+analyze-vacuum-fleet.py
+* Copyright 2015, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+Runs the Analyze Vacuum Utility against each of a list of cluster and database targets, with clusters run concurrently,
+and writes a consolidated report of the run.
+'''
+import os
+import sys
+
+# add the lib directory to the sys path
+try:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+except:
+    pass
+
+import getopt
+import json
+import analyze_vacuum_fleet
+
+OK = 0
+ERROR = 1
+INVALID_ARGS = 2
+
+
+def usage(with_message=None):
+    print('Usage: analyze-vacuum-fleet.py')
+    print('       Runs vacuum AND/OR analyze on a list of cluster and database targets\n')
+
+    if with_message is not None:
+        print(with_message + "\n")
+
+    print('Arguments: --targets-file       - JSON file of the default configuration and the configuration of each target')
+    print('           --max-concurrency    - Maximum number of clusters to run at the same time : Default = 1')
+    print('           --log-dir            - Directory of the log of each target : Default = the temp directory')
+    print('           --report-file        - Path of the consolidated JSON report : Default = in the log directory')
+
+    sys.exit(INVALID_ARGS)
+
+
+def main(argv):
+    supported_args = """targets-file= max-concurrency= log-dir= report-file="""
+
+    # extract the command line arguments
+    try:
+        optlist, remaining = getopt.getopt(argv[1:], "", supported_args.split())
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage()
+
+    targets_file = None
+    max_concurrency = 1
+    log_dir = None
+    report_file = None
+
+    # parse command line arguments
+    for arg, value in optlist:
+        if arg == "--targets-file":
+            targets_file = value
+        elif arg == "--max-concurrency":
+            if value != '' and value is not None:
+                max_concurrency = int(value)
+        elif arg == "--log-dir":
+            if value != '' and value is not None:
+                log_dir = value
+        elif arg == "--report-file":
+            if value != '' and value is not None:
+                report_file = value
+        else:
+            usage("Unsupported Argument " + arg)
+
+    if targets_file is None or targets_file == '':
+        usage("Missing Parameter 'targets-file'")
+
+    with open(targets_file, 'r') as f:
+        targets = analyze_vacuum_fleet.get_targets(json.load(f))
+
+    if len(targets) == 0:
+        usage("No targets configured in %s" % targets_file)
+
+    summary = analyze_vacuum_fleet.run_fleet(targets, max_concurrency, log_dir, report_file)
+
+    if len([t for t in summary['targets'] if t['status'] != analyze_vacuum_fleet.OK]) > 0:
+        sys.exit(ERROR)
+    else:
+        sys.exit(OK)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
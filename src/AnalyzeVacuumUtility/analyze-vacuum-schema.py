@@ -88,7 +88,7 @@ def usage(with_message=None):
     print('           --query_group        - Set the query_group for all queries')
     print('           --analyze-flag       - Flag to turn ON/OFF ANALYZE functionality (True or False) : Default = True ')
     print('           --vacuum-flag        - Flag to turn ON/OFF VACUUM functionality (True or False) :  Default = True')
-    print('           --vacuum-parameter   - Vacuum parameters [ FULL | SORT ONLY | DELETE ONLY | REINDEX ] Default = FULL')
+    print('           --vacuum-parameter   - Vacuum parameters [ FULL | SORT ONLY | DELETE ONLY | REINDEX | ADAPTIVE ] Default = FULL')
     print('           --min-unsorted-pct   - Minimum unsorted percentage(%) to consider a table for vacuum : Default = 5%')
     print('           --max-unsorted-pct   - Maximum unsorted percentage(%) to consider a table for vacuum : Default = 50%')
     print('           --stats-off-pct      - Minimum stats off percentage(%) to consider a table for analyze : Default = 10%')
@@ -97,12 +97,19 @@ def usage(with_message=None):
     print('           --min-interleaved-skew   - Minimum index skew to consider a table for vacuum reindex: Default = 1.4')
     print('           --min-interleaved-cnt   - Minimum stv_interleaved_counts records to consider a table for vacuum reindex: Default = 0')
     print('           --suppress-cloudwatch   - Don\'t emit CloudWatch metrics for analyze or vacuum when set to True')
+    print('           --analyze-parallelism   - Number of connections used to run analyze statements concurrently : Default = 1')
+    print('           --time-budget           - Minutes within which to run the vacuum and analyze statements of greatest benefit')
+    print('           --duration-model        - Path of the file in which the vacuum and analyze duration model is persisted')
+    print('           --analyze-interval      - Skip analyze of tables which were analyzed within this many minutes')
+    print('           --vacuum-progress-interval - Report the progress of each vacuum every this many seconds')
+    print('           --analyze-used-cols  - Analyze only the columns used by recent queries whose statistics are stale')
+    print('           --min-vacuum-benefit-pct - Minimum unsorted and deleted percentage(%) to run an ADAPTIVE vacuum : Default = 5%')
 
     sys.exit(INVALID_ARGS)
 
 
 def main(argv):
-    supported_args = """db= db-user= db-pwd= db-host= db-port= schema-name= table-name= blacklisted-tables= suppress-cloudwatch= require-ssl= debug= output-file= slot-count= ignore-errors= query_group= analyze-flag= vacuum-flag= vacuum-parameter= min-unsorted-pct= max-unsorted-pct= stats-off-pct= predicate-cols= max-table-size-mb= min-interleaved-skew= min-interleaved-cnt="""
+    supported_args = """db= db-user= db-pwd= db-host= db-port= schema-name= table-name= blacklisted-tables= suppress-cloudwatch= require-ssl= debug= output-file= slot-count= ignore-errors= query_group= analyze-flag= vacuum-flag= vacuum-parameter= min-unsorted-pct= max-unsorted-pct= stats-off-pct= predicate-cols= max-table-size-mb= min-interleaved-skew= min-interleaved-cnt= analyze-parallelism= time-budget= duration-model= analyze-interval= vacuum-progress-interval= analyze-used-cols= min-vacuum-benefit-pct="""
 
     # extract the command line arguments
     try:
@@ -212,6 +219,29 @@ def main(argv):
         elif arg == "--min-interleaved-cnt":
             if value != '' and value is not None:
                 args[config_constants.MIN_INTERLEAVED_COUNT] = value
+        elif arg == "--analyze-parallelism":
+            if value != '' and value is not None:
+                args[config_constants.ANALYZE_PARALLELISM] = int(value)
+        elif arg == "--time-budget":
+            if value != '' and value is not None:
+                args[config_constants.TIME_BUDGET] = value
+        elif arg == "--duration-model":
+            if value != '' and value is not None:
+                args[config_constants.DURATION_MODEL] = value
+        elif arg == "--analyze-interval":
+            if value != '' and value is not None:
+                args[config_constants.ANALYZE_INTERVAL] = value
+        elif arg == "--vacuum-progress-interval":
+            if value != '' and value is not None:
+                args[config_constants.VACUUM_PROGRESS_INTERVAL] = value
+        elif arg == "--analyze-used-cols":
+            if value.upper() == 'TRUE' or value == '1':
+                args[config_constants.ANALYZE_USED_COLS] = True
+            else:
+                args[config_constants.ANALYZE_USED_COLS] = False
+        elif arg == "--min-vacuum-benefit-pct":
+            if value != '' and value is not None:
+                args[config_constants.MIN_VACUUM_BENEFIT_PCT] = value
         else:
             usage("Unsupported Argument " + arg)
 
@@ -5,6 +5,9 @@ import os
 import re
 import socket
 import sys
+import tempfile
+import threading
+import time
 import traceback
 import socket
 import boto3
@@ -19,6 +22,7 @@ except:
 
 import aws_utils
 import config_constants
+import duration_model
 
 __version__ = ".9.1.6"
 
@@ -29,6 +33,17 @@ query_rank = 25
 # timeout for retries - 100ms
 RETRY_TIMEOUT = 100 / 1000
 
+# number of days of queries from which the columns used by each table are found
+USED_COLUMNS_DAYS = -7
+
+# vacuum parameter which selects the vacuum of each table from its statistics
+ADAPTIVE_VACUUM = 'ADAPTIVE'
+
+# kinds of work in a maintenance plan
+VACUUM_WORK = duration_model.VACUUM
+REINDEX_WORK = duration_model.REINDEX
+ANALYZE_WORK = duration_model.ANALYZE
+
 OK = 0
 ERROR = 1
 INVALID_ARGS = 2
@@ -39,9 +54,15 @@ NO_CONNECTION = 5
 debug = False
 
 
-def execute_query(conn, query):
+def execute_query(conn, query, params=None):
+    # queries with parameters are run as prepared statements, which the driver caches on each connection by their
+    # text, so that a query run for many schemas or tables is only parsed and planned once
     cursor = conn.cursor()
-    cursor.execute(query)
+
+    if params is not None:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
     try:
         results = cursor.fetchall()
 
@@ -146,18 +167,181 @@ def get_pg_conn(db_host, db, db_user, db_pwd, schema_name, db_port=5439, query_g
     return conn
 
 
-def run_commands(conn, commands, cw=None, cluster_name=None, suppress_errors=False):
+def parse_interval(interval):
+    # convert an interval such as '1h 5m 10s' from svv_vacuum_progress into seconds
+    if interval is None:
+        return None
+
+    parts = re.findall('(\\d+)\\s*([hms])', interval)
+    if len(parts) == 0:
+        return None
+
+    return sum(int(v) * {'h': 3600, 'm': 60, 's': 1}[u] for v, u in parts)
+
+
+class VacuumMonitor(object):
+    # polls the progress of the vacuum running on another connection from svv_vacuum_progress, reporting its phase,
+    # percent complete, rows per second and time remaining, and cancels the vacuum if it is projected to finish after
+    # the deadline
+    def __init__(self, conn, vacuum_pid, cw=None, cluster_name=None, interval=60, snapshot=None):
+        self.conn = conn
+        self.vacuum_pid = vacuum_pid
+        self.cw = cw
+        self.cluster_name = cluster_name
+        self.interval = interval
+        self.snapshot = snapshot
+        self.deadline = None
+        self.metrics = []
+        self.aborted = False
+        self.thread = None
+
+    def start(self, statement):
+        match = re.match('vacuum\\s+.*?([^\\s".]+)\\."?([^\\s"]+)"?(\\s+to\\s+\\d+\\s+percent)?\\s*;', statement,
+                         re.IGNORECASE)
+        self.table = (match.group(1), match.group(2)) if match is not None else (None, None)
+        self.started = time.time()
+        self.polls = 0
+        self.overruns = 0
+        self.aborted = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+        try:
+            self.summarise()
+        except Exception as e:
+            comment("Unable to extract Vacuum Summary: %s" % e)
+
+        self.flush()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                comment("Unable to extract Vacuum Progress: %s" % e)
+
+    def poll(self):
+        progress = execute_query(self.conn, "SELECT TRIM(table_name), TRIM(status), TRIM(time_remaining_estimate) "
+                                            "FROM svv_vacuum_progress")
+
+        if progress is None or len(progress) == 0 or progress[0][0] != self.table[1]:
+            return
+
+        self.polls += 1
+        phase = progress[0][1]
+        elapsed = time.time() - self.started
+        remaining = parse_interval(progress[0][2])
+
+        if remaining is None:
+            comment("Vacuum of %s.%s : %s after %.0f seconds" % (self.table[0], self.table[1], phase, elapsed))
+            return
+
+        pct_complete = 100.0 * elapsed / (elapsed + remaining) if elapsed + remaining > 0 else 100.0
+
+        rows = None
+        if self.snapshot is not None and self.table in self.snapshot['tables']:
+            rows = self.snapshot['tables'][self.table]['rows']
+        rows_per_second = float(rows) * pct_complete / 100 / elapsed if rows is not None and elapsed > 0 else None
+
+        comment("Vacuum of %s.%s : %s, %.0f%% complete, %s rows/s, %s seconds remaining" % (
+            self.table[0], self.table[1], phase, pct_complete,
+            '%.0f' % rows_per_second if rows_per_second is not None else 'unknown', remaining))
+
+        self.add_metric('VacuumPercentComplete', pct_complete, 'Percent')
+        self.add_metric('VacuumSecondsRemaining', remaining, 'Seconds')
+        if rows_per_second is not None:
+            self.add_metric('VacuumRowsPerSecond', rows_per_second, 'Count/Second')
+
+        # a single estimate may be unreliable at the start of a vacuum, so the vacuum is only cancelled once it has
+        # been projected to overrun on more than one poll
+        if self.deadline is not None and time.time() + remaining > self.deadline and self.polls > 1:
+            self.overruns += 1
+        else:
+            self.overruns = 0
+
+        if self.overruns > 1 and not self.aborted:
+            comment("Cancelling Vacuum of %s.%s which is projected to finish %.0f seconds after the Time Budget" % (
+                self.table[0], self.table[1], time.time() + remaining - self.deadline))
+            self.aborted = True
+            execute_query(self.conn, "SELECT pg_cancel_backend(%s)", (self.vacuum_pid,))
+
+    def summarise(self):
+        # report the rows sorted per second over the whole vacuum from svv_vacuum_summary
+        summary = execute_query(self.conn, """SELECT elapsed_time, row_delta, sortedrow_delta
+                                              FROM svv_vacuum_summary
+                                              WHERE TRIM(table_name) = %s
+                                              ORDER BY xid DESC
+                                              LIMIT 1""", (self.table[1],))
+
+        if summary is not None and len(summary) > 0 and summary[0][0] is not None and summary[0][0] > 0:
+            seconds = float(summary[0][0]) / 1000000
+            sorted_rows = float(summary[0][2]) if summary[0][2] is not None else 0.0
+            comment("Vacuum of %s.%s sorted %.0f rows in %.0f seconds at %.0f rows/s" % (
+                self.table[0], self.table[1], sorted_rows, seconds, sorted_rows / seconds))
+            self.add_metric('VacuumSortedRowsPerSecond', sorted_rows / seconds, 'Count/Second')
+
+    def add_metric(self, metric_name, value, unit):
+        if self.cw is None or self.cluster_name is None:
+            return
+
+        self.metrics.append({'MetricName': metric_name,
+                             'Dimensions': [{'Name': 'ClusterIdentifier', 'Value': self.cluster_name},
+                                            {'Name': 'TableName', 'Value': '%s.%s' % self.table}],
+                             'Timestamp': datetime.datetime.utcnow(),
+                             'Value': value,
+                             'Unit': unit})
+
+        if len(self.metrics) >= 20:
+            self.flush()
+
+    def flush(self):
+        if len(self.metrics) > 0:
+            try:
+                aws_utils.emit_metrics(self.cw, 'Redshift', self.metrics)
+            except Exception as e:
+                comment("Unable to emit Vacuum Progress Metrics: %s" % e)
+
+            self.metrics = []
+
+
+def run_commands(conn, commands, cw=None, cluster_name=None, suppress_errors=False, monitor=None):
     for idx, c in enumerate(commands, start=1):
         if c is not None:
             comment('[%s] Running %s out of %s commands: %s' % (str(os.getpid()), idx, len(commands), c))
+            monitored = monitor is not None and c.lower().startswith('vacuum')
             try:
                 cursor = conn.cursor()
-                cursor.execute(c)
+
+                if monitored:
+                    monitor.start(c)
+
+                try:
+                    cursor.execute(c)
+                finally:
+                    if monitored:
+                        monitor.stop()
+
                 comment('Success.')
             except:
                 # cowardly bail on errors
                 conn.rollback()
                 print(traceback.format_exc())
+
+                # a vacuum cancelled by the monitor isn't an error, and the run continues with the next statement
+                if monitored and monitor.aborted:
+                    comment('Vacuum cancelled as it was projected to overrun the Time Budget')
+                    continue
+
                 if not suppress_errors:
                     raise
 
@@ -181,6 +365,451 @@ def run_commands(conn, commands, cw=None, cluster_name=None, suppress_errors=Fal
     return True
 
 
+def run_parallel_commands(connections, commands, cw=None, cluster_name=None, suppress_errors=False):
+    # run the commands concurrently, with one worker thread per connection taking the next command to run until all
+    # have been run. Returns the outcome of each command as (command, succeeded, elapsed seconds)
+    commands = [c for c in commands if c is not None]
+    results = []
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def next_command():
+        with lock:
+            if len(commands) == 0 or (failed.is_set() and not suppress_errors):
+                return None
+            return commands.pop(0)
+
+    def worker(conn):
+        c = next_command()
+        while c is not None:
+            start_time = time.time()
+            try:
+                run_commands(conn, [c], cw=cw, cluster_name=cluster_name)
+                succeeded = True
+            except:
+                succeeded = False
+                failed.set()
+
+            with lock:
+                results.append((c, succeeded, time.time() - start_time))
+
+            c = next_command()
+
+    threads = [threading.Thread(target=worker, args=(conn,)) for conn in connections]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
+
+def run_analyze_commands(conn, analyze_conns, commands, cw, cluster_name, ignore_errors):
+    # run the analyze commands serially on the supplied connection, or concurrently on the analyze connection pool
+    if analyze_conns is None or len(analyze_conns) < 2:
+        return run_commands(conn, commands, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors)
+
+    results = run_parallel_commands(analyze_conns, commands, cw=cw, cluster_name=cluster_name,
+                                    suppress_errors=ignore_errors)
+
+    failed = [r[0] for r in results if not r[1]]
+    comment("Analyzed %s Tables on %s connections in %.1f seconds of analyze time, %s failed" % (
+        len(results) - len(failed), len(analyze_conns), sum(r[2] for r in results), len(failed)))
+
+    if debug:
+        for r in results:
+            comment("%s : %s in %.1f seconds" % (r[0], 'Succeeded' if r[1] else 'Failed', r[2]))
+
+    if len(failed) > 0 and not ignore_errors:
+        raise Exception("Analyze failed for %s" % str(failed))
+
+    return True
+
+
+def dense_rank(counts):
+    # rank the keys of a dictionary of counts in descending order of their count, with ties sharing the same rank
+    ranks = {}
+    for i, count in enumerate(sorted(set(counts.values()), reverse=True), start=1):
+        ranks[count] = i
+
+    return dict((k, ranks[v]) for k, v in counts.items())
+
+
+def get_table_snapshot(conn, schema_name='public', table_name=None, load_alerts=False, load_interleaved=False,
+                       load_last_analyzed=False, load_used_columns=False):
+    # read the table statistics from svv_table_info, and optionally the query alert and interleaved sort key
+    # statistics, the time each table was last analyzed and the columns used by recent queries, once for the whole
+    # run, so that all candidate tables for vacuum and analyze can be selected from memory. Tables are keyed by
+    # (schema, table). The tables analyzed in this run and the analyze statements skipped as redundant are also
+    # recorded in the snapshot
+    snapshot = {'tables': {}, 'vacuum_alert_rank': {}, 'interleaved': {}, 'last_analyzed': {}, 'analyzed': {},
+                'skipped_analyze': {}, 'used_columns': None, 'skipped_vacuum': {}}
+
+    comment("Extracting Table Statistics...")
+    statement = '''SELECT TRIM("schema"), TRIM("table"), "size", unsorted, stats_off, skew_rows, table_id, tbl_rows,
+                          estimated_visible_rows
+                   FROM svv_table_info
+                   WHERE TRIM("schema") ~ %s
+                '''
+    params = (schema_name,)
+
+    if table_name is not None:
+        statement = statement + ''' AND TRIM("table") = %s
+                '''
+        params = (schema_name, table_name)
+
+    if debug:
+        comment(statement)
+        comment('Parameters: %s' % str(params))
+
+    for row in execute_query(conn, statement, params):
+        snapshot['tables'][(row[0], row[1])] = {'schema': row[0],
+                                                'table': row[1],
+                                                'size': row[2],
+                                                'unsorted': row[3],
+                                                'stats_off': row[4],
+                                                'skew_rows': row[5],
+                                                'table_id': row[6],
+                                                'rows': row[7],
+                                                'visible_rows': row[8]}
+
+    comment("Found Statistics for %s Tables" % len(snapshot['tables']))
+
+    if load_alerts:
+        # count the alerts recommending a vacuum for each table over the lookback window
+        comment("Extracting Query Alerts...")
+        statement = '''SELECT TRIM(n.nspname) schema_name,
+                              TRIM(c.relname) table_name,
+                              COUNT(*)
+                       FROM stl_alert_event_log AS l
+                         JOIN (SELECT query,
+                                      tbl,
+                                      perm_table_name
+                               FROM stl_scan
+                               WHERE perm_table_name <> 'Internal Worktable'
+                               GROUP BY query,
+                                        tbl,
+                                        perm_table_name) AS s ON s.query = l.query
+                         JOIN pg_class c ON c.oid = s.tbl
+                         JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                       WHERE l.userid > 1
+                       AND   l.event_time >= dateadd(DAY,CAST(%s AS INTEGER),CURRENT_DATE)
+                       AND   regexp_instr(solution,'.*VACUUM.*reclaim deleted.') > 0
+                       GROUP BY TRIM(n.nspname),
+                                TRIM(c.relname)
+                    '''
+
+        if debug:
+            comment(statement)
+
+        alert_counts = {}
+        for row in execute_query(conn, statement, (goback_no_of_days,)):
+            alert_counts[(row[0], row[1])] = row[2]
+
+        snapshot['vacuum_alert_rank'] = dense_rank(alert_counts)
+
+    if load_interleaved:
+        comment("Extracting Interleaved Sort Key Statistics...")
+        statement = '''SELECT TRIM(n.nspname) schema_name, TRIM(t.relname) table_name,
+                              MAX(v.interleaved_skew) max_skew, MAX(NVL(v.interleaved_skew,10)) max_skew_or_default,
+                              MAX(c.count) AS rows, MAX(c.max_bucket) AS max_bucket
+                       FROM svv_interleaved_columns v
+                       JOIN (SELECT tbl,col, max(compressed_val) AS max_bucket,  SUM(count) AS count
+                             FROM stv_interleaved_counts
+                             GROUP BY tbl,col) c
+                       ON (v.tbl = c.tbl AND v.col = c.col)
+                       JOIN pg_class t ON t.oid = c.tbl
+                       JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
+                       WHERE TRIM(n.nspname) ~ %s
+                       GROUP BY 1, 2
+                    '''
+
+        if debug:
+            comment(statement)
+
+        for row in execute_query(conn, statement, (schema_name,)):
+            snapshot['interleaved'][(row[0], row[1])] = {'max_skew': row[2],
+                                                         'max_skew_or_default': row[3],
+                                                         'rows': row[4],
+                                                         'max_bucket': row[5]}
+
+    if load_last_analyzed:
+        comment("Extracting Analyze History...")
+        statement = '''SELECT TRIM(n.nspname), TRIM(c.relname), MAX(a.endtime)
+                       FROM stl_analyze a
+                       JOIN pg_class c ON c.oid = a.table_id
+                       JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                       WHERE a.status <> 'Skipped'
+                       AND   TRIM(n.nspname) ~ %s
+                       GROUP BY 1, 2
+                    '''
+
+        if debug:
+            comment(statement)
+
+        for row in execute_query(conn, statement, (schema_name,)):
+            snapshot['last_analyzed'][(row[0], row[1])] = row[2]
+
+    if load_used_columns:
+        snapshot['used_columns'] = get_used_columns(conn, schema_name, table_name)
+
+    return snapshot
+
+
+def get_used_columns(conn, schema_name, table_name=None):
+    # find the columns of each table used in filters and join conditions of queries over the lookback window, from
+    # the plans in stl_explain, and which of them haven't been analyzed since the table was last modified, from the
+    # predicate column statistics in pg_statistic as in AdminScripts/predicate_columns.sql and the latest insert or
+    # delete in stl_insert and stl_delete. Returns the stale used columns, the used columns and the number of columns
+    # of each table with used columns, keyed by (schema, table)
+    comment("Extracting Columns used by Recent Queries...")
+    statement = '''SELECT DISTINCT TRIM(SPLIT_PART(TRIM(scan.plannode), ' on ', 2)), TRIM(cond.info)
+                   FROM stl_explain scan
+                   JOIN stl_explain cond ON cond.query = scan.query
+                   JOIN stl_query q ON q.query = scan.query
+                   WHERE scan.plannode LIKE '%%Scan on %%'
+                   AND   (cond.info LIKE '%%Filter:%%' OR cond.info LIKE '%%Cond:%%')
+                   AND   q.userid > 1
+                   AND   q.starttime >= dateadd(DAY,CAST(%s AS INTEGER),CURRENT_DATE)
+                '''
+
+    if debug:
+        comment(statement)
+
+    # the identifiers in the conditions of the queries which scanned each table
+    identifiers = {}
+    for row in execute_query(conn, statement, (USED_COLUMNS_DAYS,)):
+        scanned = re.match('"?([^\\s"]+)"?', row[0]) if row[0] is not None else None
+
+        if scanned is not None and row[1] is not None:
+            identifiers.setdefault(scanned.group(1), set()).update(
+                i.lower() for i in re.findall('[A-Za-z_][A-Za-z0-9_$]*', row[1]))
+
+    statement = '''SELECT TRIM(ns.nspname), TRIM(c.relname), TRIM(a.attname),
+                          CASE WHEN 10002 = s.stakind1 THEN array_to_string(stavalues1, '||')
+                               WHEN 10002 = s.stakind2 THEN array_to_string(stavalues2, '||')
+                               WHEN 10002 = s.stakind3 THEN array_to_string(stavalues3, '||')
+                               WHEN 10002 = s.stakind4 THEN array_to_string(stavalues4, '||')
+                               ELSE NULL::varchar
+                          END AS pred_ts,
+                          c.oid
+                   FROM pg_attribute a
+                   JOIN pg_class c ON c.oid = a.attrelid
+                   JOIN pg_namespace ns ON c.relnamespace = ns.oid
+                   LEFT JOIN pg_statistic s ON s.starelid = a.attrelid AND s.staattnum = a.attnum
+                   WHERE a.attnum > 0
+                   AND   NOT a.attisdropped
+                   AND   c.relkind = 'r'
+                   AND   TRIM(ns.nspname) ~ %s
+                '''
+    params = (schema_name,)
+
+    if table_name is not None:
+        statement = statement + ''' AND TRIM(c.relname) = %s
+                '''
+        params = (schema_name, table_name)
+
+    statement = statement + ''' ORDER BY 1, 2, a.attnum'''
+
+    if debug:
+        comment(statement)
+        comment('Parameters: %s' % str(params))
+
+    columns = {}
+    table_ids = {}
+    for row in execute_query(conn, statement, params):
+        # the predicate timestamps are the first use as a predicate and the last analyze, where 2000-01-01 is unset
+        last_analyze = None
+        if row[3] is not None and len(row[3].split('||')) > 1 and not row[3].split('||')[1].startswith('2000-01-01'):
+            last_analyze = datetime.datetime.strptime(row[3].split('||')[1][:19], '%Y-%m-%d %H:%M:%S')
+
+        columns.setdefault((row[0], row[1]), []).append((row[2], last_analyze))
+        table_ids[(row[0], row[1])] = row[4]
+
+    # the time each table was last modified, as far as the system tables retain it
+    statement = '''SELECT tbl, MAX(endtime)
+                   FROM (SELECT tbl, endtime FROM stl_insert
+                         UNION ALL
+                         SELECT tbl, endtime FROM stl_delete)
+                   GROUP BY tbl
+                '''
+
+    if debug:
+        comment(statement)
+
+    last_modified = dict((row[0], row[1]) for row in execute_query(conn, statement))
+
+    used_columns = {}
+    for key, table_columns in columns.items():
+        if key[1] not in identifiers:
+            continue
+
+        used = [c for c in table_columns if c[0].lower() in identifiers[key[1]]]
+        if len(used) > 0:
+            modified = last_modified.get(table_ids[key])
+            stale = [c[0] for c in used if c[1] is None or (modified is not None and c[1] < modified)]
+            used_columns[key] = (stale, [c[0] for c in used], len(table_columns))
+
+    comment("Found Columns used by Recent Queries on %s Tables" % len(used_columns))
+
+    return used_columns
+
+
+def skip_analyze(snapshot, table_info, analyze_interval=None):
+    # determine whether an analyze of the table is redundant, as it has already been analyzed in this run, or within
+    # the last analyze_interval minutes. stl_analyze records times in UTC
+    key = (table_info['schema'], table_info['table'])
+
+    reason = None
+    if key in snapshot['skipped_analyze']:
+        return True
+    elif key in snapshot['analyzed']:
+        reason = 'already analyzed in this run'
+    elif analyze_interval is not None and key in snapshot['last_analyzed'] and snapshot['last_analyzed'][
+            key] >= datetime.datetime.utcnow() - datetime.timedelta(minutes=float(analyze_interval)):
+        reason = 'analyzed at %s' % snapshot['last_analyzed'][key]
+
+    if reason is not None:
+        comment("Skipping analyze of %s.%s, %s" % (key[0], key[1], reason))
+        snapshot['skipped_analyze'][key] = (reason, table_info['size'])
+        return True
+    else:
+        return False
+
+
+def mark_analyzed(snapshot, table_info):
+    key = (table_info['schema'], table_info['table'])
+
+    if key not in snapshot['skipped_analyze']:
+        snapshot['analyzed'][key] = datetime.datetime.utcnow()
+
+    table_info['stats_off'] = 0
+
+
+def report_skipped_analyze(snapshot):
+    skipped = snapshot['skipped_analyze'].values()
+
+    if len(skipped) > 0:
+        comment("Skipped %s redundant analyze statements on %s MB of tables, %s already analyzed in this run" % (
+            len(skipped), sum(s[1] for s in skipped if s[1] is not None),
+            len([s for s in skipped if s[0] == 'already analyzed in this run'])))
+
+
+def get_threshold(threshold):
+    # thresholds may be supplied as numbers, or as strings which can also be products such as 700*1024
+    try:
+        return float(threshold)
+    except ValueError:
+        value = 1.0
+        for factor in threshold.split('*'):
+            value = value * float(factor)
+
+        return value
+
+
+def exceeds(value, threshold):
+    # compare a statistic to a threshold, where a missing statistic never exceeds it
+    return value is not None and value > get_threshold(threshold)
+
+
+def below(value, threshold):
+    return value is not None and value < get_threshold(threshold)
+
+
+def nulls_last(value):
+    return value is None, value
+
+
+def get_candidates(snapshot, blacklisted_tables=None, condition=None):
+    # return the tables in the snapshot which aren't blacklisted and meet the condition, smallest first
+    blacklist = blacklisted_tables.split(',') if blacklisted_tables is not None else []
+
+    candidates = [t for t in snapshot['tables'].values() if
+                  t['table'] not in blacklist and (condition is None or condition(t))]
+
+    return sorted(candidates, key=lambda t: (nulls_last(t['size']), nulls_last(t['skew_rows'])))
+
+
+def get_deleted_pct(table_info):
+    # the percentage of the rows of a table which are marked for deletion, and whose space a vacuum would reclaim
+    if table_info.get('rows') is None or table_info.get('visible_rows') is None or float(table_info['rows']) <= 0:
+        return None
+
+    return max(0.0, 100 * (1 - float(table_info['visible_rows']) / float(table_info['rows'])))
+
+
+def get_adaptive_vacuum_parameter(table_info, min_unsorted_pct, min_vacuum_benefit_pct):
+    # select the cheapest vacuum which sorts or reclaims the table, as the vacuum mode and the TO n PERCENT target of
+    # the vacuum, or None if the rows it would sort and reclaim are below the benefit threshold. The target lets the
+    # vacuum skip the phase if the table has reached the threshold by the time it runs, and stop once it has
+    unsorted = float(table_info['unsorted']) if table_info['unsorted'] is not None else 0.0
+    deleted = get_deleted_pct(table_info) or 0.0
+
+    if unsorted + deleted < get_threshold(min_vacuum_benefit_pct):
+        return None
+
+    needs_sort = unsorted >= get_threshold(min_unsorted_pct)
+    needs_delete = deleted >= get_threshold(min_vacuum_benefit_pct)
+
+    if needs_sort and needs_delete:
+        return 'FULL', None
+
+    # when only one of the phases is needed, or neither is on its own but together they are worth a vacuum, the phase
+    # which does the most is run on its own
+    if needs_sort or (not needs_delete and unsorted >= deleted):
+        return 'SORT ONLY', min(max(int(100 - get_threshold(min_unsorted_pct)), 0), 100)
+    else:
+        return 'DELETE ONLY', min(max(int(100 - get_threshold(min_vacuum_benefit_pct)), 0), 100)
+
+
+def get_vacuum_statement(vacuum_parameter, table_info, with_stats_off=True, to_percent=None):
+    # the TO n PERCENT target follows the table name in the vacuum grammar
+    statement = 'vacuum %s %s."%s"%s ; /* Size : %s MB, Unsorted_pct : %s' % (
+        vacuum_parameter, table_info['schema'], table_info['table'],
+        ' TO %d PERCENT' % to_percent if to_percent is not None else '', table_info['size'],
+        table_info['unsorted'] if table_info['unsorted'] is not None else 'null')
+
+    if get_deleted_pct(table_info) is not None:
+        statement = statement + ', Deleted_pct : %.2f' % get_deleted_pct(table_info)
+
+    if with_stats_off:
+        statement = statement + ', Stats Off : %s' % table_info['stats_off']
+
+    return statement + ' */ ;'
+
+
+def report_skipped_vacuum(snapshot):
+    skipped = snapshot['skipped_vacuum'].values()
+
+    if len(skipped) > 0:
+        comment("Skipped %s vacuum statements below the benefit threshold on %s MB of tables" % (
+            len(skipped), sum(s for s in skipped if s is not None)))
+
+
+def get_analyze_statement(predicate_cols_option, table_info, used_columns=None):
+    # analyze only the columns used by recent queries when they're known for the table, narrowed to those which are
+    # stale. The table was selected because its statistics are off, so if none of its used columns is known to be
+    # stale, all of them are analyzed
+    key = (table_info['schema'], table_info['table'])
+
+    if used_columns is not None and key in used_columns:
+        stale, used, total = used_columns[key]
+        columns = stale if len(stale) > 0 else used
+
+        return 'analyze %s."%s" (%s) ; /* Stats_Off : %s, Stale Used Columns : %s of %s Used, %s Total */ ;' % (
+            table_info['schema'], table_info['table'], ', '.join('"%s"' % c for c in columns), table_info['stats_off'],
+            len(stale), len(used), total)
+
+    return 'analyze %s."%s" %s ; /* Stats_Off : %s */ ;' % (
+        table_info['schema'], table_info['table'], predicate_cols_option, table_info['stats_off'])
+
+
+def work_item(kind, table_info, statements, alternative=None):
+    # a unit of maintenance work on a table for the time budget planner. The table statistics are copied as they are
+    # before the work is done, and a vacuum may carry an analyze statement to run instead if it doesn't fit the budget
+    return {'kind': kind, 'table': dict(table_info), 'statements': statements, 'alternative': alternative}
+
+
 def run_vacuum(conn,
                cluster_name,
                cw,
@@ -195,198 +824,173 @@ def run_vacuum(conn,
                max_table_size_mb=(700 * 1024),
                min_interleaved_skew=1.4,
                min_interleaved_count=0,
+               snapshot=None,
+               plan=None,
+               analyze_interval=None,
+               monitor=None,
+               min_vacuum_benefit_pct=5,
                **kwargs):
     statements = []
+    work = []
+    all_tables = table_name is None and blacklisted_tables is None
 
-    if table_name is not None:
-        get_vacuum_statement = '''SELECT 'vacuum %s ' + "schema" + '."' + "table" + '" ; '
-                                         + '/* Size : ' + CAST("size" AS VARCHAR(10)) + ' MB'
-                                         + ', Unsorted_pct : ' + coalesce(unsorted :: varchar(10),'null') 
-                                         + ', Stats Off : ' + stats_off :: varchar(10)
-                                         + ' */ ;' as statement,
-                                         "table" as table_name
-                                  FROM svv_table_info
-                                  WHERE (unsorted > %s or stats_off > %s)
-                                    AND   size < %s
-                                    AND  "schema" ~ '%s'
-                                    AND  "table" = '%s';
-                                        ''' % (
-            vacuum_parameter, min_unsorted_pct, stats_off_pct, max_table_size_mb, schema_name, table_name)
-
-    elif blacklisted_tables is not None:
-        comment("Extracting Candidate Tables for Vacuum...")
-        blacklisted_tables_array = blacklisted_tables.split(',')
-        get_vacuum_statement = '''SELECT 'vacuum %s ' + "schema" + '."' + "table" + '" ; '
-                                         + '/* Size : ' + CAST("size" AS VARCHAR(10)) + ' MB'
-                                         + ', Unsorted_pct : ' + coalesce(unsorted :: varchar(10),'null')
-                                         + ', Stats Off : ' + stats_off :: varchar(10)
-                                         + ' */ ;' as statement,
-                                         "table" as table_name
-                                  FROM svv_table_info
-                                  WHERE (unsorted > %s or stats_off > %s)
-                                    AND   size < %s
-                                    AND  "schema" ~ '%s'
-                                    AND  "table" NOT IN (%s);
-                                        ''' % (
-            vacuum_parameter, min_unsorted_pct, stats_off_pct, max_table_size_mb, schema_name,
-            str(blacklisted_tables_array)[1:-1])
+    if snapshot is None:
+        snapshot = get_table_snapshot(conn, schema_name, table_name, load_alerts=all_tables,
+                                      load_interleaved=all_tables, load_last_analyzed=analyze_interval is not None)
 
-    else:
-        # query for all tables in the schema ordered by size descending
+    def needs_delete(t):
+        # an adaptive vacuum can reclaim the deleted rows of a table which is sorted and has current statistics
+        return vacuum_parameter.upper() == ADAPTIVE_VACUUM and (get_deleted_pct(t) or 0.0) >= get_threshold(
+            min_vacuum_benefit_pct)
+
+    def needs_vacuum(t):
+        return (exceeds(t['unsorted'], min_unsorted_pct) or exceeds(t['stats_off'], stats_off_pct) or needs_delete(
+            t)) and below(t['size'], max_table_size_mb)
+
+    def get_vacuums(candidates, with_stats_off=True):
+        # the vacuum statement of each candidate, where an adaptive vacuum is selected from the statistics of each
+        # table, and candidates which wouldn't benefit enough are skipped
+        if vacuum_parameter.upper() != ADAPTIVE_VACUUM:
+            return [(t, get_vacuum_statement(vacuum_parameter, t, with_stats_off)) for t in candidates]
+
+        vacuums = []
+        for t in candidates:
+            parameter = get_adaptive_vacuum_parameter(t, min_unsorted_pct, min_vacuum_benefit_pct)
+
+            if parameter is None:
+                snapshot['skipped_vacuum'][(t['schema'], t['table'])] = t['size']
+
+                if debug:
+                    comment('Skipping vacuum of %s."%s" below the benefit threshold' % (t['schema'], t['table']))
+            else:
+                vacuums.append((t, get_vacuum_statement(parameter[0], t, with_stats_off, to_percent=parameter[1])))
+
+        return vacuums
+
+    if all_tables:
+        # tables flagged by the query alerts
         comment("Extracting Candidate Tables for Vacuum...")
+        candidates = get_candidates(snapshot, condition=lambda t: needs_vacuum(t) and snapshot['vacuum_alert_rank'].get(
+            (t['schema'], t['table']), query_rank) < query_rank)
+    else:
+        if blacklisted_tables is not None:
+            comment("Extracting Candidate Tables for Vacuum...")
 
-        get_vacuum_statement = '''
-                SELECT 'vacuum %s ' + feedback_tbl.schema_name + '."' + feedback_tbl.table_name + '" ; ' 
-                       + '/* Size : ' + CAST(info_tbl."size" AS VARCHAR(10)) + ' MB' 
-                       + ', Unsorted_pct : ' + coalesce(unsorted :: varchar(10),'null') 
-                       + ', Stats Off : ' + stats_off :: varchar(10)
-                       + ' */ ;' as statement,
-                       table_name
-                FROM (SELECT schema_name,
-                             table_name
-                      FROM (SELECT TRIM(n.nspname) schema_name,
-                                   TRIM(c.relname) table_name,
-                                   DENSE_RANK() OVER (ORDER BY COUNT(*) DESC) AS qry_rnk,
-                                   COUNT(*)
-                            FROM stl_alert_event_log AS l
-                              JOIN (SELECT query,
-                                           tbl,
-                                           perm_table_name
-                                    FROM stl_scan
-                                    WHERE perm_table_name <> 'Internal Worktable'
-                                    GROUP BY query,
-                                             tbl,
-                                             perm_table_name) AS s ON s.query = l.query
-                              JOIN pg_class c ON c.oid = s.tbl
-                              JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                            WHERE l.userid > 1
-                            AND   l.event_time >= dateadd(DAY,%s,CURRENT_DATE)
-                            AND   regexp_instr(solution,'.*VACUUM.*reclaim deleted.') > 0
-                            GROUP BY TRIM(n.nspname),
-                                     TRIM(c.relname)) anlyz_tbl
-                      WHERE anlyz_tbl.qry_rnk <%s) feedback_tbl
-                  JOIN svv_table_info info_tbl
-                    ON info_tbl.schema = feedback_tbl.schema_name
-                   AND info_tbl.table = feedback_tbl.table_name
-                WHERE (info_tbl.unsorted > %s OR info_tbl.stats_off > %s)
-                AND   info_tbl.size < %s
-                AND   TRIM(info_tbl.schema) ~ '%s'
-                ORDER BY info_tbl.size,
-                         info_tbl.skew_rows
-                            ''' % (vacuum_parameter,
-                                   goback_no_of_days,
-                                   query_rank,
-                                   min_unsorted_pct,
-                                   stats_off_pct,
-                                   max_table_size_mb,
-                                   schema_name)
+        candidates = get_candidates(snapshot, blacklisted_tables, needs_vacuum)
 
-    if debug:
-        comment(get_vacuum_statement)
+    vacuums = get_vacuums(candidates)
+    candidates = [t for t, vacuum_statement in vacuums]
+    comment("Found %s Tables requiring Vacuum and flagged by alert" % len(candidates))
 
-    vacuum_statements = execute_query(conn, get_vacuum_statement)
-    comment("Found %s Tables requiring Vacuum and flagged by alert" % len(vacuum_statements))
+    for t, vacuum_statement in vacuums:
+        analyze_statement = "analyze %s.\"%s\"" % (t['schema'], t['table'])
+        if skip_analyze(snapshot, t, analyze_interval):
+            analyze_statement = None
 
-    for vs in vacuum_statements:
-        statements.append(vs[0])
-        statements.append("analyze %s.\"%s\"" % (schema_name, vs[1]))
+        statements.extend([vacuum_statement, analyze_statement])
+        work.append(work_item(VACUUM_WORK, t, [vacuum_statement, analyze_statement],
+                              analyze_statement if exceeds(t['stats_off'], stats_off_pct) else None))
 
-    if not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors):
+    if plan is not None:
+        plan.extend(work)
+    elif not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors,
+                          monitor=monitor):
         if not ignore_errors:
             if debug:
                 print("Error running statements: %s" % (str(statements),))
             return ERROR
 
+    # the snapshot reflects the vacuumed and analyzed tables, so that they aren't selected again
+    for t in candidates:
+        t['unsorted'] = 0
+        t['visible_rows'] = t['rows']
+        mark_analyzed(snapshot, t)
+
     statements = []
-    if table_name is None and blacklisted_tables is None:
-        # query for all tables in the schema ordered by size descending
+    work = []
+    if all_tables:
         comment("Extracting Candidate Tables for Vacuum ...")
-        get_vacuum_statement = '''SELECT 'vacuum %s ' + "schema" + '."' + "table" + '" ; '
-                                                   + '/* Size : ' + CAST("size" AS VARCHAR(10)) + ' MB'
-                                                   + ',  Unsorted_pct : ' + coalesce(info_tbl.unsorted :: varchar(10),'N/A')
-                                                   + ' */ ;' as statement,
-                                         info_tbl."table" as table_name,
-                                         info_tbl."schema" as schema_name
-                                        FROM svv_table_info info_tbl
-                                        WHERE "schema" ~ '%s'
-                                                AND
-                                                 (
-                                                --If the size of the table is less than the max_table_size_mb then , run vacuum based on condition: >min_unsorted_pct
-                                                    ((size < %s) AND (unsorted > %s or stats_off > %s))
-                                                    OR
-                                                --If the size of the table is greater than the max_table_size_mb then , run vacuum based on condition:
-                                                -- >min_unsorted_pct AND < max_unsorted_pct
-                                                --This is to avoid big table with large unsorted_pct
-                                                     ((size > %s) AND (unsorted > %s AND unsorted < %s ))
-                                                 )
-                                        ORDER BY "size" ASC ,skew_rows ASC;
-                                        ''' % (vacuum_parameter,
-                                               schema_name,
-                                               max_table_size_mb,
-                                               min_unsorted_pct,
-                                               stats_off_pct,
-                                               max_table_size_mb,
-                                               min_unsorted_pct,
-                                               max_unsorted_pct)
-
-        if debug:
-            comment(get_vacuum_statement)
 
-        vacuum_statements = execute_query(conn, get_vacuum_statement)
-        comment("Found %s Tables requiring Vacuum due to stale statistics" % len(vacuum_statements))
-
-        for vs in vacuum_statements:
-            statements.append(vs[0])
-            statements.append("analyze %s.\"%s\"" % (vs[2], vs[1]))
-
-        if not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors):
+        def needs_vacuum_by_size(t):
+            # If the size of the table is less than the max_table_size_mb then , run vacuum based on condition:
+            # >min_unsorted_pct. If the size of the table is greater than the max_table_size_mb then , run vacuum based
+            # on condition: >min_unsorted_pct AND < max_unsorted_pct. This is to avoid big table with large
+            # unsorted_pct
+            return (below(t['size'], max_table_size_mb) and (
+                    exceeds(t['unsorted'], min_unsorted_pct) or exceeds(t['stats_off'], stats_off_pct) or
+                    needs_delete(t))) or (
+                           exceeds(t['size'], max_table_size_mb) and exceeds(t['unsorted'], min_unsorted_pct) and
+                           below(t['unsorted'], max_unsorted_pct))
+
+        vacuums = get_vacuums(get_candidates(snapshot, condition=needs_vacuum_by_size), with_stats_off=False)
+        candidates = [t for t, vacuum_statement in vacuums]
+        comment("Found %s Tables requiring Vacuum due to stale statistics" % len(candidates))
+
+        for t, vacuum_statement in vacuums:
+            analyze_statement = "analyze %s.\"%s\"" % (t['schema'], t['table'])
+            if skip_analyze(snapshot, t, analyze_interval):
+                analyze_statement = None
+
+            statements.extend([vacuum_statement, analyze_statement])
+            work.append(work_item(VACUUM_WORK, t, [vacuum_statement, analyze_statement],
+                                  analyze_statement if exceeds(t['stats_off'], stats_off_pct) else None))
+
+        if plan is not None:
+            plan.extend(work)
+        elif not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors,
+                              monitor=monitor):
             if not ignore_errors:
                 if debug:
                     print("Error running statements: %s" % (str(statements),))
                 return ERROR
 
+        for t in candidates:
+            t['unsorted'] = 0
+            t['visible_rows'] = t['rows']
+            mark_analyzed(snapshot, t)
+
     statements = []
-    if table_name is None and blacklisted_tables is None:
-        # query for all tables in the schema for vacuum reindex
+    work = []
+    if all_tables:
         comment("Extracting Candidate Tables for Vacuum reindex of Interleaved Sort Keys...")
-        get_vacuum_statement = ''' SELECT 'vacuum REINDEX ' + schema_name + '."' + table_name + '" ; ' + '/* Rows : ' + CAST("rows" AS VARCHAR(10))
-                                    + ', Interleaved_skew : ' + CAST("max_skew" AS VARCHAR(10))
-                                    + ', Reindex Flag : '  + CAST(reindex_flag AS VARCHAR(10)) + ' */ ;' AS statement, table_name, schema_name
-                                FROM (SELECT TRIM(n.nspname) schema_name, TRIM(t.relname) table_name,
-                                                 MAX(v.interleaved_skew) max_skew, MAX(c.count) AS rows,
-                                                 CASE
-                                                   -- v.interleaved_skew can be null if the table has never been vacuumed so account for that
-                                                   WHEN (max(c.max_bucket) = 0) OR (MAX(NVL(v.interleaved_skew,10)) > %s AND MAX(c.count) > %s) THEN 'Yes'
-                                                   ELSE 'No'
-                                                 END AS reindex_flag
-                                            FROM svv_interleaved_columns v
-                                            JOIN (SELECT tbl,col, max(compressed_val) AS max_bucket,  SUM(count) AS count
-                                                  FROM stv_interleaved_counts
-                                                  GROUP BY tbl,col) c
-                                            ON (v.tbl = c.tbl AND v.col = c.col)
-                                            JOIN pg_class t ON t.oid = c.tbl
-                                            JOIN pg_catalog.pg_namespace n ON n.oid = t.relnamespace
-                                            GROUP BY 1, 2)
-                                WHERE reindex_flag = 'Yes'
-                                    AND schema_name ~ '%s'
-                                        ''' % (min_interleaved_skew, min_interleaved_count, schema_name)
 
-        if debug:
-            comment(get_vacuum_statement)
-
-        vacuum_statements = execute_query(conn, get_vacuum_statement)
-        comment("Found %s Tables with Interleaved Sort Keys requiring Vacuum" % len(vacuum_statements))
-
-        for vs in vacuum_statements:
-            statements.append(vs[0])
-            statements.append("analyze %s.\"%s\"" % (vs[2], vs[1]))
-
-        if not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors):
+        reindex_tables = []
+        for key, i in sorted(snapshot['interleaved'].items()):
+            # the interleaved skew can be null if the table has never been vacuumed so account for that
+            if i['max_bucket'] == 0 or (exceeds(i['max_skew_or_default'], min_interleaved_skew) and exceeds(
+                    i['rows'], min_interleaved_count)):
+                reindex_tables.append(key)
+                reindex_statement = 'vacuum REINDEX %s."%s" ; /* Rows : %s, Interleaved_skew : %s, Reindex Flag : Yes */ ;' \
+                                    % (key[0], key[1], i['rows'],
+                                       i['max_skew'] if i['max_skew'] is not None else 'null')
+                table_info = snapshot['tables'][key] if key in snapshot['tables'] else {
+                    'schema': key[0], 'table': key[1], 'size': None, 'unsorted': None, 'stats_off': None,
+                    'skew_rows': None, 'table_id': None, 'rows': i['rows'], 'visible_rows': None}
+
+                analyze_statement = "analyze %s.\"%s\"" % key
+                if skip_analyze(snapshot, table_info, analyze_interval):
+                    analyze_statement = None
+
+                statements.extend([reindex_statement, analyze_statement])
+                work.append(work_item(REINDEX_WORK, table_info, [reindex_statement, analyze_statement]))
+
+        comment("Found %s Tables with Interleaved Sort Keys requiring Vacuum" % len(reindex_tables))
+
+        if plan is not None:
+            plan.extend(work)
+        elif not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors,
+                              monitor=monitor):
             if not ignore_errors:
                 if debug:
                     print("Error running statements: %s" % (str(statements),))
                 return ERROR
 
+        for key in reindex_tables:
+            del snapshot['interleaved'][key]
+
+            if key in snapshot['tables']:
+                mark_analyzed(snapshot, snapshot['tables'][key])
+
     return True
 
 
@@ -399,6 +1003,11 @@ def run_analyze(conn,
                 ignore_errors=False,
                 predicate_cols=False,
                 stats_off_pct=10,
+                analyze_conns=None,
+                snapshot=None,
+                plan=None,
+                analyze_interval=None,
+                analyze_used_cols=False,
                 **kwargs):
     statements = []
 
@@ -407,207 +1016,159 @@ def run_analyze(conn,
     else:
         predicate_cols_option = ' ALL COLUMNS '
 
-    if table_name is not None:
-        # If it is one table , just check if this needs to be analyzed and prepare analyze statements
-        get_analyze_statement_feedback = '''SELECT DISTINCT 'analyze ' + "schema" + '."' + "table" + '"' + '%s ; '
-                                                   + '/* Stats_Off : ' + CAST("stats_off" AS VARCHAR(10)) + ' */ ;'
-                                                FROM svv_table_info
-                                                WHERE   stats_off::DECIMAL (32,4) > %s ::DECIMAL (32,4)
-                                                AND  trim("schema") ~ '%s'
-                                                AND  trim("table") = '%s';
-                                                ''' % (predicate_cols_option, stats_off_pct, schema_name, table_name,)
-
-    elif blacklisted_tables is not None:
-        comment("Extracting Candidate Tables for analyze based on Query Optimizer Alerts...")
-
-        blacklisted_tables_array = blacklisted_tables.split(',')
-        get_analyze_statement_feedback = '''
-                                    SELECT DISTINCT 'analyze ' + feedback_tbl.schema_name + '."' + feedback_tbl.table_name + '"' + '%s ; ' + '/* Stats_Off : ' + CAST(info_tbl."stats_off" AS VARCHAR(10)) + ' */ ;'
-                                    FROM (/* Get top N rank tables based on the missing statistics alerts */
-                                         SELECT TRIM(n.nspname)::VARCHAR schema_name,
-                                                TRIM(c.relname)::VARCHAR table_name
-                                         FROM (SELECT TRIM(SPLIT_PART(SPLIT_PART(a.plannode,':',2),' ',2)) AS Table_Name,
-                                                      COUNT(a.query),
-                                                      DENSE_RANK() OVER (ORDER BY COUNT(a.query) DESC) AS qry_rnk
-                                               FROM stl_explain a,
-                                                    stl_query b
-                                               WHERE a.query = b.query
-                                               AND   CAST(b.starttime AS DATE) >= dateadd(DAY,%s,CURRENT_DATE)
-                                               AND   a.userid > 1
-                                               AND   regexp_instr(a.plannode,'.*missing statistics.*') > 0
-                                               AND   regexp_instr(a.plannode,'.*_bkp_.*') = 0
-                                               GROUP BY Table_Name) miss_tbl
-                                               LEFT JOIN pg_class c ON c.relname = TRIM(miss_tbl.table_name)
-                                               LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace WHERE miss_tbl.qry_rnk <= %s
-                                               /* Get the top N rank tables based on the stl_alert_event_log alerts */
-                                               UNION
-                                               SELECT schema_name,
-                                                      table_name
-                                               FROM (SELECT TRIM(n.nspname)::VARCHAR schema_name,
-                                                            TRIM(c.relname)::VARCHAR table_name,
-                                                            DENSE_RANK() OVER (ORDER BY COUNT(*) DESC) AS qry_rnk,
-                                                            COUNT(*)
-                                                     FROM stl_alert_event_log AS l
-                                                       JOIN (SELECT query,
-                                                                    tbl,
-                                                                    perm_table_name
-                                                             FROM stl_scan
-                                                             WHERE perm_table_name <> 'Internal Worktable'
-                                                             GROUP BY query,
-                                                                      tbl,
-                                                                      perm_table_name) AS s ON s.query = l.query
-                                                       JOIN pg_class c ON c.oid = s.tbl
-                                                       JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                                                     WHERE l.userid > 1
-                                                     AND   l.event_time >= dateadd(DAY,%s,CURRENT_DATE)
-                                                     AND   regexp_instr(l.Solution,'.*ANALYZE command.*') > 0
-                                                     GROUP BY TRIM(n.nspname),
-                                                              TRIM(c.relname)) anlyz_tbl
-                                               WHERE anlyz_tbl.qry_rnk < %s
-                                               UNION
-                                               /* just a base dump of svv_table_info to check the stats_off metric */
-                                               SELECT "schema"::VARCHAR schema_name,
-                                                      "table"::VARCHAR table_name
-                                               FROM svv_table_info) feedback_tbl
-                                      JOIN svv_table_info info_tbl
-                                        ON info_tbl.schema = feedback_tbl.schema_name
-                                       AND info_tbl.table = feedback_tbl.table_name
-                                    WHERE info_tbl.stats_off::DECIMAL(32,4) > %s::DECIMAL(32,4)
-                                    AND   TRIM(info_tbl.schema) ~ '%s'
-                                    AND   info_tbl.table NOT IN (%s)
-                                    ORDER BY info_tbl.size ASC;
-                            ''' % (predicate_cols_option,
-                                   goback_no_of_days,
-                                   query_rank,
-                                   goback_no_of_days,
-                                   query_rank,
-                                   stats_off_pct,
-                                   schema_name,
-                                   str(blacklisted_tables_array)[1:-1],)
+    if snapshot is None:
+        snapshot = get_table_snapshot(conn, schema_name, table_name, load_last_analyzed=analyze_interval is not None,
+                                      load_used_columns=analyze_used_cols)
 
+    def needs_analyze(t):
+        return exceeds(t['stats_off'], stats_off_pct) and not skip_analyze(snapshot, t, analyze_interval)
 
-    else:
-        # query for all tables in the schema
+    if table_name is None:
         comment("Extracting Candidate Tables for analyze based on Query Optimizer Alerts...")
 
-        get_analyze_statement_feedback = '''
-                                    SELECT DISTINCT 'analyze ' + feedback_tbl.schema_name + '."' + feedback_tbl.table_name + '"' + '%s ; ' + '/* Stats_Off : ' + CAST(info_tbl."stats_off" AS VARCHAR(10)) + ' */ ;'
-                                    FROM (/* Get top N rank tables based on the missing statistics alerts */  
-                                         SELECT TRIM(n.nspname)::VARCHAR schema_name,
-                                                TRIM(c.relname)::VARCHAR table_name 
-                                         FROM (SELECT TRIM(SPLIT_PART(SPLIT_PART(a.plannode,':',2),' ',2)) AS Table_Name,
-                                                      COUNT(a.query),
-                                                      DENSE_RANK() OVER (ORDER BY COUNT(a.query) DESC) AS qry_rnk
-                                               FROM stl_explain a,
-                                                    stl_query b
-                                               WHERE a.query = b.query
-                                               AND   CAST(b.starttime AS DATE) >= dateadd(DAY,%s,CURRENT_DATE)
-                                               AND   a.userid > 1
-                                               AND   regexp_instr(a.plannode,'.*missing statistics.*') > 0
-                                               AND   regexp_instr(a.plannode,'.*_bkp_.*') = 0
-                                               GROUP BY Table_Name) miss_tbl 
-                                               LEFT JOIN pg_class c ON c.relname = TRIM(miss_tbl.table_name) 
-                                               LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace WHERE miss_tbl.qry_rnk <= %s 
-                                               /* Get the top N rank tables based on the stl_alert_event_log alerts */
-                                               UNION
-                                               SELECT schema_name,
-                                                      table_name
-                                               FROM (SELECT TRIM(n.nspname)::VARCHAR schema_name,
-                                                            TRIM(c.relname)::VARCHAR table_name,
-                                                            DENSE_RANK() OVER (ORDER BY COUNT(*) DESC) AS qry_rnk,
-                                                            COUNT(*)
-                                                     FROM stl_alert_event_log AS l
-                                                       JOIN (SELECT query,
-                                                                    tbl,
-                                                                    perm_table_name
-                                                             FROM stl_scan
-                                                             WHERE perm_table_name <> 'Internal Worktable'
-                                                             GROUP BY query,
-                                                                      tbl,
-                                                                      perm_table_name) AS s ON s.query = l.query
-                                                       JOIN pg_class c ON c.oid = s.tbl
-                                                       JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-                                                     WHERE l.userid > 1
-                                                     AND   l.event_time >= dateadd(DAY,%s,CURRENT_DATE)
-                                                     AND   regexp_instr(l.Solution,'.*ANALYZE command.*') > 0
-                                                     GROUP BY TRIM(n.nspname),
-                                                              TRIM(c.relname)) anlyz_tbl
-                                               WHERE anlyz_tbl.qry_rnk < %s 
-                                               UNION
-                                               /* just a base dump of svv_table_info to check the stats_off metric */ 
-                                               SELECT "schema"::VARCHAR schema_name,
-                                                      "table"::VARCHAR table_name
-                                               FROM svv_table_info) feedback_tbl
-                                      JOIN svv_table_info info_tbl
-                                        ON info_tbl.schema = feedback_tbl.schema_name
-                                       AND info_tbl.table = feedback_tbl.table_name
-                                    WHERE info_tbl.stats_off::DECIMAL(32,4) > %s::DECIMAL(32,4)
-                                    AND   TRIM(info_tbl.schema) ~ '%s' 
-                                    ORDER BY info_tbl.size ASC
-                            ''' % (predicate_cols_option,
-                                   goback_no_of_days,
-                                   query_rank,
-                                   goback_no_of_days,
-                                   query_rank,
-                                   stats_off_pct,
-                                   schema_name)
-
-    if debug:
-        comment(get_analyze_statement_feedback)
+    # tables flagged by the missing statistics and analyze alerts are a subset of all tables, so all tables are
+    # selected on their stats off metric
+    candidates = get_candidates(snapshot, blacklisted_tables, needs_analyze)
 
-    analyze_statements = execute_query(conn, get_analyze_statement_feedback)
-
-    for vs in analyze_statements:
-        statements.append(vs[0])
+    for t in candidates:
+        statements.append(get_analyze_statement(predicate_cols_option, t, snapshot['used_columns']))
 
     comment("Found %s Tables requiring Analysis" % len(statements))
 
-    if not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors):
+    if plan is not None:
+        plan.extend([work_item(ANALYZE_WORK, t, [get_analyze_statement(predicate_cols_option, t,
+                                                                       snapshot['used_columns'])]) for t in candidates])
+    elif not run_analyze_commands(conn, analyze_conns, statements, cw, cluster_name, ignore_errors):
         if not ignore_errors:
             if debug:
                 print("Error running statements: %s" % (str(statements),))
             return ERROR
 
+    for t in candidates:
+        mark_analyzed(snapshot, t)
+
     if table_name is None:
         comment("Extracting Candidate Tables for analyze based on stats off from system table info ...")
 
-        if blacklisted_tables is not None:
-            blacklisted_tables_array = blacklisted_tables.split(',')
-            get_analyze_statement = '''SELECT DISTINCT 'analyze ' + "schema" + '."' + "table" + '" %s ; '
-                                            + '/* Stats_Off : ' + CAST("stats_off" AS VARCHAR(10)) + ' */ ;'
-                                            FROM svv_table_info
-                                            WHERE   stats_off::DECIMAL (32,4) > %s::DECIMAL (32,4)
-                                            AND  trim("schema") ~ '%s'
-                                            AND "table" NOT IN (%s)
-                                            ORDER BY "size" ASC ;
-                                            ''' % (predicate_cols_option,
-                                                   stats_off_pct,
-                                                   schema_name,
-                                                   str(blacklisted_tables_array)[1:-1],
-                                                   )
-        else:
-            get_analyze_statement = '''SELECT DISTINCT 'analyze ' + "schema" + '."' + "table" + '" %s ; '
-                                            + '/* Stats_Off : ' + CAST("stats_off" AS VARCHAR(10)) + ' */ ;'
-                                            FROM svv_table_info
-                                            WHERE   stats_off::DECIMAL (32,4) > %s::DECIMAL (32,4)
-                                            AND  trim("schema") ~ '%s'
-                                            ORDER BY "size" ASC ;
-                                            ''' % (predicate_cols_option, stats_off_pct, schema_name)
-
-        if debug:
-            comment(get_analyze_statement)
-
-        analyze_statements = execute_query(conn, get_analyze_statement)
+        candidates = get_candidates(snapshot, blacklisted_tables, needs_analyze)
 
         statements = []
-        for vs in analyze_statements:
-            statements.append(vs[0])
-
-        if not run_commands(conn, statements, cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors):
+        for t in candidates:
+            statements.append(get_analyze_statement(predicate_cols_option, t, snapshot['used_columns']))
+
+        if plan is not None:
+            plan.extend([work_item(ANALYZE_WORK, t, [get_analyze_statement(predicate_cols_option, t,
+                                                                           snapshot['used_columns'])])
+                         for t in candidates])
+        elif not run_analyze_commands(conn, analyze_conns, statements, cw, cluster_name, ignore_errors):
             if not ignore_errors:
                 if debug:
                     print("Error running statements: %s" % (str(statements),))
                     return ERROR
+
+        for t in candidates:
+            mark_analyzed(snapshot, t)
+
+    return True
+
+
+def estimate_seconds(kind, table_info, model):
+    # a vacuum is followed by an analyze of the table
+    seconds = model.predict(table_info, kind)
+
+    if kind != ANALYZE_WORK:
+        seconds += model.predict(table_info, ANALYZE_WORK)
+
+    return seconds
+
+
+def estimate_benefit(kind, table_info):
+    # the benefit of the work on a table is the number of rows it returns to sort order, and the number of rows whose
+    # statistics are refreshed
+    rows = float(table_info['rows']) if table_info['rows'] is not None else 0.0
+    unsorted = float(table_info['unsorted']) / 100 if table_info['unsorted'] is not None else 0.0
+    stats_off = float(table_info['stats_off']) / 100 if table_info['stats_off'] is not None else 0.0
+
+    if kind == ANALYZE_WORK:
+        return rows * stats_off
+    elif kind == REINDEX_WORK:
+        return rows * (1 + stats_off)
+    else:
+        return rows * (unsorted + stats_off)
+
+
+def plan_maintenance(work, time_budget, model):
+    # select the work which returns the greatest benefit within the time budget, by taking the work in order of its
+    # benefit per second while it fits the budget. Vacuums which don't fit are then replaced by their analyze
+    # statement where that fits the remaining budget
+    options = []
+    alternatives = []
+    for w in work:
+        options.append(dict(w, seconds=estimate_seconds(w['kind'], w['table'], model),
+                            benefit=estimate_benefit(w['kind'], w['table'])))
+
+        if w['alternative'] is not None:
+            alternatives.append(dict(w, kind=ANALYZE_WORK, statements=[w['alternative']], alternative=None,
+                                     seconds=estimate_seconds(ANALYZE_WORK, w['table'], model),
+                                     benefit=estimate_benefit(ANALYZE_WORK, w['table'])))
+
+    def by_benefit_per_second(o):
+        return o['benefit'] / max(o['seconds'], 1)
+
+    planned = []
+    planned_tables = set()
+    remaining = time_budget
+    for o in sorted(options, key=by_benefit_per_second, reverse=True) + sorted(alternatives,
+                                                                               key=by_benefit_per_second,
+                                                                               reverse=True):
+        key = (o['table']['schema'], o['table']['table'])
+
+        if key not in planned_tables and o['seconds'] <= remaining:
+            planned.append(o)
+            planned_tables.add(key)
+            remaining -= o['seconds']
+
+    return planned
+
+
+def run_maintenance_plan(conn, work, time_budget, model, cw, cluster_name, ignore_errors, monitor=None):
+    # run the planned work in order, skipping any work which is estimated to overrun the time remaining in the budget.
+    # Vacuums which are monitored are also cancelled if they are projected to overrun it
+    deadline = time.time() + time_budget
+    planned = plan_maintenance(work, time_budget, model)
+
+    if monitor is not None:
+        monitor.deadline = deadline
+
+    comment("Planned %s of %s Tables within a Time Budget of %s seconds, estimated to take %.0f seconds" % (
+        len(planned), len(work), time_budget, sum(p['seconds'] for p in planned)))
+
+    completed = 0
+    for p in planned:
+        comment("%s %s.%s : estimated %.0f seconds" % (p['kind'], p['table']['schema'], p['table']['table'],
+                                                       p['seconds']))
+
+    for p in planned:
+        remaining = deadline - time.time()
+
+        if remaining <= 0:
+            comment("Time Budget exhausted")
+            break
+
+        if p['seconds'] > remaining:
+            comment("Skipping %s of %s.%s estimated at %.0f seconds with %.0f seconds remaining" % (
+                p['kind'], p['table']['schema'], p['table']['table'], p['seconds'], remaining))
+            continue
+
+        if not run_commands(conn, p['statements'], cw=cw, cluster_name=cluster_name, suppress_errors=ignore_errors,
+                            monitor=monitor):
+            if not ignore_errors:
+                return ERROR
+
+        completed += 1
+
+    comment("Completed %s of %s Tables requiring maintenance within the Time Budget" % (completed, len(work)))
+
     return True
 
 
@@ -666,41 +1227,113 @@ def run_analyze_vacuum(**kwargs):
     if config_constants.SCHEMA_NAME not in kwargs:
         kwargs[config_constants.SCHEMA_NAME] = 'public'
 
+    def connect():
+        return get_pg_conn(kwargs[config_constants.DB_HOST],
+                           kwargs[config_constants.DB_NAME],
+                           kwargs[config_constants.DB_USER],
+                           db_pwd,
+                           kwargs[config_constants.SCHEMA_NAME],
+                           kwargs[config_constants.DB_PORT],
+                           None if config_constants.QUERY_GROUP not in kwargs else kwargs[
+                               config_constants.QUERY_GROUP],
+                           None if config_constants.QUERY_SLOT_COUNT not in kwargs else kwargs[
+                               config_constants.QUERY_SLOT_COUNT],
+                           None if config_constants.SSL not in kwargs else kwargs[config_constants.SSL])
+
     # get a connection for the controlling processes
-    master_conn = get_pg_conn(kwargs[config_constants.DB_HOST],
-                              kwargs[config_constants.DB_NAME],
-                              kwargs[config_constants.DB_USER],
-                              db_pwd,
-                              kwargs[config_constants.SCHEMA_NAME],
-                              kwargs[config_constants.DB_PORT],
-                              None if config_constants.QUERY_GROUP not in kwargs else kwargs[
-                                  config_constants.QUERY_GROUP],
-                              None if config_constants.QUERY_SLOT_COUNT not in kwargs else kwargs[
-                                  config_constants.QUERY_SLOT_COUNT],
-                              None if config_constants.SSL not in kwargs else kwargs[config_constants.SSL])
+    master_conn = connect()
 
     if master_conn is None:
         raise Exception("No Connection was established")
 
     vacuum_flag = kwargs[config_constants.DO_VACUUM] if config_constants.DO_VACUUM in kwargs else False
+    analyze_flag = kwargs[config_constants.DO_ANALYZE] if config_constants.DO_ANALYZE in kwargs else False
+
+    # read the table statistics once, from which all vacuum and analyze candidates are selected
+    snapshot = None
+    if vacuum_flag is True or analyze_flag is True:
+        all_tables = config_constants.TABLE_NAME not in kwargs and config_constants.BLACKLISTED_TABLES not in kwargs
+        snapshot = get_table_snapshot(master_conn, kwargs[config_constants.SCHEMA_NAME],
+                                      kwargs.get(config_constants.TABLE_NAME),
+                                      load_alerts=vacuum_flag is True and all_tables,
+                                      load_interleaved=vacuum_flag is True and all_tables,
+                                      load_last_analyzed=config_constants.ANALYZE_INTERVAL in kwargs,
+                                      load_used_columns=analyze_flag is True and kwargs.get(
+                                          config_constants.ANALYZE_USED_COLS, False))
+
+    # with a time budget, the candidates of all phases are collected into a plan, rather than run as they are found
+    time_budget = int(float(kwargs[config_constants.TIME_BUDGET]) * 60) \
+        if config_constants.TIME_BUDGET in kwargs else None
+    plan = [] if time_budget is not None else None
+
+    # monitor the progress of each vacuum from a separate connection
+    monitor = None
+    monitor_conn = None
+    if vacuum_flag is True and config_constants.VACUUM_PROGRESS_INTERVAL in kwargs:
+        monitor_conn = connect()
+
+        if monitor_conn is None:
+            raise Exception("No Connection was established")
+
+        monitor = VacuumMonitor(monitor_conn, execute_query(master_conn, "SELECT pg_backend_pid()")[0][0], cw,
+                                cluster_name, float(kwargs[config_constants.VACUUM_PROGRESS_INTERVAL]), snapshot)
+
     if vacuum_flag is True:
         # Run vacuum based on the Unsorted , Stats off and Size of the table
-        run_vacuum(master_conn, cluster_name, cw, **kwargs)
+        run_vacuum(master_conn, cluster_name, cw, snapshot=snapshot, plan=plan, monitor=monitor, **kwargs)
     else:
         comment("Vacuum flag arg is not set. Vacuum not performed.")
 
-    analyze_flag = kwargs[config_constants.DO_ANALYZE] if config_constants.DO_ANALYZE in kwargs else False
+    analyze_conns = []
     if analyze_flag is True:
         if not vacuum_flag:
             comment("Warning - Analyze without Vacuum may result in sub-optimal performance")
 
+        # open a pool of connections to run analyze statements concurrently, as unlike vacuum, analyze of different
+        # tables can run at the same time
+        analyze_parallelism = int(kwargs[config_constants.ANALYZE_PARALLELISM]) \
+            if config_constants.ANALYZE_PARALLELISM in kwargs else 1
+        if analyze_parallelism > 1 and plan is not None:
+            comment("Analyze statements are run serially within a Time Budget")
+        elif analyze_parallelism > 1:
+            comment("Opening %s connections for Analyze" % analyze_parallelism)
+
+            for i in range(analyze_parallelism):
+                c = connect()
+
+                if c is None:
+                    raise Exception("No Connection was established")
+
+                analyze_conns.append(c)
+
         # Run Analyze based on the  Stats off Metrics table
-        run_analyze(master_conn, cluster_name, cw, **kwargs)
+        run_analyze(master_conn, cluster_name, cw, analyze_conns=analyze_conns, snapshot=snapshot, plan=plan,
+                    **kwargs)
     else:
         comment("Analyze flag arg is set as %s. Analyze is not performed." % analyze_flag)
 
+    if plan is not None:
+        # predict the duration of the planned work from the vacuum and analyze history of the cluster
+        model_path = kwargs[config_constants.DURATION_MODEL] if config_constants.DURATION_MODEL in kwargs else \
+            os.path.join(tempfile.gettempdir(), 'analyze-vacuum-duration-model-%s.json' % cluster_name)
+        model = duration_model.DurationModel(model_path)
+        duration_model.debug = debug
+        model.refresh(master_conn)
+        comment("Duration Model %s" % model.describe())
+
+        run_maintenance_plan(master_conn, plan, time_budget, model, cw, cluster_name,
+                             kwargs[config_constants.IGNORE_ERRORS] if config_constants.IGNORE_ERRORS in kwargs else
+                             False, monitor)
+
+    if snapshot is not None:
+        report_skipped_vacuum(snapshot)
+        report_skipped_analyze(snapshot)
+
     comment('Processing Complete')
 
     cleanup(master_conn)
+    cleanup(monitor_conn)
+    for c in analyze_conns:
+        cleanup(c)
 
     return OK
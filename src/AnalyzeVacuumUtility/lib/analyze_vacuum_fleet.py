@@ -0,0 +1,282 @@
+from __future__ import print_function
+
+'''
+analyze_vacuum_fleet.py
+* Copyright 2015, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+
+Runs the Analyze Vacuum Utility against a fleet of cluster and database targets. Each target is run in its own process
+with its own log, so that a failure or hang of one cluster doesn't affect the others. Clusters are run concurrently up
+to a limit, while the databases of a single cluster are run one after another, as Redshift only runs one vacuum at a
+time on a cluster. A target with a time budget is terminated if it's still running after its budget and a grace
+period, and the statements its sessions are still running on the cluster are cancelled before the next database of
+the cluster is started. When all targets have completed, a consolidated report of the run is written.
+'''
+
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import analyze_vacuum
+import config_constants
+
+# seconds between checks of the running targets
+POLL_SECONDS = 5
+
+# seconds that a target may run beyond its time budget before it's terminated, to allow the running statement to
+# complete or be cancelled by the vacuum monitor
+GRACE_SECONDS = 300
+
+OK = 'OK'
+ERROR = 'ERROR'
+FAILED = 'FAILED'
+TIMED_OUT = 'TIMED OUT'
+
+# message from a target with the backend pid of a session it opened
+BACKEND = 'BACKEND'
+
+
+def comment(string):
+    if string is not None:
+        print('-- %s [%s] %s' % (datetime.datetime.utcnow(), os.getpid(), string))
+
+
+def get_targets(config):
+    # resolve the targets of a fleet configuration, each of which is the default configuration overridden by the
+    # configuration of the target, using the same parameter names and aliases as the utility
+    defaults = config.get('configuration', {})
+
+    targets = []
+    for t in config.get('targets', []):
+        target = dict(defaults)
+        target.update(t)
+        target = config_constants.normalise_config(target)
+
+        for required in [config_constants.DB_NAME, config_constants.DB_USER, config_constants.DB_HOST,
+                         config_constants.DB_PORT]:
+            if required not in target:
+                raise Exception("Target %s is missing Parameter '%s'" % (t, required))
+
+        # the password is taken from .pgpass if it's not configured
+        if config_constants.DB_PASSWORD not in target:
+            target[config_constants.DB_PASSWORD] = os.environ.get('PGPASSWORD')
+
+        if config_constants.CLUSTER_NAME not in target:
+            target[config_constants.CLUSTER_NAME] = target[config_constants.DB_HOST].split('.')[0]
+
+        targets.append(target)
+
+    return targets
+
+
+def get_target_name(target):
+    return '%s/%s' % (target[config_constants.CLUSTER_NAME], target[config_constants.DB_NAME])
+
+
+def run_target(target, log_file, results):
+    # run the utility against a single target in a child process, logging to its own file
+    name = get_target_name(target)
+    get_pg_conn = analyze_vacuum.get_pg_conn
+
+    def get_reported_pg_conn(*args, **kwargs):
+        # report the backend of each session, so that its statements can be cancelled if the target is terminated
+        conn = get_pg_conn(*args, **kwargs)
+
+        if conn is not None:
+            results.put((name, BACKEND, analyze_vacuum.execute_query(conn, 'select pg_backend_pid()')[0][0]))
+
+        return conn
+
+    try:
+        sys.stdout = open(log_file, 'w')
+        sys.stderr = sys.stdout
+
+        analyze_vacuum.get_pg_conn = get_reported_pg_conn
+
+        result = analyze_vacuum.run_analyze_vacuum(**dict(target))
+        results.put((name, OK if result in (None, analyze_vacuum.OK) else ERROR, None))
+    except Exception as e:
+        print(traceback.format_exc())
+        results.put((name, ERROR, str(e)))
+    finally:
+        sys.stdout.flush()
+
+
+def cancel_backends(target, backends):
+    # cancel the statements of the sessions of a terminated target, as terminating the client leaves them running on
+    # the cluster, and wait for the sessions to end, so that a vacuum of the target can't block the next database of
+    # the cluster. Sessions which don't end within the grace period are terminated
+    if len(backends) == 0:
+        return
+
+    conn = analyze_vacuum.get_pg_conn(target[config_constants.DB_HOST], target[config_constants.DB_NAME],
+                                      target[config_constants.DB_USER], target[config_constants.DB_PASSWORD],
+                                      'public', target[config_constants.DB_PORT],
+                                      ssl=target.get(config_constants.SSL, True))
+
+    if conn is None:
+        comment("Unable to connect to cancel the sessions %s of %s" % (backends, get_target_name(target)))
+        return
+
+    try:
+        for pid in backends:
+            analyze_vacuum.execute_query(conn, 'select pg_cancel_backend(CAST(%s AS INTEGER))', (pid,))
+
+        comment("Cancelled the sessions %s of %s" % (backends, get_target_name(target)))
+
+        deadline = time.time() + GRACE_SECONDS
+        while True:
+            running = [row[0] for row in analyze_vacuum.execute_query(conn, 'select process from stv_sessions')
+                       if row[0] in backends]
+
+            if len(running) == 0:
+                break
+            elif time.time() > deadline:
+                for pid in running:
+                    analyze_vacuum.execute_query(conn, 'select pg_terminate_backend(CAST(%s AS INTEGER))', (pid,))
+
+                comment("Terminated the sessions %s of %s" % (running, get_target_name(target)))
+                break
+
+            time.sleep(POLL_SECONDS)
+    finally:
+        analyze_vacuum.cleanup(conn)
+
+
+def run_fleet(targets, max_concurrency=1, log_dir=None, report_file=None):
+    # run the targets, at most max_concurrency clusters at a time, and return the consolidated report
+    if log_dir is None:
+        log_dir = tempfile.gettempdir()
+
+    run_start = datetime.datetime.utcnow()
+    if report_file is None:
+        report_file = os.path.join(log_dir, 'analyze-vacuum-fleet-%s.json' % run_start.strftime('%Y%m%d%H%M%S'))
+
+    # the targets of each cluster, with their position in the configuration, in the order they were configured
+    pending = []
+    for i, t in enumerate(targets):
+        cluster = [p for p in pending if p[0] == t[config_constants.DB_HOST]]
+
+        if len(cluster) == 0:
+            pending.append((t[config_constants.DB_HOST], [(i, t)]))
+        else:
+            cluster[0][1].append((i, t))
+
+    comment("Running %s Targets on %s Clusters with Concurrency %s" % (len(targets), len(pending), max_concurrency))
+
+    results = multiprocessing.Queue()
+    statuses = {}
+    backends = {}
+    running = {}
+    report = []
+
+    def collect(timeout=None):
+        # collect the results put by the targets which have completed
+        try:
+            while True:
+                name, status, error = results.get(True, timeout) if timeout is not None else results.get_nowait()
+
+                if status == BACKEND:
+                    backends.setdefault(name, []).append(error)
+                else:
+                    statuses[name] = (status, error)
+        except Exception:
+            pass
+
+    def finish(host, status, error=None):
+        process, target, started, deadline, log_file = running.pop(host)
+        backends.pop(get_target_name(target), None)
+        ended = datetime.datetime.utcnow()
+        seconds = (ended - started).total_seconds()
+
+        report.append({'target': get_target_name(target), 'cluster': target[config_constants.CLUSTER_NAME],
+                       'db': target[config_constants.DB_NAME], 'status': status, 'error': error,
+                       'start': started.isoformat(), 'end': ended.isoformat(), 'seconds': round(seconds, 1),
+                       'log_file': log_file})
+        comment("%s completed with status %s in %.0f seconds%s" % (
+            get_target_name(target), status, seconds, '' if error is None else ': %s' % error))
+
+    while len(pending) > 0 or len(running) > 0:
+        # start the next target of each idle cluster, up to the concurrency limit
+        for host, cluster_targets in list(pending):
+            if len(running) >= max_concurrency:
+                break
+
+            if host in running:
+                continue
+
+            index, target = cluster_targets.pop(0)
+            if len(cluster_targets) == 0:
+                pending.remove((host, cluster_targets))
+
+            # several targets can run against the same database, e.g. for different schemas
+            log_file = os.path.join(log_dir, 'analyze-vacuum-%03d-%s-%s.log' % (
+                index, target[config_constants.CLUSTER_NAME], target[config_constants.DB_NAME]))
+            process = multiprocessing.Process(target=run_target, args=(target, log_file, results))
+            process.start()
+
+            started = datetime.datetime.utcnow()
+            deadline = None
+            if config_constants.TIME_BUDGET in target:
+                deadline = started + datetime.timedelta(
+                    seconds=float(target[config_constants.TIME_BUDGET]) * 60 + GRACE_SECONDS)
+
+            running[host] = (process, target, started, deadline, log_file)
+            comment("Started %s in process %s, logging to %s" % (get_target_name(target), process.pid, log_file))
+
+        time.sleep(POLL_SECONDS)
+
+        collect()
+
+        for host, (process, target, started, deadline, log_file) in list(running.items()):
+            name = get_target_name(target)
+
+            # a process which has exited may not yet have had its result received
+            if name not in statuses and not process.is_alive():
+                collect(POLL_SECONDS)
+
+            if name in statuses:
+                process.join()
+                finish(host, *statuses.pop(name))
+            elif not process.is_alive():
+                finish(host, FAILED, 'process exited with code %s' % process.exitcode)
+            elif deadline is not None and datetime.datetime.utcnow() > deadline:
+                process.terminate()
+                process.join()
+                collect()
+                cancel_backends(target, backends.get(name, []))
+                finish(host, TIMED_OUT, 'exceeded time budget of %s minutes' % target[config_constants.TIME_BUDGET])
+
+    run_end = datetime.datetime.utcnow()
+    summary = {'start': run_start.isoformat(), 'end': run_end.isoformat(),
+               'seconds': round((run_end - run_start).total_seconds(), 1),
+               'serial_seconds': round(sum(r['seconds'] for r in report), 1),
+               'max_concurrency': max_concurrency, 'targets': report}
+
+    with open(report_file, 'w') as f:
+        json.dump(summary, f, indent=4)
+
+    comment("Fleet completed in %s seconds, against %s seconds for the Targets run serially" % (
+        summary['seconds'], summary['serial_seconds']))
+    for status in [OK, ERROR, FAILED, TIMED_OUT]:
+        count = len([r for r in report if r['status'] == status])
+        if count > 0:
+            comment("%s Targets %s" % (count, status))
+    comment("Report written to %s" % report_file)
+
+    return summary
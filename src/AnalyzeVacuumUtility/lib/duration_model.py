@@ -0,0 +1,253 @@
+from __future__ import print_function
+
+'''
+duration_model.py
+* Copyright 2015, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+
+Predicts the duration of vacuum and analyze of a table from the history of the cluster. The vacuums in stl_vacuum
+and the analyzes in stl_analyze are collected as samples of the size and unsorted fraction of a table against the
+seconds taken, and a linear model of seconds against MB and unsorted MB is fitted for each kind of work. As the system
+tables only retain a few days of history, samples are persisted to a local file and accumulate across runs.
+'''
+
+import datetime
+import json
+import os
+import time
+
+
+# kinds of work which the model predicts
+VACUUM = 'vacuum'
+REINDEX = 'reindex'
+ANALYZE = 'analyze'
+
+# number of days of history to extract from the system tables
+HISTORY_DAYS = -7
+
+# maximum number of samples retained for each kind of work, most recent first
+MAX_SAMPLES = 5000
+
+# durations assumed when there are too few samples to fit a model
+DEFAULT_SECONDS_PER_MB = {VACUUM: 0.1, REINDEX: 0.2, ANALYZE: 0.01}
+
+# share of the cost of a vacuum which is incurred for the whole table rather than only the unsorted region, when there
+# are too few samples to fit a model
+VACUUM_BASE_FRACTION = 0.25
+
+# bounds of the correction applied to the prediction for a table from its own history
+MIN_TABLE_FACTOR = 0.1
+MAX_TABLE_FACTOR = 10
+
+debug = False
+
+
+def _query(conn, statement, params):
+    if debug:
+        print(statement)
+        print(params)
+
+    cursor = conn.cursor()
+    cursor.execute(statement, params)
+    return cursor.fetchall()
+
+
+def _solve(matrix, vector):
+    # solve a small system of linear equations by gaussian elimination, returning None if it is singular
+    n = len(vector)
+    a = [list(matrix[i]) + [vector[i]] for i in range(n)]
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            return None
+
+        a[col], a[pivot] = a[pivot], a[col]
+
+        for r in range(n):
+            if r != col:
+                f = a[r][col] / a[col][col]
+                a[r] = [a[r][k] - f * a[col][k] for k in range(n + 1)]
+
+    return [a[i][n] / a[i][i] for i in range(n)]
+
+
+def _features(kind, mbytes, unsorted):
+    if kind == ANALYZE:
+        return [1.0, mbytes]
+    else:
+        return [1.0, mbytes, mbytes * unsorted]
+
+
+def _fit(kind, samples):
+    # least squares fit of seconds against the features of the samples. Returns None if the samples don't determine a
+    # model where every coefficient is positive
+    rows = [(_features(kind, s['mbytes'], s['unsorted']), s['seconds']) for s in samples]
+    width = len(rows[0][0]) if len(rows) > 0 else 0
+
+    if len(rows) <= width:
+        return None
+
+    xtx = [[sum(x[i] * x[j] for x, y in rows) for j in range(width)] for i in range(width)]
+    xty = [sum(x[i] * y for x, y in rows) for i in range(width)]
+    coefficients = _solve(xtx, xty)
+
+    if coefficients is None or min(coefficients) < 0:
+        return None
+
+    return coefficients
+
+
+class DurationModel(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.samples = {VACUUM: [], REINDEX: [], ANALYZE: []}
+        self.coefficients = {}
+        self.table_factors = {}
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    saved = json.load(f)
+
+                for kind in self.samples:
+                    self.samples[kind] = saved['samples'].get(kind, [])
+            except Exception as e:
+                print("Unable to load Duration Model from %s: %s" % (path, e))
+
+        self.sample_keys = set((kind, s['table_id'], s['xid']) for kind in self.samples for s in self.samples[kind])
+
+    def extract_history(self, conn):
+        # collect the vacuums and analyzes of the history window as samples, keyed by transaction so that samples
+        # already persisted by a previous run aren't duplicated
+        vacuums = _query(conn, '''SELECT v.table_id, v.xid, MIN(v.eventtime),
+                                         MAX(CASE WHEN v.status ILIKE 'start%%' THEN v.blocks END),
+                                         MAX(CASE WHEN v.status ILIKE 'start%%' THEN v.rows END),
+                                         MAX(CASE WHEN v.status ILIKE 'start%%' THEN v.sortedrows END),
+                                         MAX(CASE WHEN v.status ILIKE '%%reindex%%' THEN 1 ELSE 0 END),
+                                         DATEDIFF(ms, MIN(v.eventtime), MAX(v.eventtime)) / 1000.0
+                                  FROM stl_vacuum v
+                                  WHERE v.eventtime >= dateadd(DAY,CAST(%s AS INTEGER),CURRENT_DATE)
+                                  GROUP BY v.table_id, v.xid
+                                  HAVING COUNT(*) > 1
+                               ''', (HISTORY_DAYS,))
+
+        for row in vacuums:
+            if row[3] is None or row[7] is None:
+                continue
+
+            rows = float(row[4]) if row[4] is not None else 0.0
+            sorted_rows = float(row[5]) if row[5] is not None else rows
+            self.add_sample(REINDEX if row[6] == 1 else VACUUM, row[0], row[1], row[2], float(row[3]),
+                            1 - sorted_rows / rows if rows > 0 else 0.0, float(row[7]))
+
+        # stl_analyze doesn't record the size of the table, so it's taken from svv_table_info in proportion to the
+        # rows of the table at the time
+        analyzes = _query(conn, '''SELECT a.table_id, a.xid, a.starttime, i.size, a.rows, i.tbl_rows,
+                                          DATEDIFF(ms, a.starttime, a.endtime) / 1000.0
+                                   FROM stl_analyze a
+                                   JOIN svv_table_info i ON i.table_id = a.table_id
+                                   WHERE a.status <> 'Skipped'
+                                   AND   a.starttime >= dateadd(DAY,CAST(%s AS INTEGER),CURRENT_DATE)
+                                ''', (HISTORY_DAYS,))
+
+        for row in analyzes:
+            if row[3] is None or row[6] is None:
+                continue
+
+            mbytes = float(row[3])
+            if row[4] is not None and row[5] is not None and float(row[5]) > 0:
+                mbytes = mbytes * float(row[4]) / float(row[5])
+
+            self.add_sample(ANALYZE, row[0], row[1], row[2], mbytes, 0.0, float(row[6]))
+
+    def add_sample(self, kind, table_id, xid, event_time, mbytes, unsorted, seconds):
+        if (kind, table_id, xid) in self.sample_keys:
+            return
+
+        self.sample_keys.add((kind, table_id, xid))
+
+        if isinstance(event_time, (datetime.date, datetime.datetime)):
+            event_time = event_time.isoformat()
+
+        self.samples[kind].append({'table_id': table_id, 'xid': xid, 'time': str(event_time), 'mbytes': mbytes,
+                                   'unsorted': unsorted, 'seconds': seconds})
+
+    def fit(self):
+        # fit a model to the samples of each kind of work, and then a correction for each table with samples of its
+        # own, so that tables which are consistently slower or faster than the model are predicted from their history
+        self.coefficients = {}
+        self.table_factors = {}
+
+        for kind, samples in self.samples.items():
+            samples.sort(key=lambda s: s['time'], reverse=True)
+            del samples[MAX_SAMPLES:]
+
+            coefficients = _fit(kind, samples)
+            if coefficients is not None:
+                self.coefficients[kind] = coefficients
+
+            ratios = {}
+            for s in samples:
+                predicted = self.predict_mbytes(kind, s['mbytes'], s['unsorted'])
+
+                if predicted > 0:
+                    ratios.setdefault(s['table_id'], []).append(s['seconds'] / predicted)
+
+            for table_id, r in ratios.items():
+                r.sort()
+                self.table_factors[(kind, table_id)] = min(max(r[len(r) // 2], MIN_TABLE_FACTOR), MAX_TABLE_FACTOR)
+
+    def save(self):
+        if self.path is None:
+            return
+
+        with open(self.path, 'w') as f:
+            json.dump({'saved': time.time(), 'samples': self.samples,
+                       'coefficients': self.coefficients}, f)
+
+    def refresh(self, conn):
+        # extract the latest history, and fit and persist the model
+        self.extract_history(conn)
+        self.fit()
+
+        try:
+            self.save()
+        except Exception as e:
+            print("Unable to save Duration Model to %s: %s" % (self.path, e))
+
+    def predict_mbytes(self, kind, mbytes, unsorted):
+        if kind in self.coefficients:
+            return sum(c * x for c, x in zip(self.coefficients[kind], _features(kind, mbytes, unsorted)))
+
+        if kind == VACUUM:
+            return mbytes * DEFAULT_SECONDS_PER_MB[kind] * (
+                    VACUUM_BASE_FRACTION + (1 - VACUUM_BASE_FRACTION) * unsorted)
+        else:
+            return mbytes * DEFAULT_SECONDS_PER_MB[kind]
+
+    def predict(self, table, kind=VACUUM):
+        # predict the seconds to run the kind of work on a table from svv_table_info, as a dictionary of its size in
+        # MB, unsorted percentage and table_id
+        mbytes = float(table['size']) if table.get('size') is not None else 0.0
+        unsorted = float(table['unsorted']) / 100 if table.get('unsorted') is not None else 1.0
+
+        if kind == REINDEX:
+            unsorted = 1.0
+
+        return self.predict_mbytes(kind, mbytes, unsorted) * self.table_factors.get((kind, table.get('table_id')), 1)
+
+    def describe(self):
+        return ', '.join('%s: %s samples%s' % (kind, len(self.samples[kind]),
+                                                ' fitted' if kind in self.coefficients else '')
+                         for kind in [VACUUM, REINDEX, ANALYZE])
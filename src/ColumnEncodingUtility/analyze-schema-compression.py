@@ -39,14 +39,17 @@ from __future__ import print_function
 import datetime
 import getopt
 import getpass
+import json
 import math
+import numbers
 import os
 import re
 import socket
+import sqlite3
 import sys
 import time
 import traceback
-from multiprocessing import Pool
+from multiprocessing import Condition, Pool, Value
 
 import boto3
 import pg8000
@@ -81,6 +84,32 @@ COL_LENGTH_EXPANSION_BUFFER = .2
 # maximum length above which varchar columns should be reduced if analyze_col_width is true
 STRING_REDUCTION_MAX_LENGTH_THRESHOLD = 255
 
+# default number of hours for which a cached analyze compression result is used
+ANALYZE_CACHE_TTL_HOURS = 168
+
+# number of seconds a deep copy waits for disk space to be freed by other copies before checking again
+DISK_ADMISSION_WAIT_SECONDS = 30
+
+# number of attempts to copy a single chunk of a chunked deep copy
+CHUNK_RETRY = 5
+
+# types of leading sort key columns on which a deep copy can be split into ranges
+CHUNK_RANGE_TYPES = ('smallint', 'integer', 'bigint', 'numeric', 'real', 'double precision', 'date', 'timestamp')
+
+# execution modes recorded in the plan output and throughput history
+MODE_DEEP_COPY = 'deep copy'
+MODE_ALTER_IN_PLACE = 'alter in place'
+
+# table states recorded in the run journal
+JOURNAL_ANALYZED = 'analyzed'
+JOURNAL_UNCHANGED = 'unchanged'
+JOURNAL_PLANNED = 'planned'
+JOURNAL_COPIED = 'copied'
+JOURNAL_RENAMED = 'renamed'
+JOURNAL_ALTERED = 'altered'
+JOURNAL_COPYING = 'copying'
+JOURNAL_FK_APPLIED = 'fk-applied'
+
 # compiled regular expressions
 IDENTITY_RE = re.compile(r'"identity"\((?P<current>.*), (?P<base>.*), \(?\'(?P<seed>\d+),(?P<step>\d+)\'.*\)')
 
@@ -114,6 +143,31 @@ ssl = False
 suppress_cw = None
 cw = None
 statement_timeout = '1200000'
+analyze_cache = None
+analyze_cache_ttl = ANALYZE_CACHE_TTL_HOURS
+journal = None
+resume = False
+max_disk_pct = None
+alter_in_place = False
+min_savings_pct = None
+savings_budget_mb = None
+plan_output = None
+copy_chunks = None
+
+# shared between worker processes: the megabytes reserved by running deep copies, and the condition used to wait for
+# disk space to be released
+disk_reserved_mb = None
+disk_condition = None
+
+# catalog information for all candidate tables, keyed by (schema, table), populated by prefetch_catalog()
+catalog = None
+
+# analyze compression results of the tables selected by select_by_savings(), keyed by (schema, table)
+compression_results = None
+
+# progress of chunked deep copies in the journal being resumed, as (chunks copied, chunk count) keyed by
+# (schema, table)
+resumed_copies = {}
 
 
 def execute_query(string):
@@ -288,10 +342,13 @@ def get_grants(schema_name, table_name, current_user):
         ;
     ''' % (table_name, schema_name, current_user)
 
-    if debug:
-        comment(sql)
+    grants = get_prefetched(schema_name, table_name, 'grants')
+
+    if grants is None:
+        if debug:
+            comment(sql)
 
-    grants = execute_query(sql)
+        grants = execute_query(sql)
 
     grant_statements = []
 
@@ -324,10 +381,13 @@ def get_foreign_keys(schema_name, set_target_schema, table_name):
  ORDER BY 1
 ''' % (schema_name, table_name)
 
-    if debug:
-        comment(fk_statement)
+    foreign_keys = get_prefetched(schema_name, table_name, 'fks')
+
+    if foreign_keys is None:
+        if debug:
+            comment(fk_statement)
 
-    foreign_keys = execute_query(fk_statement)
+        foreign_keys = execute_query(fk_statement)
     fk_statements = []
 
     for fk in foreign_keys:
@@ -360,10 +420,13 @@ WHERE
 order by att.attnum;
 ''' % (schema_name, original_table)
 
-    if debug:
-        comment(statement)
+    pks = get_prefetched(schema_name, original_table, 'pks')
+
+    if pks is None:
+        if debug:
+            comment(statement)
 
-    pks = execute_query(statement)
+        pks = execute_query(statement)
 
     for pk in pks:
         has_pks = True
@@ -387,10 +450,13 @@ def get_table_desc(schema_name, table_name):
  and de.column = at.attname
 ''' % (schema_name, table_name, schema_name, table_name)
 
-    if debug:
-        comment(statement)
+    description = get_prefetched(schema_name, table_name, 'descr')
 
-    description = execute_query(statement)
+    if description is None:
+        if debug:
+            comment(statement)
+
+        description = execute_query(statement)
 
     descr = {}
     for row in description:
@@ -411,6 +477,17 @@ def get_count_raw_columns(schema_name, table_name):
         and tablename = '%s'
 ''' % (schema_name, table_name)
 
+    description = get_prefetched(schema_name, table_name, 'descr')
+
+    if description is not None:
+        # derive the count from the prefetched column descriptions
+        count_raw_columns = 0
+        for row in description:
+            if str(row[2]).lower() in ('raw', 'none') and row[4] != 1:
+                count_raw_columns += 1
+
+        return [(count_raw_columns,)]
+
     if debug:
         comment(statement)
 
@@ -419,6 +496,147 @@ def get_count_raw_columns(schema_name, table_name):
     return description
 
 
+def get_prefetched(schema_name, table_name, item):
+    # returns the prefetched catalog rows of the given type for a table, or None if the table was not prefetched
+    if catalog is None:
+        return None
+
+    table_catalog = catalog.get((schema_name, table_name))
+
+    if table_catalog is None:
+        return None
+    else:
+        return table_catalog[item]
+
+
+def prefetch_catalog(table_list, tables=None):
+    # fetch the column definitions, primary keys, foreign keys and grants for all candidate tables with a few set
+    # based queries, rather than issuing one query per table and item. Worker processes inherit the result
+    global catalog
+
+    def table_filter(column):
+        # restrict the prefetch to the requested tables, if any
+        if tables is not None:
+            return 'and %s in (%s)' % (column, tables)
+        else:
+            return ''
+
+    candidates = {}
+    for t in table_list:
+        candidates[(t[0], t[1])] = True
+
+    column_statement = '''select /* prefetching column descriptions */ de.schemaname, de.tablename, "column", type, encoding, distkey, sortkey, "notnull", ad.adsrc
+ from pg_table_def de
+ join pg_namespace n on n.nspname = de.schemaname
+ join pg_class c on c.relnamespace = n.oid and c.relname = de.tablename
+ join pg_attribute at on at.attrelid = c.oid and at.attname = de.column
+ left join pg_attrdef ad on (at.attrelid, at.attnum) = (ad.adrelid, ad.adnum)
+ where de.schemaname ~ '%s'
+ %s
+ order by de.schemaname, de.tablename, at.attnum
+''' % (schema_name, table_filter('de.tablename'))
+
+    pk_statement = '''select /* prefetching primary key information */ n.nspname, cl.relname, att.attname
+ from pg_index ind
+ join pg_class cl on ind.indrelid = cl.oid
+ join pg_namespace n on n.oid = cl.relnamespace
+ join pg_attribute att on att.attrelid = cl.oid
+ where att.attnum = ANY(string_to_array(textin(int2vectorout(ind.indkey)), ' '))
+ and att.attnum > 0
+ and ind.indisprimary
+ and n.nspname ~ '%s'
+ %s
+ order by n.nspname, cl.relname, att.attnum
+''' % (schema_name, table_filter('cl.relname'))
+
+    fk_statement = '''select /* prefetching foreign key relations */ n.nspname, pgc.relname, conname,
+ pg_catalog.pg_get_constraintdef(cons.oid, true) as condef
+ from pg_catalog.pg_constraint cons
+ join pg_class pgc on cons.conrelid = pgc.oid
+ join pg_namespace n on n.oid = pgc.relnamespace
+ where cons.contype = 'f'
+ and n.nspname ~ '%s'
+ %s
+ order by n.nspname, pgc.relname, conname
+''' % (schema_name, table_filter('pgc.relname'))
+
+    grants_statement = '''
+        WITH priviledge AS
+        (
+            SELECT 'SELECT'::varchar(10) as "grant"
+            UNION ALL
+            SELECT 'DELETE'::varchar(10)
+            UNION ALL
+            SELECT 'INSERT'::varchar(10)
+            UNION ALL
+            SELECT 'UPDATE'::varchar(10)
+            UNION ALL
+            SELECT 'REFERENCES'::varchar(10)
+        ),
+        usr AS
+        (
+            SELECT usesysid, 0 as grosysid, usename, false as is_group
+            FROM pg_user
+            WHERE usename != 'rdsdb'
+            UNION ALL
+            SELECT 0, grosysid, groname, true
+            FROM pg_group
+        )
+        SELECT /* prefetching table grants */ nc.nspname AS table_schema, c.relname AS table_name, priviledge."grant" AS privilege_type, usr.is_group, usr.usename AS grantee
+        FROM pg_class c
+        JOIN pg_namespace nc ON (c.relnamespace = nc.oid)
+        CROSS JOIN usr
+        CROSS JOIN priviledge
+        JOIN pg_user ON pg_user.usename not in ('rdsdb')
+        WHERE  (c.relkind = 'r'::"char" OR c.relkind = 'v'::"char")
+        AND aclcontains(c.relacl, makeaclitem(usr.usesysid, usr.grosysid, pg_user.usesysid, priviledge."grant", false))
+        AND nc.nspname ~ '%s'
+        %s
+        and grantee != '%s'
+        ;
+    ''' % (schema_name, table_filter('c.relname'), db_user)
+
+    prefetched = {}
+
+    def prefetch(statement):
+        if debug:
+            comment(statement)
+
+        return execute_query(statement)
+
+    # column descriptions are in the same format as returned by get_table_desc(). Only tables for which we find
+    # columns are cached, so that any other table falls back to querying the catalog directly
+    for row in prefetch(column_statement):
+        key = (row[0], row[1])
+        if key in candidates:
+            if key not in prefetched:
+                prefetched[key] = {'descr': [], 'pks': [], 'fks': [], 'grants': []}
+            prefetched[key]['descr'].append(row[2:])
+
+    # primary keys in the format returned by the query in get_primary_key()
+    for row in prefetch(pk_statement):
+        key = (row[0], row[1])
+        if key in prefetched:
+            prefetched[key]['pks'].append(row[2:])
+
+    # foreign keys in the format returned by the query in get_foreign_keys()
+    for row in prefetch(fk_statement):
+        key = (row[0], row[1])
+        if key in prefetched:
+            prefetched[key]['fks'].append(row[2:])
+
+    # grants in the format returned by the query in get_grants()
+    for row in prefetch(grants_statement):
+        key = (row[0], row[1])
+        if key in prefetched:
+            prefetched[key]['grants'].append(row)
+
+    catalog = prefetched
+
+    if debug:
+        comment("Prefetched catalog information for %s of %s tables" % (len(catalog), len(candidates)))
+
+
 def run_commands(conn, commands):
     cursor = conn.cursor()
 
@@ -444,26 +662,170 @@ def run_commands(conn, commands):
     return True
 
 
-def reduce_column_length(col_type, column_name, table_name):
-    set_col_type = col_type
+def get_chunk_ranges(schema_name, table_name, sort_column, col_type):
+    # split the values of the leading sort key column of a table into copy_chunks ranges of equal width between its
+    # minimum and maximum. Returns the where clause of each range, or None if the table can't be split
+    col_type = get_create_type(col_type).strip()
 
-    # analyze the current size length for varchar columns and return early if they are below the threshold
-    if "varchar" in col_type:
-        curr_col_length = int(re.search(r'\d+', col_type).group())
-        if curr_col_length < STRING_REDUCTION_MAX_LENGTH_THRESHOLD:
-            return col_type
+    if not col_type.startswith(CHUNK_RANGE_TYPES):
+        comment("Unable to split the copy of %s.%s on sort key column '%s' of type %s" % (
+            schema_name, table_name, sort_column, col_type))
+        return None
+
+    statement = 'select /* computing sort key range */ min("%s"), max("%s") from %s."%s"' % (
+        sort_column, sort_column, schema_name, table_name)
+
+    if debug:
+        comment(statement)
+
+    low, high = execute_query(statement)[0]
+
+    if low is None or low == high:
+        return None
+
+    boundaries = []
+    for i in range(1, copy_chunks):
+        if isinstance(low, (datetime.date, datetime.datetime)):
+            boundary = low + (high - low) // copy_chunks * i
+        elif isinstance(low, numbers.Integral):
+            boundary = low + (high - low) * i // copy_chunks
         else:
-            col_len_statement = 'select /* computing max column length */ max(octet_length("%s")) from %s."%s"' % (
-                column_name, schema_name, table_name)
+            boundary = low + (high - low) * i / copy_chunks
+
+        # small ranges may not split into as many distinct boundaries as requested
+        if boundary > low and (len(boundaries) == 0 or boundary > boundaries[-1]):
+            boundaries.append(boundary)
+
+    if len(boundaries) == 0:
+        return None
+
+    def literal(value):
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return "'%s'" % value
+        else:
+            return str(value)
+
+    column = '"%s"' % sort_column
+    ranges = ['%s < %s' % (column, literal(boundaries[0]))]
+    for i in range(1, len(boundaries)):
+        ranges.append('%s >= %s and %s < %s' % (column, literal(boundaries[i - 1]), column, literal(boundaries[i])))
+    ranges.append('(%s >= %s or %s is null)' % (column, literal(boundaries[-1]), column))
+
+    return ranges
+
+
+def run_chunked_copy(schema_name, table_name, copy_groups, fks):
+    # run the creation of the new table, each chunk of the copy in its own transaction, and then the rename, as
+    # generated in analyze(). Each chunk is retried on failure, and its completion is journaled so that a resumed run
+    # continues with the next chunk
+    conn = get_pg_conn()
+    chunk_count = len(copy_groups) - 2
+    chunks_copied = 0
+
+    if (schema_name, table_name) in resumed_copies:
+        resumed = resumed_copies[(schema_name, table_name)]
+
+        if resumed[1] != chunk_count:
+            print("Unable to resume the copy of %s.%s made in %s chunks with %s chunks" % (
+                schema_name, table_name, resumed[1], chunk_count))
+            return False
+
+        chunks_copied = resumed[0]
+        comment("Resuming copy of %s.%s after %s of %s chunks" % (schema_name, table_name, chunks_copied, chunk_count))
     else:
-        col_len_statement = 'select /* computing max column length */ max(abs("%s")) from %s."%s"' % (
-            column_name, schema_name, table_name)
+        if not run_commands(conn, copy_groups[0]):
+            return False
+
+    journal_table(schema_name, table_name, JOURNAL_COPYING, fks, chunks_copied, chunk_count)
+
+    for i in range(chunks_copied, chunk_count):
+        comment("Copying chunk %s of %s for %s.%s" % (i + 1, chunk_count, schema_name, table_name))
+
+        attempt_count = 0
+        copied = False
+        while attempt_count < CHUNK_RETRY and not copied:
+            copied = run_commands(conn, copy_groups[i + 1])
+
+            if not copied:
+                attempt_count += 1
+
+                # Exponential Backoff
+                time.sleep(2 ** attempt_count * RETRY_TIMEOUT)
+
+        if not copied:
+            return False
+
+        journal_table(schema_name, table_name, JOURNAL_COPYING, fks, i + 1, chunk_count)
+
+    return run_commands(conn, copy_groups[-1])
+
+
+def run_autocommit_commands(conn, commands):
+    # run commands which can't be run inside a transaction block, such as alter column encode. Queries run earlier
+    # on the connection, such as the disk usage or column width profiling, leave a transaction open which enabling
+    # autocommit doesn't close, so it's ended first
+    conn.commit()
+    conn.autocommit = True
+
+    try:
+        return run_commands(conn, commands)
+    finally:
+        conn.autocommit = False
+
+
+def emit_table_metric(table_name):
+    # emit a cloudwatch metric for a table whose encoding was modified
+    if cw is not None:
+        dimensions = [
+            {'Name': 'ClusterIdentifier', 'Value': db_host.split('.')[0]},
+            {'Name': 'TableName', 'Value': table_name}
+        ]
+        aws_utils.put_metric(cw, 'Redshift', 'ColumnEncodingModification', dimensions, None, 1, 'Count')
+        if debug:
+            comment("Emitted Cloudwatch Metric for Column Encoded table")
+
+
+def get_create_type(col_type):
+    # fix datatypes from the description type to the create type
+    return col_type.replace('character varying', 'varchar').replace('without time zone', '')
+
+
+def is_width_candidate(col_type):
+    # varchar columns above the reduction threshold, and integer columns which could be stored as a smaller type
+    if "varchar" in col_type:
+        return int(re.search(r'\d+', col_type).group()) >= STRING_REDUCTION_MAX_LENGTH_THRESHOLD
+    else:
+        return col_type in ('integer', 'bigint')
+
+
+def profile_column_widths(schema_name, table_name, descr):
+    # compute the maximum length of all candidate varchar columns and the minimum and maximum values of all candidate
+    # integer columns of a table in a single aggregate query, so that the table is scanned once rather than per column
+    profile_columns = []
+    aggregates = []
+    for col in descr:
+        col_type = get_create_type(descr[col][1])
+
+        if is_width_candidate(col_type):
+            profile_columns.append(col)
+
+            if "varchar" in col_type:
+                aggregates.extend(['max(octet_length("%s"))' % col, 'null'])
+            else:
+                aggregates.extend(['min("%s")' % col, 'max("%s")' % col])
+
+    column_profile = {}
+
+    if len(profile_columns) == 0:
+        return column_profile
+
+    col_len_statement = 'select /* computing column widths */ %s from %s."%s"' % (
+        ', '.join(aggregates), schema_name, table_name)
 
     if debug:
         comment(col_len_statement)
 
-    comment("Analyzing max length of column '%s' for table '%s.%s' " % (
-        column_name, schema_name, table_name))
+    comment("Analyzing width of %s columns for table '%s.%s' " % (len(profile_columns), schema_name, table_name))
 
     # run the analyze in a loop, because it could be locked by another process modifying rows
     # and get a timeout
@@ -475,9 +837,6 @@ def reduce_column_length(col_type, column_name, table_name):
     while col_len_attempt_count < col_len_retry and col_len_result is None:
         try:
             col_len_result = execute_query(col_len_statement)
-            col_max_len = col_len_result[0][0]
-            if col_max_len is None:
-                col_max_len = 0
         except KeyboardInterrupt:
             # To handle Ctrl-C from user
             cleanup(get_pg_conn())
@@ -492,13 +851,42 @@ def reduce_column_length(col_type, column_name, table_name):
 
     if col_len_result is None:
         if col_len_last_exception is not None:
-            print("Unable to determine length of %s for table %s due to Exception %s" % (
-                column_name, table_name, col_len_last_exception.message))
+            print("Unable to determine column widths for table %s due to Exception %s" % (
+                table_name, col_len_last_exception))
             raise col_len_last_exception
         else:
             print(
-                "Unable to determine length of %s for table %s due to Null response to query. No changes will be made" % (
-                    column_name, table_name))
+                "Unable to determine column widths for table %s due to Null response to query. No changes will be made" % (
+                    table_name))
+            return column_profile
+
+    # map the profile values back to their columns, as (max length, None) for varchar or (min, max) for integers
+    for i, col in enumerate(profile_columns):
+        column_profile[col] = (col_len_result[0][i * 2], col_len_result[0][i * 2 + 1])
+
+        if debug:
+            comment("Column width profile of '%s' for table '%s.%s' is %s" % (
+                col, schema_name, table_name, str(column_profile[col])))
+
+    return column_profile
+
+
+def reduce_column_length(col_type, column_name, table_name, column_profile):
+    # determine the reduced type of a column from its profile computed by profile_column_widths()
+    set_col_type = col_type
+
+    if column_name not in column_profile:
+        return col_type
+
+    if "varchar" in col_type:
+        curr_col_length = int(re.search(r'\d+', col_type).group())
+        col_max_len = column_profile[column_name][0]
+    else:
+        col_min, col_max = column_profile[column_name]
+        col_max_len = max(abs(col_min) if col_min is not None else 0, abs(col_max) if col_max is not None else 0)
+
+    if col_max_len is None:
+        col_max_len = 0
 
     if "varchar" in col_type:
         new_column_len = int(col_max_len * (1 + COL_LENGTH_EXPANSION_BUFFER))
@@ -530,6 +918,485 @@ def reduce_column_length(col_type, column_name, table_name):
     return set_col_type
 
 
+def get_analyze_cache_conn():
+    # open a connection to the analyze compression cache. Each process opens its own connection, and sqlite
+    # serialises writes from concurrent workers
+    conn = sqlite3.connect(analyze_cache, timeout=60)
+    conn.execute('''create table if not exists analyze_compression (
+        db_host text, db text, table_oid integer, schema_name text, table_name text, rows integer, mbytes integer,
+        comprows integer, result text, analyzed_at real, primary key (db_host, db, table_oid))''')
+
+    return conn
+
+
+def get_cached_analysis(table_info):
+    # return the analyze compression result of the table from an analysis earlier in this run, or the stored result
+    # if its oid, row count and block count are unchanged since it was analyzed and the result is within the cache ttl
+    if compression_results is not None and (table_info[0], table_info[1]) in compression_results:
+        return compression_results[(table_info[0], table_info[1])]
+
+    if analyze_cache is None or force or len(table_info) < 8:
+        return None
+
+    conn = get_analyze_cache_conn()
+    try:
+        cached = conn.execute('''select result from analyze_compression
+            where db_host = ? and db = ? and table_oid = ? and rows = ? and mbytes = ? and comprows = ?
+            and analyzed_at > ?''', (db_host, db, table_info[7], table_info[3], table_info[2],
+                                     comprows if comprows is not None else -1,
+                                     time.time() - float(analyze_cache_ttl) * 3600)).fetchone()
+    finally:
+        conn.close()
+
+    if cached is None:
+        return None
+    else:
+        return json.loads(cached[0])
+
+
+def cache_analysis(table_info, analyze_compression_result):
+    # store the analyze compression result for the table along with its change fingerprint
+    if analyze_cache is None or len(table_info) < 8:
+        return
+
+    result = []
+    for row in analyze_compression_result:
+        result.append([row[0], row[1], row[2], float(row[3]) if row[3] is not None else None])
+
+    conn = get_analyze_cache_conn()
+    try:
+        conn.execute('''insert or replace into analyze_compression
+            (db_host, db, table_oid, schema_name, table_name, rows, mbytes, comprows, result, analyzed_at)
+            values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', (db_host, db, table_info[7], table_info[0], table_info[1],
+                                                   table_info[3], table_info[2],
+                                                   comprows if comprows is not None else -1, json.dumps(result),
+                                                   time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_journal_conn():
+    # open a connection to the run journal. Each process opens its own connection, and sqlite serialises writes
+    # from concurrent workers
+    conn = sqlite3.connect(journal, timeout=60)
+    conn.execute('''create table if not exists run_journal (
+        schema_name text, table_name text, state text, fk_statements text, chunks_copied integer,
+        chunk_count integer, updated_at real, primary key (schema_name, table_name))''')
+
+    return conn
+
+
+def journal_table(schema_name, table_name, state, fk_statements=None, chunks_copied=None, chunk_count=None):
+    # record the processing state of a table in the run journal, and the progress of a chunked deep copy
+    if journal is None:
+        return
+
+    conn = get_journal_conn()
+    try:
+        conn.execute('''insert or replace into run_journal
+            (schema_name, table_name, state, fk_statements, chunks_copied, chunk_count, updated_at)
+            values (?, ?, ?, ?, ?, ?, ?)''', (schema_name, table_name, state,
+                                             json.dumps(fk_statements) if fk_statements is not None else None,
+                                             chunks_copied, chunk_count, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def journal_fks_applied():
+    # mark all tables which have been migrated as having had their foreign keys applied
+    if journal is None:
+        return
+
+    conn = get_journal_conn()
+    try:
+        conn.execute("update run_journal set state = ?, updated_at = ? where state in (?, ?)",
+                     (JOURNAL_FK_APPLIED, time.time(), JOURNAL_COPIED, JOURNAL_RENAMED))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_journal_state():
+    # returns the journaled state, foreign key statements, and chunked copy progress of all tables, keyed by
+    # (schema, table)
+    conn = get_journal_conn()
+    try:
+        rows = conn.execute('''select schema_name, table_name, state, fk_statements, chunks_copied, chunk_count
+            from run_journal''').fetchall()
+    finally:
+        conn.close()
+
+    journal_state = {}
+    for row in rows:
+        journal_state[(row[0], row[1])] = (row[2], json.loads(row[3]) if row[3] is not None else None, row[4],
+                                           row[5])
+
+    return journal_state
+
+
+def clear_journal():
+    conn = get_journal_conn()
+    try:
+        conn.execute("delete from run_journal")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def init_disk_governor(reserved_mb, condition):
+    # called in each worker process to share the disk space reservations of the pool
+    global disk_reserved_mb
+    global disk_condition
+
+    disk_reserved_mb = reserved_mb
+    disk_condition = condition
+
+
+def get_disk_usage():
+    # returns the capacity and used space of the cluster in megabytes
+    statement = 'select /* fetching disk usage */ sum(capacity), sum(used) from stv_partitions where part_begin = 0'
+
+    if debug:
+        comment(statement)
+
+    result = execute_query(statement)
+
+    return int(result[0][0]), int(result[0][1])
+
+
+def admit_copy(schema_name, table_name, footprint_mb):
+    # block until the deep copy of a table, which temporarily needs footprint_mb of additional space, fits under the
+    # configured disk usage ceiling together with all other running copies. Returns False if it can never fit
+    if max_disk_pct is None or disk_condition is None:
+        return True
+
+    with disk_condition:
+        while True:
+            capacity, used = get_disk_usage()
+
+            # used space already includes the blocks written so far by running copies, so this is conservative
+            projected_pct = (used + disk_reserved_mb.value + footprint_mb) * 100.0 / capacity
+
+            if projected_pct <= max_disk_pct:
+                disk_reserved_mb.value += footprint_mb
+
+                if debug:
+                    comment("Admitted copy of %s.%s (%sMB) with projected disk usage of %.1f%%" % (
+                        schema_name, table_name, footprint_mb, projected_pct))
+
+                return True
+            elif disk_reserved_mb.value == 0:
+                # no other copies are running which could free up space
+                comment("Copy of %s.%s (%sMB) would raise disk usage to %.1f%%, above the ceiling of %s%%" % (
+                    schema_name, table_name, footprint_mb, projected_pct, max_disk_pct))
+                return False
+            else:
+                comment("Waiting for disk space to copy %s.%s (%sMB): projected disk usage %.1f%%" % (
+                    schema_name, table_name, footprint_mb, projected_pct))
+                disk_condition.wait(DISK_ADMISSION_WAIT_SECONDS)
+
+
+def release_copy(footprint_mb):
+    # release the disk space reserved by admit_copy(), and wake up any copies waiting for space
+    if max_disk_pct is None or disk_condition is None:
+        return
+
+    with disk_condition:
+        disk_reserved_mb.value -= footprint_mb
+        disk_condition.notify_all()
+
+
+def order_by_size(table_list):
+    # order the candidate tables largest first, using the mbytes and then rows columns returned by the candidate
+    # query, so that the biggest tables start first and don't leave a single worker busy at the tail of the run
+    def table_size(table_info):
+        mbytes = table_info[2] if table_info[2] is not None else 0
+        rows = table_info[3] if table_info[3] is not None else 0
+        return mbytes, rows
+
+    return sorted(table_list, key=table_size, reverse=True)
+
+
+def get_compression_analysis(table_info):
+    # run analyze compression on a table, or reuse a previous result for it if available. Returns the analysis, or
+    # an error code if the table could not be analyzed
+    schema_name = table_info[0]
+    table_name = table_info[1]
+
+    statement = 'analyze compression %s."%s"' % (schema_name, table_name)
+
+    if comprows is not None:
+        statement = statement + (" comprows %s" % int(comprows))
+
+    if debug:
+        comment(statement)
+
+    # reuse a previous analysis if the table has not changed since
+    analyze_compression_result = get_cached_analysis(table_info)
+    used_cache = analyze_compression_result is not None
+
+    if used_cache:
+        comment("Using cached analysis for Table '%s.%s'" % (schema_name, table_name,))
+    else:
+        comment("Analyzing Table '%s.%s'" % (schema_name, table_name,))
+
+    # run the analyze in a loop, because it could be locked by another process modifying rows and get a timeout
+    analyze_retry = 10
+    attempt_count = 0
+    last_exception = None
+    while attempt_count < analyze_retry and analyze_compression_result is None:
+        try:
+            analyze_compression_result = execute_query(statement)
+            # Commiting otherwise anaylze keep an exclusive lock until a commit arrive which can be very long
+            execute_query('commit;')
+        except KeyboardInterrupt:
+            # To handle Ctrl-C from user
+            cleanup(get_pg_conn())
+            return TERMINATED_BY_USER
+        except Exception as e:
+            execute_query('rollback;')
+            print(e)
+            attempt_count += 1
+            last_exception = e
+
+            # Exponential Backoff
+            time.sleep(2 ** attempt_count * RETRY_TIMEOUT)
+
+    if analyze_compression_result is None:
+        if last_exception is not None:
+            print("Unable to analyze %s due to Exception %s" % (table_name, last_exception))
+        else:
+            print("Unknown Error")
+        return ERROR
+    elif not used_cache:
+        cache_analysis(table_info, analyze_compression_result)
+
+    return analyze_compression_result
+
+
+def record_throughput(mode, rewrite_mb, seconds):
+    # store the throughput of a table modification in the analyze cache, to estimate the runtime of future runs
+    if analyze_cache is None or seconds <= 0:
+        return
+
+    conn = get_analyze_cache_conn()
+    try:
+        conn.execute('''create table if not exists throughput (
+            db_host text, db text, mode text, mbytes real, seconds real, completed_at real)''')
+        conn.execute("insert into throughput (db_host, db, mode, mbytes, seconds, completed_at) values (?, ?, ?, ?, ?, ?)",
+                     (db_host, db, mode, rewrite_mb, seconds, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_throughput(mode):
+    # returns the megabytes per second rewritten by previous runs against this cluster with the given mode, or None
+    # if no runs have been recorded
+    if analyze_cache is None:
+        return None
+
+    conn = get_analyze_cache_conn()
+    try:
+        conn.execute('''create table if not exists throughput (
+            db_host text, db text, mode text, mbytes real, seconds real, completed_at real)''')
+        history = conn.execute("select sum(mbytes), sum(seconds) from throughput where db_host = ? and db = ? and mode = ?",
+                               (db_host, db, mode)).fetchone()
+    finally:
+        conn.close()
+
+    if history is None or history[0] is None or not history[1]:
+        return None
+    else:
+        return history[0] / history[1]
+
+
+def plan_table(table_info, mode, statements, fks, columns, analyze_compression_result, descr):
+    # describe the planned modification of a table for the plan output
+    saving_mb, rewrite_mb = estimate_savings(table_info, analyze_compression_result, descr,
+                                             mode == MODE_ALTER_IN_PLACE)
+    throughput = get_throughput(mode)
+
+    return {
+        'schema': table_info[0],
+        'table': table_info[1],
+        'mode': mode,
+        'rows': int(table_info[3]) if table_info[3] is not None else None,
+        'mbytes': int(table_info[2]) if table_info[2] is not None else None,
+        'rewrite_rows': int(table_info[3]) if table_info[3] is not None else None,
+        'rewrite_bytes': int(rewrite_mb * 1024 * 1024),
+        'estimated_saving_bytes': int(saving_mb * 1024 * 1024),
+        'estimated_runtime_seconds': int(math.ceil(rewrite_mb / throughput)) if throughput else None,
+        'columns': columns,
+        'statements': [x for x in statements if x is not None],
+        'foreign_keys': fks if fks is not None else []
+    }
+
+
+def write_plan(plan):
+    # write the planned modifications of all tables to the plan output file
+    total_runtime = 0
+    for p in plan:
+        if p['estimated_runtime_seconds'] is None:
+            total_runtime = None
+            break
+        total_runtime += p['estimated_runtime_seconds']
+
+    output = {
+        'cluster': db_host,
+        'database': db,
+        'schema': schema_name,
+        'generated_at': datetime.datetime.utcnow().isoformat(),
+        'do_execute': do_execute,
+        'table_count': len(plan),
+        'total_rewrite_bytes': sum([p['rewrite_bytes'] for p in plan]),
+        'total_estimated_saving_bytes': sum([p['estimated_saving_bytes'] for p in plan]),
+        'total_estimated_runtime_seconds': total_runtime,
+        'tables': plan
+    }
+
+    with open(plan_output, 'w') as f:
+        json.dump(output, f, indent=2)
+
+    comment("Wrote plan for %s table(s) to %s" % (len(plan), plan_output))
+
+
+def get_column_width(col_type):
+    # estimate the average width in bytes of an uncompressed value of the given type, used to weight the expected
+    # saving of each column by its share of the table
+    col_type = get_create_type(col_type).strip()
+
+    if col_type == 'smallint':
+        return 2
+    elif col_type in ('integer', 'real', 'date'):
+        return 4
+    elif col_type in ('bigint', 'double precision') or col_type.startswith('timestamp') or col_type.startswith(
+            'time'):
+        return 8
+    elif col_type == 'boolean':
+        return 1
+    elif col_type.startswith('numeric'):
+        precision = re.search(r'\d+', col_type)
+        return 16 if precision is not None and int(precision.group()) > 18 else 8
+    else:
+        # character types, using the declared length where there is one
+        length = re.search(r'\d+', col_type)
+        return int(length.group()) if length is not None else 256
+
+
+def estimate_savings(table_info, analyze_compression_result, descr, in_place=None):
+    # estimate the megabytes saved by applying the recommended encodings to a table, from each changed column's
+    # est_reduction_pct weighted by its share of the table size, and the megabytes rewritten to apply them. Returns
+    # (saving, rewritten)
+    table_mbytes = table_info[2] if table_info[2] is not None else 0
+
+    total_width = 0
+    for col in descr:
+        total_width += get_column_width(descr[col][1])
+
+    if total_width == 0:
+        return 0, 0
+
+    saving_mb = 0.0
+    changed_mb = 0.0
+    for row in analyze_compression_result:
+        col = row[1]
+
+        if col not in descr:
+            continue
+
+        old_encoding = 'raw' if descr[col][2] == 'none' else descr[col][2]
+
+        # the first sortkey column is always left raw
+        if abs(descr[col][4]) != 1 and row[2] != old_encoding:
+            column_mb = table_mbytes * float(get_column_width(descr[col][1])) / total_width
+            changed_mb += column_mb
+            saving_mb += column_mb * float(row[3] if row[3] is not None else 0) / 100
+
+    # an in place change only rewrites the changed columns, while a deep copy rewrites the whole table
+    if in_place is None:
+        in_place = alter_in_place
+
+    rewrite_mb = changed_mb if in_place else table_mbytes
+
+    return saving_mb, rewrite_mb
+
+
+def estimate_table_savings(table_info):
+    # analyze a table and estimate the saving of applying the recommended encodings, without generating any
+    # statements. Returns (table_info, analysis, saving, rewritten), with no analysis if the table needs no changes
+    try:
+        output = get_count_raw_columns(table_info[0], table_info[1])
+
+        if (output is None or output[0][0] == 0) and not force:
+            return table_info, None, 0, 0
+
+        analyze_compression_result = get_compression_analysis(table_info)
+
+        if analyze_compression_result == ERROR or analyze_compression_result == TERMINATED_BY_USER:
+            return table_info, None, 0, 0
+
+        saving_mb, rewrite_mb = estimate_savings(table_info, analyze_compression_result,
+                                                 get_table_desc(table_info[0], table_info[1]))
+
+        return table_info, list(analyze_compression_result), saving_mb, rewrite_mb
+    except Exception as e:
+        print('Exception %s during estimation of savings for %s' % (e, table_info[1]))
+        print(traceback.format_exc())
+        return table_info, None, 0, 0
+
+
+def select_by_savings(table_names):
+    # analyze all tables, rank them by the expected saving per megabyte rewritten, and select the tables which meet
+    # the minimum savings percentage while the total megabytes rewritten stays within the savings budget
+    global compression_results
+
+    comment("Estimating savings for %s table(s)..." % len(table_names))
+
+    if threads > 1:
+        p = Pool(threads)
+        try:
+            estimates = p.map(estimate_table_savings, table_names)
+        finally:
+            p.terminate()
+    else:
+        estimates = [estimate_table_savings(t) for t in table_names]
+
+    # the highest saving per megabyte rewritten first
+    candidates = [e for e in estimates if e[1] is not None and e[3] > 0]
+    candidates.sort(key=lambda e: e[2] / e[3], reverse=True)
+
+    compression_results = {}
+    selected = []
+    budget_used_mb = 0
+    for table_info, analyze_compression_result, saving_mb, rewrite_mb in candidates:
+        savings_pct = saving_mb * 100 / rewrite_mb
+
+        if min_savings_pct is not None and not force and savings_pct < min_savings_pct:
+            if debug:
+                comment("Skipping %s.%s with expected saving of %.1f%%" % (table_info[0], table_info[1], savings_pct))
+            continue
+
+        if savings_budget_mb is not None and budget_used_mb + rewrite_mb > savings_budget_mb:
+            if debug:
+                comment("Skipping %s.%s as rewriting %dMB would exceed the budget" % (
+                    table_info[0], table_info[1], rewrite_mb))
+            continue
+
+        comment("Selected %s.%s: expected saving %dMB (%.1f%%) for %dMB rewritten" % (
+            table_info[0], table_info[1], saving_mb, savings_pct, rewrite_mb))
+
+        budget_used_mb += rewrite_mb
+        compression_results[(table_info[0], table_info[1])] = analyze_compression_result
+        selected.append(table_info)
+
+    comment("Selected %s of %s table(s), rewriting %dMB" % (len(selected), len(table_names), budget_used_mb))
+
+    return selected
+
+
 def analyze(table_info):
     schema_name = table_info[0]
     table_name = table_info[1]
@@ -555,52 +1422,24 @@ def analyze(table_info):
 
     if not table_unoptimised and not force:
         comment("Table %s.%s does not require encoding optimisation" % (schema_name, table_name))
+        journal_table(schema_name, table_name, JOURNAL_UNCHANGED)
         return OK
     else:
         comment("Table %s.%s contains %s unoptimised columns" % (schema_name, table_name, count_unoptimised))
         if force:
             comment("Using Force Override Option")
 
-        statement = 'analyze compression %s."%s"' % (schema_name, table_name)
-
-        if comprows is not None:
-            statement = statement + (" comprows %s" % int(comprows))
-
         try:
-            if debug:
-                comment(statement)
+            analyze_compression_result = get_compression_analysis(table_info)
 
-            comment("Analyzing Table '%s.%s'" % (schema_name, table_name,))
+            if analyze_compression_result == ERROR or analyze_compression_result == TERMINATED_BY_USER:
+                return analyze_compression_result
 
-            # run the analyze in a loop, because it could be locked by another process modifying rows and get a timeout
-            analyze_compression_result = None
-            analyze_retry = 10
-            attempt_count = 0
-            last_exception = None
-            while attempt_count < analyze_retry and analyze_compression_result is None:
-                try:
-                    analyze_compression_result = execute_query(statement)
-                    # Commiting otherwise anaylze keep an exclusive lock until a commit arrive which can be very long
-                    execute_query('commit;')
-                except KeyboardInterrupt:
-                    # To handle Ctrl-C from user
-                    cleanup(get_pg_conn())
-                    return TERMINATED_BY_USER
-                except Exception as e:
-                    execute_query('rollback;')
-                    print(e)
-                    attempt_count += 1
-                    last_exception = e
-
-                    # Exponential Backoff
-                    time.sleep(2 ** attempt_count * RETRY_TIMEOUT)
-
-            if analyze_compression_result is None:
-                if last_exception is not None:
-                    print("Unable to analyze %s due to Exception %s" % (table_name, last_exception.message))
-                else:
-                    print("Unknown Error")
-                return ERROR
+            # a resumed chunked copy stays journaled as copying with its chunk progress until it completes
+            resuming_copy = (schema_name, table_name) in resumed_copies
+
+            if not resuming_copy:
+                journal_table(schema_name, table_name, JOURNAL_ANALYZED)
 
             if target_schema is None:
                 set_target_schema = schema_name
@@ -625,10 +1464,22 @@ def analyze(table_info):
             has_identity = False
             non_identity_columns = []
             fks = []
+            plan = None
+            column_plan = []
+            modified_columns = []
+            column_types_modified = False
             table_distkey = None
             table_sortkeys = []
             new_sortkey_arr = [t.strip() for t in new_sort_keys.split(',')] if new_sort_keys is not None else []
 
+            # profile the widths of all candidate columns in a single scan of the table
+            column_profile = {}
+            if analyze_col_width:
+                column_profile = profile_column_widths(schema_name, table_name, descr)
+
+                if column_profile == TERMINATED_BY_USER:
+                    return TERMINATED_BY_USER
+
             # count of suggested optimizations
             count_optimized = 0
             # process each item given back by the analyze request
@@ -646,20 +1497,22 @@ def analyze(table_info):
                 if new_encoding != old_encoding:
                     encodings_modified = True
                     count_optimized += 1
+                    modified_columns.append((col, new_encoding))
 
                     if debug:
                         comment("Column %s will be modified from %s encoding to %s encoding" % (
                             col, old_encoding, new_encoding))
 
                 # fix datatypes from the description type to the create type
-                col_type = descr[col][1].replace('character varying', 'varchar').replace('without time zone', '')
+                col_type = get_create_type(descr[col][1])
 
                 # check whether columns are too wide
                 if analyze_col_width and ("varchar" in col_type or "int" in col_type):
-                    new_col_type = reduce_column_length(col_type, descr[col][0], table_name)
+                    new_col_type = reduce_column_length(col_type, descr[col][0], table_name, column_profile)
                     if new_col_type != col_type:
                         col_type = new_col_type
                         encodings_modified = True
+                        column_types_modified = True
 
                 # link in the existing distribution key, or set the new one
                 row_distkey = descr[col][3]
@@ -722,6 +1575,10 @@ def analyze(table_info):
                     default_value = ''
                     non_identity_columns.append(col)
 
+                column_plan.append({'column': col, 'type': col_type.strip(), 'old_encoding': old_encoding,
+                                    'new_encoding': compression.lower(),
+                                    'est_reduction_pct': float(row[3]) if row[3] is not None else None})
+
                 # add the formatted column specification
                 encode_columns.extend(['"%s" %s %s %s encode %s %s'
                                        % (col, col_type, default_value, col_null, compression, distkey)])
@@ -741,10 +1598,88 @@ def analyze(table_info):
                 comment(msg)
                 raise Exception(msg)
 
+            # determine whether the changes can be applied with alter column encode, rather than a deep copy
+            in_place_fallback = None
+            if alter_in_place:
+                if new_dist_key is not None or new_sort_keys is not None:
+                    in_place_fallback = "the distribution or sort keys are being changed"
+                elif set_target_schema != schema_name:
+                    in_place_fallback = "a target schema is being used"
+                elif column_types_modified:
+                    in_place_fallback = "column widths are being reduced"
+                elif has_zindex_sortkeys:
+                    in_place_fallback = "the table has an interleaved sort key"
+                elif len(modified_columns) == 0:
+                    in_place_fallback = "no column encodings are being changed"
+
+            # estimate the saving of the change, relative to the data rewritten to apply it
+            savings_pct = None
+            if min_savings_pct is not None and encodings_modified and not column_types_modified:
+                saving_mb, rewrite_mb = estimate_savings(table_info, analyze_compression_result, descr)
+                savings_pct = saving_mb * 100 / rewrite_mb if rewrite_mb > 0 else 0
+
             # if this table's encodings have not changed, then don't do a modification, unless force options is set
             if (not force) and (not encodings_modified):
                 comment("Column Encoding resulted in an identical table - no changes will be made")
+                journal_table(schema_name, table_name, JOURNAL_UNCHANGED)
+            elif (not force) and savings_pct is not None and savings_pct < min_savings_pct:
+                comment("Expected saving of %.1f%% is below the minimum of %s%% - no changes will be made" % (
+                    savings_pct, min_savings_pct))
+                journal_table(schema_name, table_name, JOURNAL_UNCHANGED)
+                encodings_modified = False
+            elif alter_in_place and in_place_fallback is None:
+                comment("Column Encoding will be modified in place for %s.%s" % (schema_name, table_name))
+
+                # only the changed columns are rewritten. Alter column encode can't run inside a transaction block
+                for col, encoding in modified_columns:
+                    statements.extend(['alter table %s."%s" alter column "%s" encode %s;' % (
+                        schema_name, table_name, col, encoding)])
+
+                if not resuming_copy:
+                    journal_table(schema_name, table_name, JOURNAL_PLANNED)
+
+                if plan_output is not None:
+                    plan = plan_table(table_info, MODE_ALTER_IN_PLACE, statements, None, column_plan,
+                                      analyze_compression_result, descr)
+
+                if do_execute:
+                    # each altered column is rewritten alongside the existing one, so estimate the additional space
+                    # as the modified columns' share of the table
+                    footprint_mb = int(math.ceil((table_info[2] if table_info[2] is not None else 0) * float(
+                        len(modified_columns)) / len(analyze_compression_result)))
+
+                    if not admit_copy(schema_name, table_name, footprint_mb):
+                        if not ignore_errors:
+                            return ERROR
+                        else:
+                            print_statements(statements)
+                            return (OK, None, False)
+
+                    try:
+                        start_time = time.time()
+                        altered = run_autocommit_commands(get_pg_conn(), statements)
+                    finally:
+                        release_copy(footprint_mb)
+
+                    if not altered:
+                        if not ignore_errors:
+                            if debug:
+                                print("Error running statements: %s" % (str(statements),))
+                            return ERROR
+                    else:
+                        journal_table(schema_name, table_name, JOURNAL_ALTERED)
+                        record_throughput(MODE_ALTER_IN_PLACE, estimate_savings(
+                            table_info, analyze_compression_result, descr, True)[1], time.time() - start_time)
+
+                    # emit a cloudwatch metric for the table
+                    emit_table_metric(table_name)
+                else:
+                    comment("No encoding modifications run for %s.%s" % (schema_name, table_name))
             else:
+                if alter_in_place:
+                    comment("Column Encoding can't be modified in place for %s.%s as %s - using a deep copy" % (
+                        schema_name, table_name, in_place_fallback))
+
                 comment("Column Encoding will be modified for %s.%s" % (schema_name, table_name))
 
                 # add all the column encoding statements on to the create table statement, suppressing the leading
@@ -804,11 +1739,37 @@ def analyze(table_info):
                                                                             schema_name,
                                                                             table_name)
                 if len(table_sortkeys) > 0:
-                    insert = "%s order by \"%s\";" % (insert, ",".join(table_sortkeys).replace(',', '\",\"'))
+                    order_by = " order by \"%s\";" % (",".join(table_sortkeys).replace(',', '\",\"'))
                 else:
-                    insert = "%s;" % (insert)
-
-                statements.extend([insert])
+                    order_by = ";"
+
+                # split the copy into ranges of the leading sort key
+                chunk_ranges = None
+                if copy_chunks is not None and copy_chunks > 1:
+                    if has_zindex_sortkeys or 1 not in sortkeys:
+                        comment("Copy of %s.%s can't be split as it has no compound sort key" % (
+                            schema_name, table_name))
+                    else:
+                        chunk_ranges = get_chunk_ranges(schema_name, table_name, sortkeys[1], descr[sortkeys[1]][1])
+
+                copy_groups = None
+                if chunk_ranges is not None:
+                    # commit the new table, and then copy each range in its own transaction which first removes any
+                    # rows of a previous attempt, so that a failed chunk can be retried without losing the others
+                    statements.extend(['commit;'])
+                    copy_groups = [statements]
+
+                    for where in chunk_ranges:
+                        copy_groups.append(['begin;',
+                                            'delete from %s."%s" where %s;' % (set_target_schema, target_table, where),
+                                            '%s where %s%s' % (insert, where, order_by),
+                                            'commit;'])
+
+                    # the remaining statements rename the tables atomically once all chunks have been copied
+                    statements = ['begin;', 'lock table %s."%s";' % (schema_name, table_name)]
+                    copy_groups.append(statements)
+                else:
+                    statements.extend([insert + order_by])
 
                 # analyze the new table
                 analyze = 'analyze %s."%s";' % (set_target_schema, target_table)
@@ -841,22 +1802,49 @@ def analyze(table_info):
 
                 statements.extend(['commit;'])
 
+                if copy_groups is not None:
+                    statements = [c for group in copy_groups for c in group]
+
+                if not resuming_copy:
+                    journal_table(schema_name, table_name, JOURNAL_PLANNED, fks)
+
+                if plan_output is not None:
+                    plan = plan_table(table_info, MODE_DEEP_COPY, statements, fks, column_plan,
+                                      analyze_compression_result, descr)
+
                 if do_execute:
-                    if not run_commands(get_pg_conn(), statements):
+                    # the new table is built alongside the existing one, so the copy needs as much space again
+                    footprint_mb = table_info[2] if table_info[2] is not None else 0
+
+                    if not admit_copy(schema_name, table_name, footprint_mb):
+                        if not ignore_errors:
+                            return ERROR
+                        else:
+                            print_statements(statements)
+                            return (OK, None, False)
+
+                    try:
+                        start_time = time.time()
+
+                        if copy_groups is not None:
+                            copied = run_chunked_copy(schema_name, table_name, copy_groups, fks)
+                        else:
+                            copied = run_commands(get_pg_conn(), statements)
+                    finally:
+                        release_copy(footprint_mb)
+
+                    if not copied:
                         if not ignore_errors:
                             if debug:
                                 print("Error running statements: %s" % (str(statements),))
                             return ERROR
+                    else:
+                        journal_table(schema_name, table_name,
+                                      JOURNAL_RENAMED if set_target_schema == schema_name else JOURNAL_COPIED, fks)
+                        record_throughput(MODE_DEEP_COPY, footprint_mb, time.time() - start_time)
 
                     # emit a cloudwatch metric for the table
-                    if cw is not None:
-                        dimensions = [
-                            {'Name': 'ClusterIdentifier', 'Value': db_host.split('.')[0]},
-                            {'Name': 'TableName', 'Value': table_name}
-                        ]
-                        aws_utils.put_metric(cw, 'Redshift', 'ColumnEncodingModification', dimensions, None, 1, 'Count')
-                        if debug:
-                            comment("Emitted Cloudwatch Metric for Column Encoded table")
+                    emit_table_metric(table_name)
                 else:
                     comment("No encoding modifications run for %s.%s" % (schema_name, table_name))
         except Exception as e:
@@ -866,7 +1854,7 @@ def analyze(table_info):
 
         print_statements(statements)
 
-        return (OK, fks, encodings_modified)
+        return (OK, fks, encodings_modified, plan)
 
 
 def usage(with_message):
@@ -904,6 +1892,19 @@ def usage(with_message):
     print('           --statement-timeout   - Set the runtime statement timeout in milliseconds (default 1200000)')
     print(
         '           --suppress-cloudwatch - Set to True to suppress CloudWatch Metrics being created when --do-execute is True')
+    print(
+        '           --analyze-cache       - Path to a local file in which to cache analyze compression results for unchanged tables')
+    print('           --analyze-cache-ttl   - Number of hours for which a cached analysis is used (default 168)')
+    print('           --journal             - Path to a local file in which to record the progress of each table')
+    print('           --resume              - Path to the journal of an interrupted run, which will be resumed')
+    print('           --max-disk-pct        - Only start a deep copy if cluster disk usage will stay below this percentage')
+    print(
+        '           --alter-in-place      - Change column encodings with ALTER TABLE ... ALTER COLUMN ... ENCODE rather than a deep copy where possible')
+    print('           --min-savings-pct     - Only modify tables whose expected saving is at least this percentage of the data rewritten')
+    print(
+        '           --savings-budget-mb   - Rank tables by expected saving per MB rewritten and only modify tables within this many MB rewritten')
+    print('           --plan-output         - Path to a JSON file describing the planned modification of each table')
+    print('           --copy-chunks         - Split each deep copy into this many ranges of the leading sort key column')
     sys.exit(INVALID_ARGS)
 
 
@@ -934,6 +1935,16 @@ def configure(**kwargs):
     global suppress_cw
     global cw
     global statement_timeout
+    global analyze_cache
+    global analyze_cache_ttl
+    global journal
+    global resume
+    global max_disk_pct
+    global alter_in_place
+    global min_savings_pct
+    global savings_budget_mb
+    global plan_output
+    global copy_chunks
 
     # set variables
     for key, value in kwargs.items():
@@ -1013,7 +2024,7 @@ def run():
             tables = "'" + table_name + "'"
 
     if table_name is not None:
-        statement = '''select pgn.nspname::text as schema, trim(a.name) as table, b.mbytes, a.rows, decode(pgc.reldiststyle,0,'EVEN',1,'KEY',8,'ALL') dist_style, TRIM(pgu.usename) "owner", pgd.description
+        statement = '''select pgn.nspname::text as schema, trim(a.name) as table, b.mbytes, a.rows, decode(pgc.reldiststyle,0,'EVEN',1,'KEY',8,'ALL') dist_style, TRIM(pgu.usename) "owner", pgd.description, a.id
 from (select db_id, id, name, sum(rows) as rows from stv_tbl_perm a group by db_id, id, name) as a
 join pg_class as pgc on pgc.oid = a.id
 left outer join pg_description pgd ON pgd.objoid = pgc.oid and pgd.objsubid = 0
@@ -1027,7 +2038,7 @@ and pgn.nspname::text ~ '%s' and pgc.relname in (%s)
         # query for all tables in the schema ordered by size descending
         comment("Extracting Candidate Table List...")
 
-        statement = '''select pgn.nspname::text as schema, trim(a.name) as table, b.mbytes, a.rows, decode(pgc.reldiststyle,0,'EVEN',1,'KEY',8,'ALL') dist_style, TRIM(pgu.usename) "owner", pgd.description
+        statement = '''select pgn.nspname::text as schema, trim(a.name) as table, b.mbytes, a.rows, decode(pgc.reldiststyle,0,'EVEN',1,'KEY',8,'ALL') dist_style, TRIM(pgu.usename) "owner", pgd.description, a.id
 from (select db_id, id, name, sum(rows) as rows from stv_tbl_perm a group by db_id, id, name) as a
 join pg_class as pgc on pgc.oid = a.id
 left outer join pg_description pgd ON pgd.objoid = pgc.oid and pgd.objsubid = 0
@@ -1053,65 +2064,148 @@ order by 2;
     for row in query_result:
         table_names.append(row)
 
+    # schedule the largest tables first
+    table_names = order_by_size(table_names)
+
+    fk_commands = []
+
+    if journal is not None:
+        if resume:
+            # skip all tables which were completed by the journaled run, and pick up the foreign keys of tables
+            # which were migrated but whose foreign keys were not yet applied
+            journal_state = get_journal_state()
+
+            if do_execute:
+                completed_states = [JOURNAL_UNCHANGED, JOURNAL_COPIED, JOURNAL_RENAMED, JOURNAL_ALTERED,
+                                    JOURNAL_FK_APPLIED]
+            else:
+                completed_states = [JOURNAL_UNCHANGED, JOURNAL_PLANNED, JOURNAL_COPIED, JOURNAL_RENAMED,
+                                    JOURNAL_ALTERED, JOURNAL_FK_APPLIED]
+
+            remaining_tables = []
+            for t in table_names:
+                state = journal_state.get((t[0], t[1]))
+
+                if state is not None and state[0] in completed_states:
+                    if do_execute and state[0] in [JOURNAL_COPIED, JOURNAL_RENAMED] and state[1] is not None:
+                        fk_commands.extend(state[1])
+                else:
+                    if do_execute and state is not None and state[0] == JOURNAL_COPYING:
+                        resumed_copies[(t[0], t[1])] = (state[2], state[3])
+
+                    remaining_tables.append(t)
+
+            comment("Resuming from journal %s: %s table(s) already completed" % (
+                journal, len(table_names) - len(remaining_tables)))
+
+            table_names = remaining_tables
+        else:
+            clear_journal()
+
+    # fetch the catalog information for all the tables up front, so that neither the ranking by savings nor the
+    # workers have to query it per table
+    if len(table_names) > 0:
+        comment("Prefetching catalog information...")
+
+        try:
+            prefetch_catalog(table_names, tables if table_name is not None else None)
+        except Exception as e:
+            comment("Unable to prefetch catalog information, falling back to per table queries: %s" % e)
+            if debug:
+                print(traceback.format_exc())
+            execute_query('rollback;')
+
+    # rank the tables by their expected saving and only process those within the budget
+    if savings_budget_mb is not None and len(table_names) > 0:
+        table_names = order_by_size(select_by_savings(table_names))
+
     comment("Analyzing %s table(s) which contain allocated data blocks" % (len(table_names)))
 
     if debug:
         [comment(str(x)) for x in table_names]
 
-    result = []
+    modified_tables = 0
+    completed_tables = 0
+    plan = []
 
-    if table_names is not None:
-        # we'll use a Pool to process all the tables with multiple threads, or just sequentially if 1 thread is requested         
+    if table_names is not None and len(table_names) > 0:
+        # deep copies share a reservation of disk space across all workers
+        if max_disk_pct is not None:
+            comment("Limiting deep copies to a disk usage ceiling of %s%%" % max_disk_pct)
+
+        disk_governor_args = (Value('d', 0), Condition())
+        init_disk_governor(*disk_governor_args)
+
+        # we'll use a Pool to process all the tables with multiple threads, or just sequentially if 1 thread is
+        # requested. Tables are handed out one at a time so that an idle worker always picks up the next largest
+        # table, and each result is processed as soon as it is available rather than when the whole run completes
+        p = None
         if threads > 1:
             # setup executor pool
-            p = Pool(threads)
+            p = Pool(threads, init_disk_governor, disk_governor_args)
+            result = p.imap_unordered(analyze, table_names, 1)
+        else:
+            result = (analyze(t) for t in table_names)
 
-            try:
-                # run all concurrent steps and block on completion
-                result = p.map(analyze, table_names)
-            except KeyboardInterrupt:
-                # To handle Ctrl-C from user
+        try:
+            for ret in result:
+                completed_tables += 1
+
+                # return any non-zero worker output statuses
+                if isinstance(ret, (list, tuple)):
+                    return_code = ret[0]
+                    if ret[1] is not None:
+                        fk_commands.extend(ret[1])
+                    modified_tables = modified_tables + 1 if ret[2] else modified_tables
+                    if len(ret) > 3 and ret[3] is not None:
+                        plan.append(ret[3])
+                else:
+                    return_code = ret
+
+                if return_code != OK:
+                    print("Error in worker thread: return code %d. Exiting." % (return_code,))
+                    if p is not None:
+                        p.close()
+                        p.terminate()
+                    return return_code
+
+                if debug:
+                    comment("Completed %s of %s tables" % (completed_tables, len(table_names)))
+        except KeyboardInterrupt:
+            # To handle Ctrl-C from user
+            if p is not None:
                 p.close()
                 p.terminate()
-                cleanup(master_conn)
-                return TERMINATED_BY_USER
-            except:
-                print(traceback.format_exc())
+            cleanup(master_conn)
+            return TERMINATED_BY_USER
+        except:
+            print(traceback.format_exc())
+            if p is not None:
                 p.close()
                 p.terminate()
-                cleanup(master_conn)
-                return ERROR
+            cleanup(master_conn)
+            return ERROR
 
+        if p is not None:
             p.terminate()
-        else:
-            for t in table_names:
-                result.append(analyze(t))
     else:
         comment("No Tables Found to Analyze")
 
-    # return any non-zero worker output statuses
-    modified_tables = 0
-    for ret in result:
-        if isinstance(ret, (list, tuple)):
-            return_code = ret[0]
-            fk_commands = ret[1]
-            modified_tables = modified_tables + 1 if ret[2] else modified_tables
-        else:
-            return_code = ret
-            fk_commands = None
+    if plan_output is not None:
+        write_plan(plan)
 
-        if fk_commands is not None and len(fk_commands) > 0:
-            print_statements(fk_commands)
+    # foreign keys are only added once all tables have been migrated, so that they reference the new tables
+    if len(fk_commands) > 0:
+        print_statements(fk_commands)
 
-            if do_execute:
-                if not run_commands(master_conn, fk_commands):
-                    if not ignore_errors:
-                        print("Error running commands %s" % (fk_commands,))
-                        return ERROR
+        if do_execute:
+            if not run_commands(master_conn, fk_commands):
+                if not ignore_errors:
+                    print("Error running commands %s" % (fk_commands,))
+                    return ERROR
 
-        if return_code != OK:
-            print("Error in worker thread: return code %d. Exiting." % (return_code,))
-            return return_code
+    if do_execute:
+        journal_fks_applied()
 
     comment("Performed modification of %s tables" % modified_tables)
 
@@ -1126,7 +2220,7 @@ order by 2;
 
 
 def main(argv):
-    supported_args = """db= db-user= db-pwd= db-host= db-port= target-schema= analyze-schema= analyze-table= new-dist-key= new-sort-keys= analyze-cols= threads= debug= output-file= do-execute= slot-count= ignore-errors= force= drop-old-data= comprows= query_group= ssl-option= suppress-cloudwatch= statement-timeout="""
+    supported_args = """db= db-user= db-pwd= db-host= db-port= target-schema= analyze-schema= analyze-table= new-dist-key= new-sort-keys= analyze-cols= threads= debug= output-file= do-execute= slot-count= ignore-errors= force= drop-old-data= comprows= query_group= ssl-option= suppress-cloudwatch= statement-timeout= analyze-cache= analyze-cache-ttl= journal= resume= max-disk-pct= alter-in-place= min-savings-pct= savings-budget-mb= plan-output= copy-chunks="""
 
     # extract the command line arguments
     try:
@@ -1230,6 +2324,39 @@ def main(argv):
                     args[config_constants.STATEMENT_TIMEOUT] = str(int(value))
                 except ValueError:
                     pass
+        elif arg == "--analyze-cache":
+            if value != '' and value is not None:
+                args[config_constants.ANALYZE_CACHE] = value
+        elif arg == "--analyze-cache-ttl":
+            if value != '' and value is not None:
+                args[config_constants.ANALYZE_CACHE_TTL] = int(value)
+        elif arg == "--journal":
+            if value != '' and value is not None:
+                args[config_constants.JOURNAL] = value
+        elif arg == "--resume":
+            if value != '' and value is not None:
+                args[config_constants.JOURNAL] = value
+                args[config_constants.RESUME] = True
+        elif arg == "--max-disk-pct":
+            if value != '' and value is not None:
+                args[config_constants.MAX_DISK_PCT] = float(value)
+        elif arg == "--alter-in-place":
+            if value == 'true' or value == 'True':
+                args[config_constants.ALTER_IN_PLACE] = True
+            else:
+                args[config_constants.ALTER_IN_PLACE] = False
+        elif arg == "--min-savings-pct":
+            if value != '' and value is not None:
+                args[config_constants.MIN_SAVINGS_PCT] = float(value)
+        elif arg == "--savings-budget-mb":
+            if value != '' and value is not None:
+                args[config_constants.SAVINGS_BUDGET_MB] = int(value)
+        elif arg == "--plan-output":
+            if value != '' and value is not None:
+                args[config_constants.PLAN_OUTPUT] = value
+        elif arg == "--copy-chunks":
+            if value != '' and value is not None:
+                args[config_constants.COPY_CHUNKS] = int(value)
         else:
             print("Unsupported Argument " + arg)
             usage()
@@ -30,6 +30,7 @@ if [ ! -d lib/AnalyzeVacuumUtility ]; then
 fi
 
 cp ../AnalyzeVacuumUtility/lib/analyze_vacuum.py lib/AnalyzeVacuumUtility/analyze_vacuum.py
+cp ../AnalyzeVacuumUtility/lib/duration_model.py lib/AnalyzeVacuumUtility/duration_model.py
 echo "Imported Analyze/Vacuum Utility"
 
 # import the SystemTablePersistence utility
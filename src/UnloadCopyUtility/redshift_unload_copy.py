@@ -24,10 +24,10 @@ import sys
 import logging
 from global_config import GlobalConfigParametersReader, config_parameters
 from util.s3_utils import S3Helper, S3Details
-from util.resources import ResourceFactory, TableResource, DBResource
+from util.resources import ResourceFactory, TableResource, SchemaResource, DBResource
 from util.tasks import TaskManager, FailIfResourceDoesNotExistsTask, CreateIfTargetDoesNotExistTask, \
     FailIfResourceClusterDoesNotExistsTask, UnloadDataToS3Task, CopyDataFromS3Task, CleanupS3StagingAreaTask, \
-    NoOperationTask
+    NoOperationTask, PartitionTableTask
 
 
 region = None
@@ -80,10 +80,11 @@ class UnloadCopyTool:
         self.task_manager.add_task(self.barrier_after_all_cluster_pre_tests)
         self.barrier_after_all_resource_pre_tests = NoOperationTask()
         self.task_manager.add_task(self.barrier_after_all_resource_pre_tests)
+        self.pre_tested_clusters = []
 
         src_config = self.config_helper.config['unloadSource']
         dest_config = self.config_helper.config['copyTarget']
-        if(src_config['tableNames']):
+        if src_config.get('tableNames'):
             src_tables = src_config['tableNames']
             dest_tables = dest_config['tableNames']
             logging.info("Migrating multiple tables")
@@ -105,7 +106,6 @@ class UnloadCopyTool:
         self.task_manager.run()
 
     def add_src_dest_tasks(self,source,destination,global_config_values):
-        # TODO: Check whether both resources are of type table if that is not the case then perform other scenario's
         if isinstance(source, TableResource):
             if isinstance(destination, DBResource):
                 if not isinstance(destination, TableResource):
@@ -117,28 +117,75 @@ class UnloadCopyTool:
                 logging.fatal('Destination should be a database resource')
                 raise NotImplementedError
             pass
+        elif isinstance(source, SchemaResource):
+            if isinstance(destination, DBResource) and not isinstance(destination, TableResource):
+                self.add_tables_migration(source, destination, global_config_values)
+            else:
+                logging.fatal('Destination of a schema should be a schema or database resource')
+                raise NotImplementedError
+        elif isinstance(source, DBResource):
+            if type(destination) is DBResource:
+                self.add_tables_migration(source, destination, global_config_values)
+            else:
+                logging.fatal('Destination of a database should be a database resource')
+                raise NotImplementedError
         else:
-            # TODO: add additional scenario's
-            # For example if both resources are of type schema then create target schema and migrate all tables
-            logging.fatal('Source is not a Table, this type of unload-copy is currently not supported.')
+            logging.fatal('Source is not a database resource, this type of unload-copy is currently not supported.')
             raise NotImplementedError
 
+    def add_tables_migration(self, source, destination, global_config_values):
+        """
+        Migrates all tables of a schema or database.  The tables are listed from the catalog of the source cluster in a
+        single query.  Target schemas are created before the target tables in them and all target tables are created
+        before any data is unloaded, after which the unloads and copies of all tables are ran by the task manager,
+        taskWorkers at a time.
+        :param source: SchemaResource or DBResource to migrate
+        :param destination: SchemaResource to migrate all tables to, or DBResource to keep the source schema names
+        """
+        source_tables = source.get_table_resources()
+        if len(source_tables) == 0:
+            logging.warning('No tables found in {s}, nothing to migrate.'.format(s=source))
+            return
+        logging.info('Migrating {n} tables of {s}'.format(n=len(source_tables), s=source))
+
+        create_schema_tasks = {}
+        for source_table in source_tables:
+            if isinstance(destination, SchemaResource):
+                schema = destination.get_schema()
+            else:
+                schema = source_table.get_schema()
+            destination_table = TableResource(destination.get_cluster(), schema, source_table.get_table())
 
-    def add_table_migration(self, source, destination, global_config_values):
+            create_dependencies = None
+            if global_config_values['destinationTableAutoCreate']:
+                if schema not in create_schema_tasks:
+                    create_schema_tasks[schema] = CreateIfTargetDoesNotExistTask(
+                        source_resource=source_table.parent,
+                        target_resource=destination_table.parent
+                    )
+                    self.task_manager.add_task(create_schema_tasks[schema],
+                                               dependencies=self.barrier_after_all_cluster_pre_tests)
+                create_dependencies = create_schema_tasks[schema]
+            self.add_table_migration(source_table, destination_table, global_config_values,
+                                     create_dependencies=create_dependencies)
+
+    def add_cluster_pre_test(self, resource):
+        # clusters that are shared by many tables only need to be tested once
+        if resource.get_cluster() in self.pre_tested_clusters:
+            return
+        self.pre_tested_clusters.append(resource.get_cluster())
+        cluster_pre_test = FailIfResourceClusterDoesNotExistsTask(resource=resource)
+        self.task_manager.add_task(cluster_pre_test, dependency_of=self.barrier_after_all_cluster_pre_tests)
+
+    def add_table_migration(self, source, destination, global_config_values, create_dependencies=None):
         if global_config_values['connectionPreTest']:
             if not global_config_values['destinationTablePreTest']:
-                destination_cluster_pre_test = FailIfResourceClusterDoesNotExistsTask(resource=destination)
-                self.task_manager.add_task(destination_cluster_pre_test,
-                                           dependency_of=self.barrier_after_all_cluster_pre_tests)
+                self.add_cluster_pre_test(destination)
             if not global_config_values['sourceTablePreTest']:
-                source_cluster_pre_test = FailIfResourceClusterDoesNotExistsTask(resource=source)
-                self.task_manager.add_task(source_cluster_pre_test,
-                                           dependency_of=self.barrier_after_all_cluster_pre_tests)
+                self.add_cluster_pre_test(source)
         if global_config_values['destinationTablePreTest']:
             if global_config_values['destinationTableAutoCreate']:
-                destination_cluster_pre_test = FailIfResourceClusterDoesNotExistsTask(resource=destination)
-                self.task_manager.add_task(destination_cluster_pre_test,
-                                           dependency_of=self.barrier_after_all_cluster_pre_tests)
+                self.add_cluster_pre_test(destination)
             else:
                 destination_table_pre_test = FailIfResourceDoesNotExistsTask(destination)
                 self.task_manager.add_task(destination_table_pre_test,
@@ -156,20 +203,50 @@ class UnloadCopyTool:
                 source_resource=source,
                 target_resource=destination
             )
+            dependencies = [self.barrier_after_all_cluster_pre_tests]
+            if create_dependencies is not None:
+                dependencies.append(create_dependencies)
             self.task_manager.add_task(create_target,
                                        dependency_of=self.barrier_after_all_resource_pre_tests,
-                                       dependencies=self.barrier_after_all_cluster_pre_tests)
+                                       dependencies=dependencies)
 
         s3_details = S3Details(self.config_helper, source, encryption_key_id=encryptionKeyID)
-        unload_data = UnloadDataToS3Task(source, s3_details)
-        self.task_manager.add_task(unload_data, dependencies=self.barrier_after_all_resource_pre_tests)
+        partitions = int(global_config_values.get('unloadPartitions', 1))
+        if partitions > 1:
+            copy_data = self.add_partitioned_data_migration(source, destination, s3_details, partitions,
+                                                            int(global_config_values.get('unloadPartitionRetries', 0)))
+        else:
+            unload_data = UnloadDataToS3Task(source, s3_details)
+            self.task_manager.add_task(unload_data, dependencies=self.barrier_after_all_resource_pre_tests)
 
-        copy_data = CopyDataFromS3Task(destination, s3_details)
-        self.task_manager.add_task(copy_data, dependencies=unload_data)
+            copy_data = CopyDataFromS3Task(destination, s3_details)
+            self.task_manager.add_task(copy_data, dependencies=unload_data)
 
         s3_cleanup = CleanupS3StagingAreaTask(s3_details)
         self.task_manager.add_task(s3_cleanup, dependencies=copy_data)
 
+    def add_partitioned_data_migration(self, source, destination, s3_details, partitions, retries):
+        """
+        Unloads the source in key ranges, each to its own staging prefix, and copies each range as soon as its unload
+        has completed.  The unload and copy of a range are retried on their own when they fail.
+        :return: list of the copy tasks
+        """
+        partition_table = PartitionTableTask(source, partitions)
+        self.task_manager.add_task(partition_table, dependencies=self.barrier_after_all_resource_pre_tests)
+
+        copy_tasks = []
+        for partition in range(partitions):
+            partition_s3_details = s3_details.get_partition_s3_details(partition)
+            unload_data = UnloadDataToS3Task(source, partition_s3_details, partition=partition)
+            unload_data.retries = retries
+            self.task_manager.add_task(unload_data, dependencies=partition_table)
+
+            copy_data = CopyDataFromS3Task(destination, partition_s3_details)
+            copy_data.retries = retries
+            self.task_manager.add_task(copy_data, dependencies=unload_data)
+            copy_tasks.append(copy_data)
+        return copy_tasks
+
 
 def set_log_level(log_level_string):
     log_level_string = log_level_string.upper()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Usage:
+
+python staging_format_benchmark.py <config file> <region>
+
+Unloads and copies the table of a configuration file once for each staging format and reports the bytes staged on S3
+and the time taken by the unload and the copy.  The target table of the configuration must exist and is TRUNCATED
+before each copy, so point copyTarget to a scratch table.
+
+
+* Copyright 2017, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+"""
+import sys
+import time
+import logging
+from global_config import GlobalConfigParametersReader, config_parameters
+from redshift_unload_copy import ConfigHelper, set_log_level, encryptionKeyID
+from util.s3_utils import S3Helper, S3Details
+from util.resources import ResourceFactory, TableResource
+
+staging_formats = ['GZIP', 'ZSTD', 'BZIP2', 'PARQUET']
+
+
+def run_benchmark(config_helper, s3_helper, source, destination, staging_format):
+    config_parameters['stagingFormat'] = staging_format
+    s3_details = S3Details(config_helper, source, encryption_key_id=encryptionKeyID)
+    try:
+        start = time.time()
+        source.unload_data(s3_details)
+        unloaded = time.time()
+        staged_bytes = s3_helper.get_size_of_staged_data(s3_details)
+
+        destination.get_cluster().execute_update('TRUNCATE {schema}.{table}'.format(
+            schema=destination.get_schema(),
+            table=destination.get_table()
+        ))
+        copy_start = time.time()
+        destination.copy_data(s3_details)
+        copied = time.time()
+    finally:
+        s3_helper.delete_s3_prefix(s3_details)
+
+    return {'staged_mb': staged_bytes / 1024 / 1024,
+            'unload_seconds': unloaded - start,
+            'copy_seconds': copied - copy_start,
+            'total_seconds': unloaded - start + copied - copy_start}
+
+
+def main(args):
+    global_config_values = GlobalConfigParametersReader().get_config_key_values_updated_with_cli_args(args)
+    set_log_level(global_config_values['logLevel'])
+
+    s3_helper = S3Helper(global_config_values['region'])
+    config_helper = ConfigHelper(global_config_values['s3ConfigFile'], s3_helper)
+    source = ResourceFactory.get_source_resource_from_config_helper(config_helper, global_config_values['region'])
+    destination = ResourceFactory.get_target_resource_from_config_helper(config_helper, global_config_values['region'])
+    if not isinstance(source, TableResource) or not isinstance(destination, TableResource):
+        logging.fatal('The benchmark requires a tableName in both unloadSource and copyTarget.')
+        sys.exit(-1)
+
+    results = [(staging_format, run_benchmark(config_helper, s3_helper, source, destination, staging_format))
+               for staging_format in staging_formats]
+
+    print('{f:<10} {mb:>12} {u:>10} {c:>10} {t:>10}'.format(f='Format', mb='Staged MB', u='Unload s', c='Copy s',
+                                                           t='Total s'))
+    for staging_format, r in results:
+        print('{f:<10} {mb:>12.1f} {u:>10.1f} {c:>10.1f} {t:>10.1f}'.format(f=staging_format, mb=r['staged_mb'],
+                                                                          u=r['unload_seconds'],
+                                                                          c=r['copy_seconds'],
+                                                                          t=r['total_seconds']))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
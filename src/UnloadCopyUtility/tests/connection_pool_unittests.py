@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Unittests can only be ran in python3 due to dependencies
+
+* Copyright 2017, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+from global_config import config_parameters
+from util.redshift_cluster import RedshiftCluster, set_timeout_stmt
+import util.redshift_cluster
+import datetime
+import threading
+import pytz
+
+
+class ConnectionPoolUnittests(TestCase):
+    def setUp(self):
+        config_parameters['connectionPoolSize'] = 2
+        self.rs_cluster = RedshiftCluster('test.abcdefghijkl.eu-west-1.redshift.amazonaws.com')
+        self.rs_cluster.set_db('dev')
+        self.connections = []
+
+        def new_connection(opt=None, database=None):
+            connection = MagicMock()
+            self.connections.append(connection)
+            return connection
+        self.rs_cluster._conn_to_rs = MagicMock(side_effect=new_connection)
+
+    def test_connection_is_reused_and_timeout_is_set_once(self):
+        self.rs_cluster.execute_update('select 1')
+        self.rs_cluster.execute_update('select 2')
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual(1, [c[0][0] for c in self.connections[0].query.call_args_list].count(set_timeout_stmt))
+
+    def test_pool_is_bounded(self):
+        pool = self.rs_cluster.get_connection_pool()
+        first = pool.checkout()
+        second = pool.checkout()
+        checked_out = []
+        waiter = threading.Thread(target=lambda: checked_out.append(pool.checkout()))
+        waiter.start()
+        waiter.join(0.2)
+        self.assertEqual([], checked_out)
+        pool.checkin(first)
+        waiter.join(5)
+        self.assertEqual([first], checked_out)
+        pool.checkin(second)
+        self.assertEqual(2, len(self.connections))
+
+    def test_connection_with_expired_temporary_credentials_is_recycled(self):
+        self.rs_cluster.has_temporary_password = True
+        self.rs_cluster.set_user_creds_expiration(datetime.datetime.now(pytz.utc) + datetime.timedelta(minutes=30))
+        pool = self.rs_cluster.get_connection_pool()
+        pooled_connection = pool.checkout()
+        pooled_connection.credentials_expiration = datetime.datetime.now(pytz.utc)
+        pool.checkin(pooled_connection)
+        self.assertIsNot(pooled_connection, pool.checkout())
+        self.assertEqual(2, len(self.connections))
+        self.connections[0].close.assert_called_once_with()
+
+    def test_connection_failing_health_check_is_recycled(self):
+        pool = self.rs_cluster.get_connection_pool()
+        pooled_connection = pool.checkout()
+        pooled_connection.connection.query.side_effect = Exception('connection lost')
+        pool.checkin(pooled_connection)
+        pooled_connection.last_used -= util.redshift_cluster.health_check_after_seconds + 1
+        self.assertIsNot(pooled_connection, pool.checkout())
+        self.assertEqual(2, len(self.connections))
@@ -21,9 +21,12 @@ from util.sql.sql_text_helpers import GET_SAFE_LOG_STRING, SQLTextHelper
 from util.sql.ddl_generators import DDLTransformer
 from util.redshift_cluster import RedshiftCluster
 from util.sql_queries import GET_DATABASE_NAME_OWNER_ACL
-from util.resources import DBResource
+from util.resources import DBResource, SchemaResource, TableResource
+from util.tasks import TaskManager, NoOperationTask, CreateIfTargetDoesNotExistTask, UnloadDataToS3Task
 import redshift_unload_copy
+from global_config import config_parameters
 import datetime
+import decimal
 import time
 import pytz
 
@@ -156,3 +159,128 @@ token '<temporary-token>';"""
         input_string = "host=localhost port=5439 dbname=dev user=master password=MyS3cr3tPass.word option1"
         expected_string = "host=localhost port=5439 dbname=dev user=master password=REDACTED option1"
         self.assertEquals(GET_SAFE_LOG_STRING(input_string), expected_string)
+
+    def test_schema_table_resources_are_listed_from_catalog(self):
+        cluster = RedshiftCluster(cluster_endpoint='test')
+        cluster.get_query_full_result_as_list_of_dict = MagicMock(return_value=[
+            {'schema_name': 'ssb', 'table_name': 'dwdate'},
+            {'schema_name': 'ssb', 'table_name': 'lineorder'}
+        ])
+        tables = SchemaResource(cluster, 'ssb').get_table_resources()
+        self.assertEqual(1, cluster.get_query_full_result_as_list_of_dict.call_count)
+        self.assertIn("nspname = 'ssb'", cluster.get_query_full_result_as_list_of_dict.call_args[0][0])
+        self.assertEqual([TableResource(cluster, 'ssb', 'dwdate'), TableResource(cluster, 'ssb', 'lineorder')],
+                         tables)
+
+    def test_schema_migration_creates_target_schema_before_target_tables(self):
+        source_cluster = RedshiftCluster(cluster_endpoint='source')
+        source_cluster.get_query_full_result_as_list_of_dict = MagicMock(return_value=[
+            {'schema_name': 'ssb', 'table_name': 'dwdate'},
+            {'schema_name': 'ssb', 'table_name': 'lineorder'}
+        ])
+        target_cluster = RedshiftCluster(cluster_endpoint='target')
+        tool = redshift_unload_copy.UnloadCopyTool.__new__(redshift_unload_copy.UnloadCopyTool)
+        tool.config_helper = MagicMock()
+        tool.config_helper.config = {'s3Staging': {'path': 's3://bucket/prefix/', 'aws_iam_role': 'role',
+                                                   'kmsGeneratedKey': 'False'}}
+        tool.task_manager = TaskManager()
+        tool.barrier_after_all_cluster_pre_tests = NoOperationTask()
+        tool.task_manager.add_task(tool.barrier_after_all_cluster_pre_tests)
+        tool.barrier_after_all_resource_pre_tests = NoOperationTask()
+        tool.task_manager.add_task(tool.barrier_after_all_resource_pre_tests)
+        tool.pre_tested_clusters = []
+        global_config_values = {'connectionPreTest': True, 'sourceTablePreTest': False,
+                                'destinationTablePreTest': False, 'destinationTableAutoCreate': True,
+                                'tableName': None}
+
+        tool.add_src_dest_tasks(SchemaResource(source_cluster, 'ssb'), SchemaResource(target_cluster, 'ssb_copy'),
+                                global_config_values)
+
+        tasks = list(tool.task_manager.tasks.values())
+        create_tasks = [t for t in tasks if isinstance(t, CreateIfTargetDoesNotExistTask)]
+        create_schema_tasks = [t for t in create_tasks if not isinstance(t.target_resource, TableResource)]
+        create_table_tasks = [t for t in create_tasks if isinstance(t.target_resource, TableResource)]
+        self.assertEqual([SchemaResource(target_cluster, 'ssb_copy')],
+                         [t.target_resource for t in create_schema_tasks])
+        self.assertEqual([TableResource(target_cluster, 'ssb_copy', 'dwdate'),
+                          TableResource(target_cluster, 'ssb_copy', 'lineorder')],
+                         [t.target_resource for t in create_table_tasks])
+        for create_table_task in create_table_tasks:
+            self.assertIn(create_schema_tasks[0].task_id, create_table_task.dependencies)
+        for unload_task in [t for t in tasks if isinstance(t, UnloadDataToS3Task)]:
+            self.assertEqual([tool.barrier_after_all_resource_pre_tests.task_id], unload_task.dependencies)
+        self.assertEqual(2, len(tool.pre_tested_clusters))
+
+    def test_integer_key_ranges_cover_all_rows(self):
+        predicates = TableResource.get_range_predicates('"id"', 1, 100, 4)
+        self.assertEqual(['("id" < 25 OR "id" IS NULL)',
+                          '("id" >= 25 AND "id" < 50)',
+                          '("id" >= 50 AND "id" < 75)',
+                          '("id" >= 75)'], predicates)
+
+    def test_timestamp_key_ranges_are_quoted_for_unload(self):
+        predicates = TableResource.get_range_predicates('"ts"', datetime.datetime(2018, 1, 1),
+                                                        datetime.datetime(2018, 1, 3), 2)
+        self.assertEqual(["(\"ts\" < ''2018-01-02 00:00:00'' OR \"ts\" IS NULL)",
+                          "(\"ts\" >= ''2018-01-02 00:00:00'')"], predicates)
+
+    def test_key_ranges_of_empty_table(self):
+        predicates = TableResource.get_range_predicates('"amount"', None, None, 3)
+        self.assertEqual(3, len(predicates))
+        self.assertEqual(['1 = 0', '1 = 0'], predicates[1:])
+
+    def test_key_ranges_of_unsupported_type_raise(self):
+        with self.assertRaises(TableResource.PartitioningNotPossibleException):
+            TableResource.get_range_predicates('"name"', 'a', 'z', 2)
+
+    def test_partitioned_unload_selects_key_range(self):
+        cluster = RedshiftCluster(cluster_endpoint='test')
+        cluster.execute_update = MagicMock()
+        table = TableResource(cluster, 'ssb', 'lineorder')
+        table.partition_predicates = TableResource.get_range_predicates('"lo_orderkey"', decimal.Decimal(0),
+                                                                        decimal.Decimal(10), 2)
+        s3_details = MagicMock()
+        s3_details.dataStagingPath = 's3://bucket/prefix/dev.ssb.lineorder.part_0001'
+        s3_details.dataStagingRegion = None
+        table.unload_data(s3_details, partition=1)
+        unload_sql = cluster.execute_update.call_args[0][0]
+        self.assertIn('FROM ssb.lineorder WHERE ("lo_orderkey" >= 5)', unload_sql)
+        self.assertIn("to 's3://bucket/prefix/dev.ssb.lineorder.part_0001.'", unload_sql)
+
+    def test_parquet_staging_format_unloads_and_copies_parquet(self):
+        cluster = RedshiftCluster(cluster_endpoint='test')
+        cluster.execute_update = MagicMock()
+        table = TableResource(cluster, 'ssb', 'lineorder')
+        s3_details = MagicMock()
+        s3_details.dataStagingPath = 's3://bucket/prefix/dev.ssb.lineorder'
+        s3_details.dataStagingRegion = None
+        config_parameters['stagingFormat'] = 'PARQUET'
+        try:
+            table.unload_data(s3_details)
+            unload_sql = cluster.execute_update.call_args[0][0]
+            table.copy_data(s3_details)
+            copy_sql = cluster.execute_update.call_args[0][0]
+        finally:
+            config_parameters['stagingFormat'] = 'GZIP'
+        for sql in [unload_sql, copy_sql]:
+            self.assertIn('format as parquet', sql)
+            self.assertNotIn('escape', sql)
+            self.assertNotIn('NULL_STRING__', sql)
+            self.assertNotIn('master_symmetric_key', sql)
+
+    def test_text_staging_format_sets_compression(self):
+        cluster = RedshiftCluster(cluster_endpoint='test')
+        cluster.execute_update = MagicMock()
+        table = TableResource(cluster, 'ssb', 'lineorder')
+        s3_details = MagicMock()
+        s3_details.dataStagingPath = 's3://bucket/prefix/dev.ssb.lineorder'
+        s3_details.dataStagingRegion = 'eu-west-1'
+        config_parameters['stagingFormat'] = 'zstd'
+        try:
+            table.copy_data(s3_details)
+        finally:
+            config_parameters['stagingFormat'] = 'GZIP'
+        copy_sql = cluster.execute_update.call_args[0][0]
+        self.assertIn('ZSTD', copy_sql)
+        self.assertNotIn('gzip', copy_sql.lower())
+        self.assertIn("REGION 'eu-west-1'", copy_sql)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Unittests can only be ran in python3 due to dependencies
+
+* Copyright 2017, Amazon.com, Inc. or its affiliates. All Rights Reserved.
+*
+* Licensed under the Amazon Software License (the "License").
+* You may not use this file except in compliance with the License.
+* A copy of the License is located at
+*
+* http://aws.amazon.com/asl/
+*
+* or in the "license" file accompanying this file. This file is distributed
+* on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+* express or implied. See the License for the specific language governing
+* permissions and limitations under the License.
+"""
+from unittest import TestCase
+from global_config import config_parameters
+from util.tasks import TaskManager, Task
+import threading
+
+
+class RecordingTask(Task):
+    def __init__(self, name, log, started=None, wait_for=None, fail=False, failures=0):
+        super(RecordingTask, self).__init__()
+        self.name = name
+        self.log = log
+        self.started = started
+        self.wait_for = wait_for
+        self.fail = fail
+        self.failures = failures
+
+    def execute(self):
+        if self.started is not None:
+            self.started.set()
+        if self.wait_for is not None and not self.wait_for.wait(5):
+            raise Exception('{n} was not run concurrently'.format(n=self.name))
+        self.log.append(self.name)
+        if self.fail or self.failures > 0:
+            self.failures -= 1
+            raise Exception('{n} failed'.format(n=self.name))
+
+
+class TaskManagerUnittests(TestCase):
+    def setUp(self):
+        config_parameters['failOnError'] = False
+
+    def test_dependencies_run_before_dependents(self):
+        log = []
+        task_manager = TaskManager()
+        unload = RecordingTask('unload', log)
+        copy = RecordingTask('copy', log)
+        cleanup = RecordingTask('cleanup', log)
+        task_manager.add_task(unload)
+        task_manager.add_task(copy, dependencies=unload)
+        task_manager.add_task(cleanup, dependencies=copy)
+        task_manager.run(workers=4)
+        self.assertEqual(['unload', 'copy', 'cleanup'], log)
+        self.assertEqual(3, len(task_manager.completed_successfully_tasks))
+
+    def test_independent_tasks_run_concurrently(self):
+        log = []
+        task_manager = TaskManager()
+        copy_a_started = threading.Event()
+        unload_b_started = threading.Event()
+        unload_a = RecordingTask('unload_a', log)
+        copy_a = RecordingTask('copy_a', log, started=copy_a_started, wait_for=unload_b_started)
+        unload_b = RecordingTask('unload_b', log, started=unload_b_started, wait_for=copy_a_started)
+        unload_b_blocker = RecordingTask('unload_b_blocker', log)
+        task_manager.add_task(unload_a)
+        task_manager.add_task(unload_b_blocker)
+        task_manager.add_task(copy_a, dependencies=unload_a)
+        task_manager.add_task(unload_b, dependencies=unload_b_blocker)
+        task_manager.run(workers=2)
+        self.assertEqual(4, len(task_manager.completed_successfully_tasks))
+
+    def test_failed_dependency_marks_dependent_as_failed(self):
+        log = []
+        task_manager = TaskManager()
+        unload = RecordingTask('unload', log, fail=True)
+        copy = RecordingTask('copy', log)
+        task_manager.add_task(unload)
+        task_manager.add_task(copy, dependencies=unload)
+        task_manager.run(workers=2)
+        self.assertIn(unload.task_id, task_manager.completed_failed_tasks)
+        self.assertTrue(copy.has_failed)
+
+    def test_failed_task_is_retried_without_its_siblings(self):
+        log = []
+        task_manager = TaskManager()
+        unload_1 = RecordingTask('unload_1', log)
+        unload_2 = RecordingTask('unload_2', log, failures=1)
+        unload_2.retries = 2
+        copy_2 = RecordingTask('copy_2', log)
+        task_manager.add_task(unload_1)
+        task_manager.add_task(unload_2)
+        task_manager.add_task(copy_2, dependencies=unload_2)
+        task_manager.run(workers=1)
+        self.assertEqual(['unload_1', 'unload_2', 'unload_2', 'copy_2'], log)
+        self.assertEqual(3, len(task_manager.completed_successfully_tasks))
+        self.assertFalse(copy_2.has_failed)
+
+    def test_task_fails_when_retries_are_exhausted(self):
+        log = []
+        task_manager = TaskManager()
+        unload = RecordingTask('unload', log, failures=3)
+        unload.retries = 1
+        task_manager.add_task(unload)
+        task_manager.run(workers=1)
+        self.assertEqual(['unload', 'unload'], log)
+        self.assertIn(unload.task_id, task_manager.completed_failed_tasks)
+
+    def test_circular_dependencies_are_failed(self):
+        log = []
+        task_manager = TaskManager()
+        first = RecordingTask('first', log)
+        second = RecordingTask('second', log)
+        task_manager.add_task(first)
+        task_manager.add_task(second, dependencies=first)
+        task_manager.add_dependency_to_task(first, second)
+        task_manager.run(workers=2)
+        self.assertEqual([], log)
+        self.assertEqual(2, len(task_manager.completed_failed_tasks))
+
+    def test_unknown_dependency_raises(self):
+        task_manager = TaskManager()
+        task = RecordingTask('task', [])
+        task_manager.add_task(task, dependencies=RecordingTask('not_added', []))
+        with self.assertRaises(TaskManager.UnknownDependencyException):
+            task_manager.run(workers=1)
+
+    def test_no_workers_raises(self):
+        task_manager = TaskManager()
+        task_manager.add_task(RecordingTask('task', []))
+        with self.assertRaises(ValueError):
+            task_manager.run(workers=0)
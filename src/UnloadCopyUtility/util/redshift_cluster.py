@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 import sys
 import logging
+import threading
+import time
 import pg
 import re
+from global_config import config_parameters
 from util.sql.sql_text_helpers import GET_SAFE_LOG_STRING
 import pytz
 
@@ -14,6 +18,9 @@ options = "keepalives=1 keepalives_idle=200 keepalives_interval=200 keepalives_c
 
 set_timeout_stmt = "set statement_timeout = 0"
 
+# connections that have been idle for longer than this are checked before they are handed out again
+health_check_after_seconds = 60
+
 
 class RedshiftClusterFactory:
     def __init__(self):
@@ -38,19 +45,111 @@ class RedshiftClusterFactory:
         return c
 
 
+class PooledConnection:
+    def __init__(self, connection, credentials_expiration=None):
+        self.connection = connection
+        self.credentials_expiration = credentials_expiration
+        self.timeout = None
+        self.last_used = time.time()
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of connections to a single database of a cluster, all using the same connection options.
+    Connections are checked out by a task and returned when it is done with them, and keep their session settings so
+    that they are only re-issued when a task needs a different statement timeout.
+    """
+    def __init__(self, cluster, database, opt, max_size):
+        self.cluster = cluster
+        self.database = database
+        self.opt = opt
+        self.max_size = max(max_size, 1)
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def checkout(self, timeout=set_timeout_stmt):
+        with self._condition:
+            while len(self._idle) == 0 and self._size >= self.max_size:
+                self._condition.wait()
+            if len(self._idle) > 0:
+                pooled_connection = self._idle.pop()
+            else:
+                pooled_connection = None
+                self._size += 1
+
+        try:
+            if pooled_connection is not None and not self.is_usable(pooled_connection):
+                ConnectionPool.close(pooled_connection)
+                pooled_connection = None
+            if pooled_connection is None:
+                pooled_connection = self.cluster.new_pooled_connection(opt=self.opt, database=self.database)
+            if pooled_connection.timeout != timeout:
+                pooled_connection.connection.query(timeout)
+                pooled_connection.timeout = timeout
+        except:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        return pooled_connection
+
+    def checkin(self, pooled_connection, discard=False):
+        with self._condition:
+            if discard:
+                ConnectionPool.close(pooled_connection)
+                self._size -= 1
+            else:
+                pooled_connection.last_used = time.time()
+                self._idle.append(pooled_connection)
+            self._condition.notify()
+
+    def is_usable(self, pooled_connection):
+        if pooled_connection.credentials_expiration is not None \
+                and datetime.now(pytz.utc) + timedelta(minutes=1) > pooled_connection.credentials_expiration:
+            logging.debug('Recycling connection to {db} as its temporary credentials expired'.format(db=self.database))
+            return False
+        if time.time() - pooled_connection.last_used > health_check_after_seconds:
+            # noinspection PyBroadException
+            try:
+                pooled_connection.connection.query('select 1')
+            except Exception as e:
+                logging.debug('Recycling connection to {db} that failed its health check: {e}'.format(
+                    db=self.database,
+                    e=e
+                ))
+                return False
+        return True
+
+    def close_all(self):
+        with self._condition:
+            for pooled_connection in self._idle:
+                ConnectionPool.close(pooled_connection)
+                self._size -= 1
+            self._idle = []
+
+    @staticmethod
+    def close(pooled_connection):
+        # noinspection PyBroadException
+        try:
+            pooled_connection.connection.close()
+        except:
+            logging.warning('Could not correctly close pooled connection')
+
+
 class RedshiftCluster:
     def __init__(self, cluster_endpoint):
         self._password = None
         self._user = None
         self._db = None
         self._port = None
-        self.database_connections = {}
-        self.database_timeouts = {}
+        self.connection_pools = {}
+        self._connection_pools_lock = threading.Lock()
+        self._credentials_lock = threading.RLock()
         self.cluster_endpoint = cluster_endpoint
         self._user_auto_create = False
         self._user_creds_expiration = datetime.now(pytz.utc)
         self._user_db_groups = []
-        self._configured_timeout = None
         self.has_temporary_password = False
 
     def __eq__(self, other):
@@ -67,14 +166,15 @@ class RedshiftCluster:
         self._user = user
 
     def get_password(self):
-        if self._password is None or self.is_temporary_credential_expired():
-            self.refresh_temporary_credentials()
-        # noinspection PyBroadException
-        try:
-            self._password = self._password.decode('utf-8')
-        except:
-            pass  # If we cannot decode it it could be a valid byte string already
-        return self._password
+        with self._credentials_lock:
+            if self._password is None or self.is_temporary_credential_expired():
+                self.refresh_temporary_credentials()
+            # noinspection PyBroadException
+            try:
+                self._password = self._password.decode('utf-8')
+            except:
+                pass  # If we cannot decode it it could be a valid byte string already
+            return self._password
 
     def set_password(self, password):
         self._password = password
@@ -148,6 +248,7 @@ class RedshiftCluster:
         self.set_user(response['DbUser'])
         self.set_password(response['DbPassword'])
         self.set_user_creds_expiration(response['Expiration'])
+        self.has_temporary_password = True
 
     @staticmethod
     def get_cluster_endpoint_regex():
@@ -208,14 +309,15 @@ class RedshiftCluster:
     def get_cluster_identifier(self):
         return self.get_element_from_cluster_endpoint('cluster_identifier')
 
-    def _conn_to_rs(self, opt=options, timeout=set_timeout_stmt, database=None):
-        rs_conn_string = "host={host} port={port} dbname={db} user={user} password={password} {opt}".format(
-            host=self.get_host(),
-            port=self.get_port(),
-            db=self.get_db(),
-            password=self.get_password(),  # First fetch the password because temporary password updates user!
-            user=self.get_user(),
-            opt=opt)
+    def _conn_to_rs(self, opt=options, database=None):
+        with self._credentials_lock:
+            rs_conn_string = "host={host} port={port} dbname={db} user={user} password={password} {opt}".format(
+                host=self.get_host(),
+                port=self.get_port(),
+                db=database or self.get_db(),
+                password=self.get_password(),  # First fetch the password because temporary password updates user!
+                user=self.get_user(),
+                opt=opt)
         logging.debug(GET_SAFE_LOG_STRING(rs_conn_string))
         try:
             # noinspection PyArgumentList
@@ -229,51 +331,59 @@ class RedshiftCluster:
             else:
                 logging.fatal('Internal error encountered when trying to connect: {ie}'.format(ie=ie))
             raise sys.exc_info()[0](sys.exc_info()[1]).with_traceback(sys.exc_info()[2])
-        if self._configured_timeout is not None and not self._configured_timeout == timeout:
-            rs_conn.query(timeout)
-            self.database_timeouts[database][opt] = timeout
         return rs_conn
 
-    def get_conn_to_rs(self, opt=options, timeout=set_timeout_stmt, database=None):
+    def new_pooled_connection(self, opt=options, database=None):
+        with self._credentials_lock:
+            rs_conn = self._conn_to_rs(opt=opt, database=database)
+            credentials_expiration = self.get_user_creds_expiration() if self.has_temporary_password else None
+        return PooledConnection(rs_conn, credentials_expiration)
+
+    def get_connection_pool(self, opt=options, database=None):
         database = database or self.get_db()
-        if database in self.database_connections:
-            if opt in self.database_connections[database]:
-                if not (opt in self.database_timeouts[database] and self.database_timeouts[database][opt] == timeout):
-                    logging.debug('Timeout is different from last configured timeout.')
-                    self.database_connections[database][opt].query(timeout)
-                return self.database_connections[database][opt]
-        else:
-            self.database_connections[database] = {}
-            self.database_timeouts[database] = {}
-        self.database_connections[database][opt] = self._conn_to_rs(opt=opt, timeout=timeout, database=database)
-        return self.database_connections[database][opt]
+        with self._connection_pools_lock:
+            if (database, opt) not in self.connection_pools:
+                self.connection_pools[(database, opt)] = ConnectionPool(
+                    self,
+                    database,
+                    opt,
+                    int(config_parameters.get('connectionPoolSize', 4))
+                )
+            return self.connection_pools[(database, opt)]
+
+    @contextmanager
+    def get_conn_to_rs(self, opt=options, timeout=set_timeout_stmt, database=None):
+        """
+        Checks out a connection from the pool of the database for the duration of the with block.  Connections that
+        raise a connection level error are discarded rather than returned to the pool.
+        """
+        pool = self.get_connection_pool(opt=opt, database=database)
+        pooled_connection = pool.checkout(timeout=timeout)
+        discard = False
+        try:
+            yield pooled_connection.connection
+        except (pg.InternalError, pg.OperationalError):
+            discard = True
+            raise
+        finally:
+            pool.checkin(pooled_connection, discard=discard)
 
     def execute_update(self, command, opt=options, timeout=set_timeout_stmt, database=None):
-        conn_rs = self.get_conn_to_rs(opt=opt, timeout=timeout, database=database)
-        logging.debug('Executing update:' + GET_SAFE_LOG_STRING(command))
-        conn_rs.query(command)
+        with self.get_conn_to_rs(opt=opt, timeout=timeout, database=database) as conn_rs:
+            logging.debug('Executing update:' + GET_SAFE_LOG_STRING(command))
+            conn_rs.query(command)
 
     def get_query_full_result_as_list_of_dict(self, sql, opt=options, timeout=set_timeout_stmt, database=None):
         """
         Inefficient way to store data but nice and easy for queries with small result sets.
         :return:
         """
-        conn_rs = self.get_conn_to_rs(opt=opt, timeout=timeout, database=database)
-        logging.debug('Executing query:' + GET_SAFE_LOG_STRING(sql))
-        result = conn_rs.query(sql)
-        dict_result = result.dictresult()
+        with self.get_conn_to_rs(opt=opt, timeout=timeout, database=database) as conn_rs:
+            logging.debug('Executing query:' + GET_SAFE_LOG_STRING(sql))
+            result = conn_rs.query(sql)
+            dict_result = result.dictresult()
         return dict_result
 
     def __del__(self):
-        for database in self.database_connections:
-            for option in self.database_connections[database]:
-                if self.database_connections[database][option] is not None:
-                    # noinspection PyBroadException
-                    try:
-                        self.database_connections[database][option].close()
-                    except:
-                        logging.warning('Could not correctly close self.database_connections{db}{opt}'.format(
-                            db=database,
-                            opt=option
-                        ))
-                    self.database_connections[database][option] = None
+        for pool in self.connection_pools.values():
+            pool.close_all()
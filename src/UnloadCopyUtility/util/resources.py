@@ -1,4 +1,6 @@
 import re
+import datetime
+import decimal
 from abc import abstractmethod
 import logging
 
@@ -8,7 +10,8 @@ from util.redshift_cluster import RedshiftCluster
 from util.sql.ddl_generators import DatabaseDDLHelper, SchemaDDLHelper, TableDDLHelper, DDLTransformer
 from util.sql.sql_text_helpers import SQLTextHelper, GET_SAFE_LOG_STRING
 from global_config import config_parameters
-from util.sql_queries import GET_DATABASE_NAME_OWNER_ACL, GET_SCHEMA_NAME_OWNER_ACL, GET_TABLE_NAME_OWNER_ACL
+from util.sql_queries import GET_DATABASE_NAME_OWNER_ACL, GET_SCHEMA_NAME_OWNER_ACL, GET_TABLE_NAME_OWNER_ACL, \
+    GET_DATABASE_TABLE_NAMES, GET_SCHEMA_TABLE_NAMES, GET_TABLE_FIRST_SORT_KEY_COLUMN
 
 
 global resources
@@ -153,6 +156,7 @@ class DBResource(Resource):
         self.owner = None
         self.acl = None
         self.get_name_owner_acl_sql = GET_DATABASE_NAME_OWNER_ACL
+        self.get_table_names_sql = GET_DATABASE_TABLE_NAMES
 
     def get_db(self):
         return self._cluster.get_db()
@@ -200,6 +204,15 @@ class DBResource(Resource):
             return False
         return self.name is not None
 
+    def get_table_resources(self):
+        """
+        Lists the tables that are part of this resource with a single catalog query.
+        :return: list of TableResource objects on the cluster of this resource
+        """
+        get_tables_sql = self.get_query_sql_text_with_parameters_replaced(self.get_table_names_sql)
+        result = self.get_cluster().get_query_full_result_as_list_of_dict(get_tables_sql)
+        return [TableResource(self.get_cluster(), r['schema_name'], r['table_name']) for r in result]
+
     def get_statement_to_retrieve_ddl_create_statement_text(self):
         return DatabaseDDLHelper().get_database_ddl_SQL(database_name=self.get_db())
 
@@ -210,7 +223,8 @@ class DBResource(Resource):
         command_parameters = command_parameters or dict()
         command_parameters['cluster'] = self.get_cluster()
         command_to_execute = self.commands[command]
-        if 'region' in command_parameters and command == 'copy_table' and command_parameters['region'] is not None:
+        if 'region' in command_parameters and command.startswith('copy_table') \
+                and command_parameters['region'] is not None:
             command_to_execute += " REGION '{region}' "
         update_sql_command = command_to_execute.format(**command_parameters)
         logging.info('Executing {command} against {resource}:'.format(command=command, resource=self))
@@ -228,6 +242,7 @@ class SchemaResource(DBResource, ChildObject):
         self.parent = DBResource(rs_cluster)
         self._schema = schema
         self.get_name_owner_acl_sql = GET_SCHEMA_NAME_OWNER_ACL
+        self.get_table_names_sql = GET_SCHEMA_TABLE_NAMES
 
     def get_schema(self):
         return self._schema
@@ -265,12 +280,12 @@ class SchemaResource(DBResource, ChildObject):
 
 
 class TableResource(SchemaResource):
-    unload_table_stmt = """unload ('SELECT {columns} FROM {schema_name}.{table_name}')
+    unload_table_stmt = """unload ('SELECT {columns} FROM {schema_name}.{table_name}{where_clause}')
                      to '{dataStagingPath}.' credentials 
                      '{s3_access_credentials};master_symmetric_key={master_symmetric_key}'
                      manifest
                      encrypted
-                     gzip
+                     {compression}
                      null as 'NULL_STRING__'
                      delimiter '^' addquotes escape allowoverwrite"""
 
@@ -279,15 +294,32 @@ class TableResource(SchemaResource):
                    '{s3_access_credentials};master_symmetric_key={master_symmetric_key}'
                    manifest 
                    encrypted
-                   gzip 
+                   {compression} 
                    null as 'NULL_STRING__'
                    {explicit_ids}
                    dateformat 'auto'
                    timeformat 'auto'
                    delimiter '^' removequotes escape compupdate off """
 
+    unload_table_parquet_stmt = """unload ('SELECT {columns} FROM {schema_name}.{table_name}{where_clause}')
+                     to '{dataStagingPath}.' credentials 
+                     '{s3_access_credentials}'
+                     manifest
+                     format as parquet
+                     allowoverwrite"""
+
+    copy_table_parquet_stmt = """copy {schema_name}.{table_name} {columns}
+                   from '{dataStagingPath}.manifest' credentials 
+                   '{s3_access_credentials}'
+                   manifest 
+                   format as parquet
+                   {explicit_ids} """
+
     drop_table_stmt = """DROP TABLE {schema_name}.{table_name}"""
 
+    partition_range_stmt = """SELECT MIN({column}) AS min_value, MAX({column}) AS max_value
+                            FROM {schema_name}.{table_name}"""
+
     def __init__(self, rs_cluster, schema, table):
         SchemaResource.__init__(self, rs_cluster, schema)
         self.parent = SchemaResource(rs_cluster, schema)
@@ -295,9 +327,12 @@ class TableResource(SchemaResource):
         self.get_name_owner_acl_sql = GET_TABLE_NAME_OWNER_ACL
         self.commands['unload_table'] = TableResource.unload_table_stmt
         self.commands['copy_table'] = TableResource.copy_table_stmt
+        self.commands['unload_table_parquet'] = TableResource.unload_table_parquet_stmt
+        self.commands['copy_table_parquet'] = TableResource.copy_table_parquet_stmt
         self.commands['drop_table'] = TableResource.drop_table_stmt
         self.columns = None
         self.explicit_ids = False  # Only relevant to copy command
+        self.partition_predicates = None
 
     def __eq__(self, other):
         return type(self) == type(other) and \
@@ -310,6 +345,9 @@ class TableResource(SchemaResource):
     def get_statement_to_retrieve_ddl_create_statement_text(self):
         return TableDDLHelper().get_table_ddl_SQL(table_name=self.get_table(), schema_name=self.get_schema())
 
+    def get_table_resources(self):
+        return [self]
+
     def get_table(self):
         return self._table
 
@@ -321,13 +359,20 @@ class TableResource(SchemaResource):
         command_parameters['table_name'] = self.get_table()
         super(TableResource, self).run_command_against_resource(command, command_parameters)
 
-    def unload_data(self, s3_details):
+    def unload_data(self, s3_details, partition=None):
+        """
+        :param partition: index of the key range to unload, requires set_partitions.  None unloads the whole table.
+        """
+        where_clause = ''
+        if partition is not None:
+            where_clause = ' WHERE ' + self.partition_predicates[partition]
         unload_parameters = {'s3_access_credentials': s3_details.access_credentials,
                              'master_symmetric_key': s3_details.symmetric_key,
                              'dataStagingPath': s3_details.dataStagingPath,
                              'region': s3_details.dataStagingRegion,
-                             'columns': self.columns or '*'}
-        self.run_command_against_resource('unload_table', unload_parameters)
+                             'columns': self.columns or '*',
+                             'where_clause': where_clause}
+        self.run_command_against_resource(*self.get_command_for_staging_format('unload_table', unload_parameters))
 
     def copy_data(self, s3_details):
         copy_parameters = {'s3_access_credentials': s3_details.access_credentials,
@@ -337,7 +382,19 @@ class TableResource(SchemaResource):
                            'columns': self.columns or '',
                            'explicit_ids': 'explicit_ids' if self.explicit_ids else ''}
 
-        self.run_command_against_resource('copy_table', copy_parameters)
+        self.run_command_against_resource(*self.get_command_for_staging_format('copy_table', copy_parameters))
+
+    @staticmethod
+    def get_command_for_staging_format(command, command_parameters):
+        """
+        Delimited text is compressed with the configured stagingFormat, parquet has its own command as it is
+        compressed, typed and encrypted (server-side) by Redshift itself.
+        """
+        staging_format = str(config_parameters.get('stagingFormat', 'GZIP')).upper()
+        if staging_format == 'PARQUET':
+            return command + '_parquet', command_parameters
+        command_parameters['compression'] = staging_format
+        return command, command_parameters
 
     def clone_structure_from(self, other):
         ddl = other.get_create_sql(generate=True)
@@ -359,6 +416,72 @@ class TableResource(SchemaResource):
     def set_explicit_ids(self, explicit_ids):
         self.explicit_ids = explicit_ids
 
+    def get_partition_column(self):
+        if config_parameters.get('unloadPartitionColumn', 'None') != 'None':
+            return config_parameters['unloadPartitionColumn']
+        get_sort_key_sql = self.get_query_sql_text_with_parameters_replaced(GET_TABLE_FIRST_SORT_KEY_COLUMN)
+        result = self.get_cluster().get_query_full_result_as_list_of_dict(get_sort_key_sql)
+        if len(result) == 0:
+            raise TableResource.PartitioningNotPossibleException(
+                self, 'it has no sort key and no unloadPartitionColumn is configured')
+        return result[0]['name']
+
+    def set_partitions(self, partitions):
+        """
+        Splits the table in key ranges of equal width between the minimum and maximum value of the partition column,
+        which is the first sort key column unless unloadPartitionColumn is configured, so that each range can be
+        unloaded on its own.
+        :param partitions: number of key ranges
+        """
+        column = '"{c}"'.format(c=self.get_partition_column().replace('"', '""'))
+        result = self.get_cluster().get_query_full_result_as_list_of_dict(self.partition_range_stmt.format(
+            column=column,
+            schema_name=self.get_schema(),
+            table_name=self.get_table()
+        ))
+        self.partition_predicates = TableResource.get_range_predicates(column,
+                                                                       result[0]['min_value'],
+                                                                       result[0]['max_value'],
+                                                                       partitions)
+        logging.info('Key ranges of {self}: {p}'.format(self=self, p=self.partition_predicates))
+
+    @staticmethod
+    def get_range_predicates(column, min_value, max_value, partitions):
+        """
+        Predicates that together select every row exactly once, as they appear in the query text of an unload
+        statement (literals are quoted twice).  Rows with a NULL key are part of the first range.
+        """
+        if min_value is None or partitions == 1:
+            # the table is empty or the column only has NULL values
+            return ['({c} IS NULL OR {c} IS NOT NULL)'.format(c=column)] + ['1 = 0'] * (partitions - 1)
+
+        if isinstance(min_value, bool) or \
+                not isinstance(min_value, (int, float, decimal.Decimal, datetime.date)):
+            raise TableResource.PartitioningNotPossibleException(
+                None, 'partition column {c} is not numeric, date or timestamp'.format(c=column))
+
+        if isinstance(min_value, int):
+            bounds = [min_value + (max_value - min_value) * p // partitions for p in range(1, partitions)]
+        else:
+            bounds = [min_value + (max_value - min_value) * p / partitions for p in range(1, partitions)]
+
+        if isinstance(min_value, datetime.date):
+            bounds = ["''{b}''".format(b=b) for b in bounds]
+        else:
+            bounds = [str(b) for b in bounds]
+
+        predicates = ['({c} < {b} OR {c} IS NULL)'.format(c=column, b=bounds[0])]
+        for lower, upper in zip(bounds, bounds[1:]):
+            predicates.append('({c} >= {l} AND {c} < {u})'.format(c=column, l=lower, u=upper))
+        predicates.append('({c} >= {b})'.format(c=column, b=bounds[-1]))
+        return predicates
+
+    class PartitioningNotPossibleException(Exception):
+        def __init__(self, resource, reason):
+            super(TableResource.PartitioningNotPossibleException, self).__init__(
+                'Cannot split {r} in key ranges: {reason}'.format(r=resource, reason=reason))
+
+
 class ResourceFactory:
     def __init__(self):
         pass
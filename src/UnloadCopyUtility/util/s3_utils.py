@@ -1,4 +1,5 @@
 import base64
+import copy
 import datetime
 import json
 import logging
@@ -49,7 +50,8 @@ class S3Helper:
 
     def delete_s3_prefix(self, s3_details):
         print("Cleaning up S3 Data Staging Location %s" % s3_details.dataStagingPath)
-        (stagingBucket, stagingPrefix) = S3Helper.tokenize_s3_path(s3_details.dataStagingRoot)
+        # only the files of this table, the staging root is shared by tables of the same name in other schemas
+        (stagingBucket, stagingPrefix) = S3Helper.tokenize_s3_path(s3_details.dataStagingPath + '.')
 
         objects = self.s3_client.list_objects_v2(Bucket=stagingBucket, Prefix=stagingPrefix)
         if objects['KeyCount'] > 0:
@@ -62,6 +64,14 @@ class S3Helper:
                 keys_to_delete.append(s3_object['Key'])
             self.delete_list_of_keys_from_bucket(keys_to_delete, stagingBucket)
 
+    def get_size_of_staged_data(self, s3_details):
+        (stagingBucket, stagingPrefix) = S3Helper.tokenize_s3_path(s3_details.dataStagingPath + '.')
+        size = 0
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=stagingBucket, Prefix=stagingPrefix):
+            size += sum(s3_object['Size'] for s3_object in page.get('Contents', []))
+        return size
+
     @staticmethod
     def tokenize_s3_path(path):
         path_elements = path.split('/')
@@ -164,3 +174,15 @@ class S3Details:
                 self.symmetric_key = self.symmetric_key.decode('utf-8')
             except:
                 logging.debug('Exception converting string can be ignored, likely Python2 so already a string.')
+
+    def get_partition_s3_details(self, partition):
+        """
+        S3 details for one key range of a partitioned table, which is staged under a prefix of its own with its own
+        manifest.  The prefix is within the staging path of the table, so cleaning up the table cleans up the range.
+        """
+        partition_s3_details = copy.copy(self)
+        partition_s3_details.dataStagingPath = '{path}.part_{partition:04d}'.format(
+            path=self.dataStagingPath,
+            partition=partition
+        )
+        return partition_s3_details
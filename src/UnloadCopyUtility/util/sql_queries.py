@@ -32,3 +32,38 @@ GET_TABLE_NAME_OWNER_ACL = """
   WHERE pc.relname = '{table}'
   AND pn.nspname = '{schema}'; 
 """
+GET_SCHEMA_TABLE_NAMES = """
+  SELECT
+    pn.nspname AS schema_name,
+    pc.relname AS table_name
+  FROM pg_class pc
+  JOIN pg_namespace pn
+  ON pc.relnamespace = pn.oid
+  WHERE pc.relkind = 'r'
+  AND pn.nspname = '{schema}'
+  ORDER BY pn.nspname, pc.relname;
+"""
+GET_DATABASE_TABLE_NAMES = """
+  SELECT
+    pn.nspname AS schema_name,
+    pc.relname AS table_name
+  FROM pg_class pc
+  JOIN pg_namespace pn
+  ON pc.relnamespace = pn.oid
+  WHERE pc.relkind = 'r'
+  AND pn.nspname NOT LIKE 'pg_%'
+  AND pn.nspname <> 'information_schema'
+  ORDER BY pn.nspname, pc.relname;
+"""
+GET_TABLE_FIRST_SORT_KEY_COLUMN = """
+  SELECT
+    pa.attname AS name
+  FROM pg_attribute pa
+  JOIN pg_class pc
+  ON pa.attrelid = pc.oid
+  JOIN pg_namespace pn
+  ON pc.relnamespace = pn.oid
+  WHERE pc.relname = '{table}'
+  AND pn.nspname = '{schema}'
+  AND ABS(pa.attsortkeyord) = 1;
+"""
@@ -1,11 +1,12 @@
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
 import uuid
 import sys
-import time
 import copy
 import logging
 from global_config import config_parameters
-from util.resources import Resource
+from util.resources import Resource, TableResource
 from util.s3_utils import S3Helper
 
 
@@ -42,31 +43,77 @@ class TaskManager(object):
         def __init__(self):
             super(TaskManager.DuplicateTaskException, self).__init__()
 
-    def run(self):
-        while len(self.tasks.keys()) > 0:
-            tasks_clone = self.tasks.copy()
-            for task_id in tasks_clone.keys():
-                self.remove_fulfilled_dependencies(task_id)
-                if len(self.tasks[task_id].dependencies) == 0:
-                    task = self.tasks.pop(task_id)
+    class UnknownDependencyException(Exception):
+        def __init__(self, task, dependency):
+            super(TaskManager.UnknownDependencyException, self).__init__(
+                'Task {t} depends on {d} which is not a task of this TaskManager'.format(t=task, d=dependency))
+
+    def run(self, workers=None):
+        """
+        Executes all tasks on a pool of worker threads.  Each task keeps a count of its unmet dependencies and is
+        dispatched as soon as that count drops to zero, so independent chains of tasks (e.g. the unload of one table
+        and the copy of another) run at the same time.
+        :param workers: number of tasks that can run concurrently, defaults to the taskWorkers config parameter
+        """
+        if workers is None:
+            workers = int(config_parameters.get('taskWorkers', 1))
+        if workers < 1:
+            raise ValueError('The number of task workers must be at least 1, got {w}'.format(w=workers))
+
+        dependents = {}
+        ready = deque()
+        for task_id in list(self.tasks.keys()):
+            self.remove_fulfilled_dependencies(task_id)
+            for dependency in self.tasks[task_id].dependencies:
+                if dependency not in self.tasks:
+                    raise TaskManager.UnknownDependencyException(self.tasks[task_id], dependency)
+                dependents.setdefault(dependency, []).append(task_id)
+            if len(self.tasks[task_id].dependencies) == 0:
+                ready.append(task_id)
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(ready) > 0 or len(running) > 0:
+                while len(ready) > 0 and len(running) < workers:
+                    task = self.tasks.pop(ready.popleft())
+                    logging.debug('Dispatching task {t}'.format(t=task))
+                    running[executor.submit(task.execute)] = task
+
+                done, not_done = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
                     # noinspection PyBroadException
                     try:
-                        task.execute()
+                        future.result()
                         self.mark_task_as_succeeded(task)
                     except Exception as e:
                         logging.warning(e)
+                        if task.retries > 0:
+                            task.retries -= 1
+                            logging.warning('Retrying task {t}, {n} retries left.'.format(t=task, n=task.retries))
+                            self.tasks[task.task_id] = task
+                            ready.append(task.task_id)
+                            continue
                         self.mark_task_as_failed(task)
                         if config_parameters['failOnError']:
                             logging.fatal('Task {t} fails and failOnError is True.'.format(t=task))
                             sys.exit(2)
-                else:
-                    logging.debug('Task {t} has {n} unmet dependencies.'.format(
-                        t=self.tasks[task_id],
-                        n=len(self.tasks[task_id].dependencies)
-                    ))
-                    for dependency in self.tasks[task_id].dependencies:
-                        logging.debug('\t{d}'.format(d=dependency))
-            time.sleep(1)
+
+                    for dependent_id in dependents.pop(task.task_id, []):
+                        self.remove_fulfilled_dependencies(dependent_id)
+                        if len(self.tasks[dependent_id].dependencies) == 0:
+                            ready.append(dependent_id)
+                        else:
+                            logging.debug('Task {t} has {n} unmet dependencies.'.format(
+                                t=self.tasks[dependent_id],
+                                n=len(self.tasks[dependent_id].dependencies)
+                            ))
+
+        # tasks that are left over depend on each other in a cycle and can never become ready
+        for task_id in list(self.tasks.keys()):
+            task = self.tasks.pop(task_id)
+            logging.error('Task {t} has circular dependencies and was not executed.'.format(t=task))
+            self.mark_task_as_failed(task)
 
     def remove_fulfilled_dependencies(self, task_id):
         for dependency in self.tasks[task_id].dependencies.copy():
@@ -131,6 +178,7 @@ class Task(object):
         self.dependencies = DependencyList()
         self.task_id = uuid.uuid4()
         self.has_failed = False
+        self.retries = 0
 
     @abstractmethod
     def execute(self):
@@ -182,7 +230,7 @@ class CreateIfTargetDoesNotExistTask(Task):
                                                              s3_details=None)
 
     def execute(self):
-        if config_parameters['destinationTableForceDropCreate']:
+        if isinstance(self.target_resource, TableResource) and config_parameters['destinationTableForceDropCreate']:
             logging.info('Dropping target table {tbl}'.format(tbl=str(self.target_resource)))
             self.target_resource.drop()
 
@@ -192,15 +240,28 @@ class CreateIfTargetDoesNotExistTask(Task):
             self.target_resource.create()
 
 
+class PartitionTableTask(Task):
+    def __init__(self, cluster_resource, partitions):
+        super(PartitionTableTask, self).__init__(source_resource=cluster_resource,
+                                                 target_resource=None,
+                                                 s3_details=None)
+        self.partitions = partitions
+
+    def execute(self):
+        logging.info("Splitting Source in {n} key ranges ({t})".format(n=self.partitions, t=self))
+        self.source_resource.set_partitions(self.partitions)
+
+
 class UnloadDataToS3Task(Task):
-    def __init__(self, cluster_resource, s3_details):
+    def __init__(self, cluster_resource, s3_details, partition=None):
         super(UnloadDataToS3Task, self).__init__(source_resource=cluster_resource,
                                                  target_resource=None,
                                                  s3_details=s3_details)
+        self.partition = partition
 
     def execute(self):
         logging.info("Exporting from Source ({t})".format(t=self))
-        self.source_resource.unload_data(self.s3_details)
+        self.source_resource.unload_data(self.s3_details, partition=self.partition)
 
 
 class CopyDataFromS3Task(Task):
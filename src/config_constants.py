@@ -48,6 +48,23 @@ SYSTABLE_CLEANUP_AFTER_DAYS = "systable_cleanup_after_days"
 STATEMENT_TIMEOUT = "statement_timeout"
 S3_UNLOAD_LOCATION = "s3_unload_location"
 S3_UNLOAD_ROLE_ARN = "s3_unload_role_arn"
+ANALYZE_CACHE = "analyze_cache"
+ANALYZE_CACHE_TTL = "analyze_cache_ttl"
+JOURNAL = "journal"
+RESUME = "resume"
+MAX_DISK_PCT = "max_disk_pct"
+ALTER_IN_PLACE = "alter_in_place"
+MIN_SAVINGS_PCT = "min_savings_pct"
+SAVINGS_BUDGET_MB = "savings_budget_mb"
+PLAN_OUTPUT = "plan_output"
+COPY_CHUNKS = "copy_chunks"
+ANALYZE_PARALLELISM = "analyze_parallelism"
+TIME_BUDGET = "time_budget"
+DURATION_MODEL = "duration_model"
+ANALYZE_INTERVAL = "analyze_interval"
+VACUUM_PROGRESS_INTERVAL = "vacuum_progress_interval"
+ANALYZE_USED_COLS = "analyze_used_cols"
+MIN_VACUUM_BENEFIT_PCT = "min_vacuum_benefit_pct"
 
 config_aliases = {
     "db": ["db", "DatabaseName"],
@@ -71,6 +88,23 @@ config_aliases = {
     "ssl": ["ssl-option", 'require-ssl'],
     "blacklisted_tables": ["blacklistedTables"],
     "agg_interval": ["aggregationInterval"],
+    "analyze_cache": ["analyzeCache"],
+    "analyze_cache_ttl": ["analyzeCacheTTL"],
+    "journal": ["journalFile"],
+    "resume": ["resumeJournal"],
+    "max_disk_pct": ["maxDiskPct"],
+    "alter_in_place": ["alterInPlace"],
+    "min_savings_pct": ["minSavingsPct"],
+    "savings_budget_mb": ["savingsBudgetMB"],
+    "plan_output": ["planOutput"],
+    "copy_chunks": ["copyChunks"],
+    "analyze_parallelism": ["analyzeParallelism"],
+    "time_budget": ["timeBudget"],
+    "duration_model": ["durationModel"],
+    "analyze_interval": ["analyzeInterval"],
+    "vacuum_progress_interval": ["vacuumProgressInterval"],
+    "analyze_used_cols": ["analyzeUsedCols"],
+    "min_vacuum_benefit_pct": ["minVacuumBenefitPct"],
 }
 
 
@@ -121,6 +155,23 @@ def normalise_config(config):
     add_to_config(SYSTABLE_CLEANUP_AFTER_DAYS)
     add_to_config(S3_UNLOAD_LOCATION)
     add_to_config(S3_UNLOAD_ROLE_ARN)
+    add_to_config(ANALYZE_CACHE)
+    add_to_config(ANALYZE_CACHE_TTL)
+    add_to_config(JOURNAL)
+    add_to_config(RESUME)
+    add_to_config(MAX_DISK_PCT)
+    add_to_config(ALTER_IN_PLACE)
+    add_to_config(MIN_SAVINGS_PCT)
+    add_to_config(SAVINGS_BUDGET_MB)
+    add_to_config(PLAN_OUTPUT)
+    add_to_config(COPY_CHUNKS)
+    add_to_config(ANALYZE_PARALLELISM)
+    add_to_config(TIME_BUDGET)
+    add_to_config(DURATION_MODEL)
+    add_to_config(ANALYZE_INTERVAL)
+    add_to_config(VACUUM_PROGRESS_INTERVAL)
+    add_to_config(ANALYZE_USED_COLS)
+    add_to_config(MIN_VACUUM_BENEFIT_PCT)
 
     return config_out
 